@@ -6,10 +6,74 @@ Like kernel's routing decision tree - clear paths, no complex logic
 """
 
 import random
-from typing import List, Optional, Tuple
-from core_data import (Wand, GameState, MagicType, DefenseRule,
-                      RuleAction, RuleChain)
-from spell_database import lookup_spell, get_top_damage_combos, get_healing_combos
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+from core_data import (Wand, GameState, MagicType, DefenseRule, EssenceBuffer,
+                      RuleAction, RuleChain, Spell, element_counts, pack_magic)
+from spell_database import (lookup_spell, lookup_spell_code,
+                            get_top_damage_combos, get_healing_combos)
+
+
+# Combo plans for buffer-wide decisions - built once at import.
+# Each plan: (7-slot element counts, essence count, damage or heal amount)
+DAMAGE_PLANS = [(element_counts(elements), len(elements), damage)
+                for elements, name, damage in get_top_damage_combos()]
+HEALING_PLANS = [(element_counts(elements), len(elements), heal)
+                 for elements, name, heal in get_healing_combos()]
+WATER_BIT = 1 << (MagicType.WATER - 1)  # EssenceBuffer.mask bit
+
+
+# ============================================================================
+# Buffer Scanner - Shared "discard i, then cast k" evaluator
+# ============================================================================
+
+class CastOption(NamedTuple):
+    """
+    One reachable cast
+
+    Data:
+        discard: Buffer index to discard first (None = cast as-is)
+        count: Essences to cast from the front (1-3)
+        spell: Spell that cast produces
+    """
+    discard: Optional[int]
+    count: int
+    spell: Spell
+
+
+@lru_cache(maxsize=None)
+def _ranked_options(window: int) -> Tuple[CastOption, ...]:
+    """All options for a packed 4-essence window, best damage first"""
+    codes = []
+    while window:
+        codes.append(window & 7)
+        window >>= 3
+
+    options = []
+    for discard in [None] + list(range(min(3, len(codes)))):
+        remaining = codes if discard is None else codes[:discard] + codes[discard + 1:]
+        for count in range(1, min(3, len(remaining)) + 1):
+            spell = lookup_spell_code(pack_magic(remaining[:count]))
+            options.append(CastOption(discard, count, spell))
+
+    # Ties: no discard (saves 5 CPU) first, then more essences
+    options.sort(key=lambda o: (-o.spell.damage, o.discard is not None, -o.count))
+    return tuple(options)
+
+
+def scan_buffer(buffer: EssenceBuffer) -> Tuple[CastOption, ...]:
+    """
+    Rank every "discard index i (or nothing), then cast k" option, best
+    damage first. Like a route lookup: the answer is cached per key.
+
+    A cast only reads the first 3 essences, so discarding index 3 or later
+    leaves every cast unchanged - those options are the discard=None ones.
+    That makes the front 4 essences the whole key, and the per-turn cost
+    one dict hit regardless of buffer size.
+
+    Returns: Options sorted by spell damage (heals last)
+    """
+    return _ranked_options(buffer.peek_code(4))
 
 
 # ============================================================================
@@ -24,11 +88,13 @@ class AIStrategy:
         name: AI opponent name
         difficulty: 1-6 (difficulty level)
         description: What this AI does
+        rng: Random source for randomized decisions
     """
     def __init__(self, name: str, difficulty: int, description: str):
         self.name = name
         self.difficulty = difficulty
         self.description = description
+        self.rng = random
 
     def configure_defenses(self, state: GameState, my_wand: Wand) -> List[DefenseRule]:
         """
@@ -83,7 +149,7 @@ class PassiveAI(AIStrategy):
 
         # Random cast 1 or 2 essences (if available)
         max_cast = min(my_wand.buffer.count, 2)
-        return random.randint(1, max_cast)
+        return self.rng.randint(1, max_cast)
 
 
 # ============================================================================
@@ -133,8 +199,9 @@ class DefensiveAI(AIStrategy):
 
         # If low HP (<50), try to heal
         if my_wand.hp < 50 and my_wand.buffer.count >= 2:
-            # Check if we have water for healing
-            if MagicType.WATER in my_wand.buffer.essences[:3]:
+            # Water for healing? The mask rules it out before the slice
+            if (my_wand.buffer.mask & WATER_BIT and
+                    MagicType.WATER in my_wand.buffer.essences[:3]):
                 return 2  # Try for healing combo
 
         # Otherwise cast conservatively (1-2)
@@ -245,7 +312,8 @@ class BalancedAI(AIStrategy):
 
         # Emergency heal if very low HP (<30)
         if my_wand.hp < 30 and my_wand.buffer.count >= 2:
-            if MagicType.WATER in my_wand.buffer.essences[:3]:
+            if (my_wand.buffer.mask & WATER_BIT and
+                    MagicType.WATER in my_wand.buffer.essences[:3]):
                 return 2  # Try healing combo
 
         # Check for good 3-element combo
@@ -301,7 +369,7 @@ class AdaptiveAI(AIStrategy):
             return []
 
         # Remove old rules
-        my_wand.rules.rules.clear()
+        my_wand.rules.clear()
 
         # Always block Dark
         rules = [
@@ -317,8 +385,8 @@ class AdaptiveAI(AIStrategy):
         enemy_wand = state.player if my_wand == state.enemy else state.enemy
         if enemy_wand.buffer.count > 0:
             # Count elements in enemy buffer (what they're building)
-            for essence in enemy_wand.buffer.essences:
-                self.player_element_count[essence] += 1
+            for magic in MagicType:
+                self.player_element_count[magic] += enemy_wand.buffer.count_of(magic)
 
             # Block their most common element
             most_common = max(self.player_element_count.items(),
@@ -351,7 +419,8 @@ class AdaptiveAI(AIStrategy):
         elif hp_diff < -20:
             # Try to heal or defend
             if my_wand.hp < 40 and my_wand.buffer.count >= 2:
-                if MagicType.WATER in my_wand.buffer.essences[:3]:
+                if (my_wand.buffer.mask & WATER_BIT and
+                        MagicType.WATER in my_wand.buffer.essences[:3]):
                     return 2  # Healing combo
             return 1  # Conserve essence
 
@@ -406,7 +475,7 @@ class ExpertAI(AIStrategy):
         if state.turn.turn_number - self.turn_last_configured < 2:
             return []
 
-        my_wand.rules.rules.clear()
+        my_wand.rules.clear()
 
         # Always block Dark and Fire
         rules = [
@@ -442,73 +511,45 @@ class ExpertAI(AIStrategy):
         # Critical heal (<25 HP)
         if my_wand.hp < 25:
             # Try for best healing combo
-            healing_combos = get_healing_combos()
-            for elements, name, heal in healing_combos:
-                if len(elements) <= my_wand.buffer.count:
+            for needed, length, heal in HEALING_PLANS:
+                if length <= my_wand.buffer.count:
                     # Check if we have these elements
-                    if self._has_elements(my_wand, elements):
+                    if my_wand.buffer.has_all(needed):
                         # Rearrange buffer to get this combo
-                        return len(elements)
+                        return length
             # Fall back to any water
-            if MagicType.WATER in my_wand.buffer.essences:
+            if my_wand.buffer.count_of(MagicType.WATER):
                 return 2
 
         # Lethal damage check
         if enemy_wand.hp <= 45:
             # Try for killing blow
-            damage_combos = get_top_damage_combos()
-            for elements, name, damage in damage_combos:
-                if damage >= enemy_wand.hp and len(elements) <= my_wand.buffer.count:
-                    if self._has_elements(my_wand, elements):
-                        return len(elements)
+            for needed, length, damage in DAMAGE_PLANS:
+                if damage >= enemy_wand.hp and length <= my_wand.buffer.count:
+                    if my_wand.buffer.has_all(needed):
+                        return length
 
-        # Optimal combo planning
+        # Optimal combo planning - best damaging cast from the buffer as-is
         if my_wand.buffer.count >= 3:
-            # Check all possible 3-element combos from buffer
-            best_damage = 0
-            best_count = 0
-
-            for count in [3, 2, 1]:
-                if my_wand.buffer.count >= count:
-                    elements = my_wand.buffer.essences[:count]
-                    spell = lookup_spell(elements)
-                    if spell.damage > best_damage:
-                        best_damage = spell.damage
-                        best_count = count
-
-            if best_count > 0:
-                return best_count
+            for option in scan_buffer(my_wand.buffer):
+                if option.discard is None:
+                    if option.spell.damage > 0:
+                        return option.count
+                    break
 
         return 1 if my_wand.buffer.count > 0 else None
 
     def should_discard(self, state: GameState, my_wand: Wand) -> Optional[int]:
         # Discard strategically to build better combos
         if my_wand.buffer.count > 6:
-            # Find worst positioned element
-            for i in range(my_wand.buffer.count):
-                # Check if removing this improves next combo
-                temp_buffer = my_wand.buffer.essences.copy()
-                temp_buffer.pop(i)
-
-                if len(temp_buffer) >= 2:
-                    new_spell = lookup_spell(temp_buffer[:2])
-                    old_spell = lookup_spell(my_wand.buffer.essences[:2])
-
-                    if new_spell.damage > old_spell.damage:
-                        return i
+            # Best option overall needs a discard only if it beats every
+            # cast available without one (ties rank no-discard first)
+            best = scan_buffer(my_wand.buffer)[0]
+            if best.discard is not None:
+                return best.discard
 
         return None
 
-    def _has_elements(self, wand: Wand, needed: List[MagicType]) -> bool:
-        """Check if wand buffer contains needed elements (order doesn't matter)"""
-        buffer_copy = wand.buffer.essences.copy()
-        for element in needed:
-            if element in buffer_copy:
-                buffer_copy.remove(element)
-            else:
-                return False
-        return True
-
 
 # ============================================================================
 # AI Factory - Create AI by difficulty
@@ -524,12 +565,13 @@ AI_LEVELS = {
 }
 
 
-def create_ai(difficulty: int) -> AIStrategy:
+def create_ai(difficulty: int, rng: Optional[random.Random] = None) -> AIStrategy:
     """
     Create AI opponent of specified difficulty
 
     Args:
         difficulty: 1-6 (Passive to Expert)
+        rng: Random source (default: global random module)
 
     Returns:
         AI strategy instance
@@ -537,7 +579,10 @@ def create_ai(difficulty: int) -> AIStrategy:
     if difficulty not in AI_LEVELS:
         difficulty = 4  # Default to balanced
 
-    return AI_LEVELS[difficulty]()
+    ai = AI_LEVELS[difficulty]()
+    if rng is not None:
+        ai.rng = rng
+    return ai
 
 
 def list_ai_opponents():
@@ -0,0 +1,687 @@
+"""
+Microbenchmarks for Kernel Duel hot paths
+
+Run: python3 benchmarks.py
+Each bench prints per-operation cost so changes can be compared
+before/after on the same machine.
+"""
+
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import timeit
+from typing import List
+
+from ai_opponents import scan_buffer
+from core_data import (EssenceBuffer, MagicType, DefenseRule, RuleAction,
+                       RuleChain, Spell, Wand, pack_magic)
+from game_engine import (BatchedMagicSource, RandomMagicSource,
+                         apply_incoming_magic, generate_incoming_magic,
+                         process_prerouting)
+from matchmaking import MatchQueue
+from metrics import Metrics
+from multiplayer_server import GameRoom, MultiplayerServer, Outbox, RoomPool, StateFrame
+from replay import replay_match
+from replay_log import INCOMING, RESOLVE, ReplayLog, read_matches
+from room_snapshot import RoomSnapshot, new_tokens, pack_room, unpack_room, write_snapshot
+from network_protocol import CLIENT_WIRE, SERVER_WIRE, ProtocolError, decode_client_frame
+from simulator import play_match
+from timer_wheel import TimerWheel
+from spell_database import SPELL_DATA, lookup_spell, lookup_spell_code
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def _per_op_ns(stmt, number: int, repeat: int = 5) -> float:
+    """Best-of-N nanoseconds per call of stmt()"""
+    best = min(timeit.repeat(stmt, number=number, repeat=repeat))
+    return best / number * 1e9
+
+
+def _report(title: str, rows: List[tuple]):
+    """Print a small results table: (label, ns_per_op)"""
+    print(f"{title}:")
+    baseline = rows[0][1]
+    for label, ns in rows:
+        print(f"  {label:<28} {ns:8.1f} ns/op  ({baseline / ns:4.1f}x)")
+    print()
+
+
+# ============================================================================
+# EssenceBuffer - in-place list vs the original list implementation
+# ============================================================================
+
+class _ListEssenceBuffer:
+    """The original EssenceBuffer (rebuilds its list on every consume), kept as a baseline"""
+    def __init__(self, capacity: int = 10):
+        self.capacity = capacity
+        self.essences: List[MagicType] = []
+        self.overflow_count = 0
+
+    def add(self, magic: MagicType) -> bool:
+        if len(self.essences) < self.capacity:
+            self.essences.append(magic)
+            return True
+        self.overflow_count += 1
+        return False
+
+    def consume(self, count: int) -> List[MagicType]:
+        if count > len(self.essences):
+            count = len(self.essences)
+        consumed = self.essences[:count]
+        self.essences = self.essences[count:]
+        return consumed
+
+    def discard(self, index: int) -> bool:
+        if 0 <= index < len(self.essences):
+            self.essences.pop(index)
+            return True
+        return False
+
+
+def bench_essence_buffer(turns: int = 20000):
+    """
+    One duel turn: 3 essences in, discard one, cast 2
+
+    The baseline list keeps nothing but the essences. EssenceBuffer also
+    keeps its histogram and presence mask current on every change, which
+    is what lets AI queries skip walking the buffer.
+    """
+    stream = [random.choice(list(MagicType)) for _ in range(3 * 64)]
+
+    def run(buf_cls, cast):
+        def turn_loop():
+            buf = buf_cls()
+            n = len(stream)
+            for t in range(turns):
+                base = (t * 3) % n
+                buf.add(stream[base])
+                buf.add(stream[(base + 1) % n])
+                buf.add(stream[(base + 2) % n])
+                buf.discard(1)
+                cast(buf)
+        return turn_loop
+
+    rows = [
+        ("list consume()", run(_ListEssenceBuffer, lambda b: b.consume(2))),
+        ("in-place consume()", run(EssenceBuffer, lambda b: b.consume(2))),
+        ("in-place pull() (no alloc)", run(EssenceBuffer, lambda b: b.pull(2))),
+    ]
+    _report(f"EssenceBuffer turn ({turns} turns)",
+            [(label, _per_op_ns(fn, number=1) / turns) for label, fn in rows])
+
+
+# ============================================================================
+# PREROUTING - compiled verdict table vs linear rule scan
+# ============================================================================
+
+def _linear_prerouting(magic: MagicType, from_enemy: bool, wand: Wand):
+    """The pre-table process_prerouting, kept only as a benchmark baseline"""
+    for rule in wand.rules.rules:
+        if rule.chain != RuleChain.PREROUTING:
+            continue
+        if rule.matches(magic, from_enemy):
+            if rule.action == RuleAction.DROP:
+                return (False, 0)
+            elif rule.action == RuleAction.ACCEPT:
+                return (True, 0)
+            elif rule.action == RuleAction.STRIP:
+                return (True, 30)
+    return (True, 0)
+
+
+def bench_prerouting(rule_count: int = 6, essences: int = 3000):
+    """Classify a batch of incoming essence against a typical ruleset"""
+    wand = Wand(owner="Bench")
+    filler = [MagicType.FIRE, MagicType.ICE, MagicType.NATURE,
+              MagicType.LIGHT, MagicType.WATER, MagicType.LIGHTNING]
+    for i in range(rule_count):
+        wand.rules.add_rule(DefenseRule(
+            chain=RuleChain.INPUT if i % 3 == 2 else RuleChain.PREROUTING,
+            action=RuleAction.DROP,
+            magic_type=filler[i % len(filler)],
+            source_filter=(i % 2 == 1)
+        ))
+    incoming = generate_incoming_magic(essences)
+
+    def linear():
+        for magic, from_enemy in incoming:
+            _linear_prerouting(magic, from_enemy, wand)
+
+    def compiled():
+        for magic, from_enemy in incoming:
+            process_prerouting(magic, from_enemy, wand)
+
+    def apply_turns():
+        wand.buffer.pull(wand.buffer.count)
+        apply_incoming_magic(wand, incoming[:3])
+
+    _report(f"PREROUTING classify ({rule_count} rules)", [
+        ("linear scan", _per_op_ns(linear, number=20) / essences),
+        ("compiled table", _per_op_ns(compiled, number=20) / essences),
+    ])
+    print(f"  apply_incoming_magic (3 essences): "
+          f"{_per_op_ns(apply_turns, number=20000):.0f} ns/turn\n")
+
+
+# ============================================================================
+# Spell lookup - interned packed-code table vs per-call construction
+# ============================================================================
+
+def _construct_spell(essences: List[MagicType]) -> Spell:
+    """The pre-table lookup_spell, kept only as a benchmark baseline"""
+    key = tuple(essences)
+    if key in SPELL_DATA:
+        name, damage, special, shield = SPELL_DATA[key]
+        return Spell(name=name, elements=key, damage=damage,
+                     special=special, shield=shield)
+    elem_str = "+".join(e.name_str for e in essences)
+    return Spell(name=f"Wild {elem_str}", elements=key,
+                 damage=5 * len(essences), special="unoptimized")
+
+
+def bench_spell_lookup(lookups: int = 5000):
+    """Look up a mix of known and Wild 1-3 element combos"""
+    rng = random.Random(5)
+    combos = [[rng.choice(list(MagicType)) for _ in range(rng.randint(1, 3))]
+              for _ in range(lookups)]
+    codes = [pack_magic(c) for c in combos]
+
+    def construct():
+        for c in combos:
+            _construct_spell(c)
+
+    def interned():
+        for c in combos:
+            lookup_spell(c)
+
+    def by_code():
+        for code in codes:
+            lookup_spell_code(code)
+
+    _report(f"Spell lookup ({lookups} combos)", [
+        ("construct per call", _per_op_ns(construct, number=20) / lookups),
+        ("lookup_spell (interned)", _per_op_ns(interned, number=20) / lookups),
+        ("lookup_spell_code", _per_op_ns(by_code, number=20) / lookups),
+    ])
+
+
+# ============================================================================
+# ExpertAI discard decision - buffer scanner vs copy-per-index
+# ============================================================================
+
+def _copying_discard(buffer: EssenceBuffer):
+    """The pre-scanner ExpertAI.should_discard body, kept as a baseline"""
+    for i in range(buffer.count):
+        temp_buffer = buffer.essences.copy()
+        temp_buffer.pop(i)
+        if len(temp_buffer) >= 2:
+            new_spell = lookup_spell(temp_buffer[:2])
+            old_spell = lookup_spell(buffer.essences[:2])
+            if new_spell.damage > old_spell.damage:
+                return i
+    return None
+
+
+def bench_discard_scan(buffers: int = 500):
+    """Discard decision on full 10-slot buffers"""
+    rng = random.Random(11)
+    full = []
+    for _ in range(buffers):
+        buf = EssenceBuffer()
+        for _ in range(10):
+            buf.add(rng.choice(list(MagicType)))
+        full.append(buf)
+
+    def copying():
+        for buf in full:
+            _copying_discard(buf)
+
+    def scanner():
+        for buf in full:
+            scan_buffer(buf)[0]
+
+    _report(f"Discard decision ({buffers} full buffers)", [
+        ("copy + lookup per index", _per_op_ns(copying, number=10) / buffers),
+        ("scan_buffer", _per_op_ns(scanner, number=10) / buffers),
+    ])
+
+
+# ============================================================================
+# Incoming magic - per-essence random vs batched counter-based stream
+# ============================================================================
+
+def bench_magic_source(turns: int = 2000):
+    """Draw both wands' incoming magic for a run of turns"""
+    def run(make):
+        def turn_loop():
+            source = make()
+            for _ in range(turns):
+                source.draw(3)
+                source.draw(3)
+        return turn_loop
+
+    _report(f"Incoming magic ({turns} turns)", [
+        ("RandomMagicSource", _per_op_ns(run(lambda: RandomMagicSource(random.Random(1))),
+                                         number=5) / turns),
+        ("BatchedMagicSource", _per_op_ns(run(lambda: BatchedMagicSource(1)),
+                                          number=5) / turns),
+    ])
+
+
+# ============================================================================
+# Game log - structured events vs disabled
+# ============================================================================
+
+def bench_match_logging(matches: int = 200):
+    """Full headless AI-vs-AI matches with the game log on and off"""
+    def run(log):
+        def matches_loop():
+            for seed in range(matches):
+                play_match(4, 6, seed, log=log)
+        return matches_loop
+
+    _report(f"Headless match ({matches} matches, L4 vs L6)", [
+        ("log on", _per_op_ns(run(True), number=1, repeat=3) / matches),
+        ("log off", _per_op_ns(run(False), number=1, repeat=3) / matches),
+    ])
+
+
+# ============================================================================
+# Multiplayer state fan-out - encode once vs per recipient
+# ============================================================================
+
+def _per_recipient_state(room: GameRoom, player_id: int) -> dict:
+    """The pre-frame get_state_for_player, kept only as a benchmark baseline"""
+    my_wand = room.get_wand(player_id)
+    enemy_wand = room.get_enemy_wand(player_id)
+    return {
+        "type": "state_update",
+        "turn": room.engine.state.turn.turn_number,
+        "phase": room.engine.state.turn.phase,
+        "your_wand": {
+            "hp": my_wand.hp,
+            "shield": my_wand.shield,
+            "cpu": my_wand.cpu,
+            "buffer": [int(e) for e in my_wand.buffer.essences],
+            "buffer_count": my_wand.buffer.count,
+            "rules_count": len(my_wand.rules.rules)
+        },
+        "enemy_wand": {
+            "hp": enemy_wand.hp,
+            "shield": enemy_wand.shield,
+            "cpu": enemy_wand.cpu,
+            "buffer_count": enemy_wand.buffer.count,
+            "rules_count": len(enemy_wand.rules.rules)
+        },
+        "log": room.engine.state.recent_log(5)
+    }
+
+
+def bench_state_fanout(actions: int = 2000):
+    """Serialize the post-action state for both players of a mid-game room"""
+    room = GameRoom("bench", "A", seed=1)
+    for _ in range(4):
+        room.engine.start_incoming_phase()
+        room.engine.start_action_phase()
+        room.engine.cast_spell(room.engine.state.player, room.engine.state.enemy, 1)
+        room.engine.end_turn()
+
+    def per_recipient():
+        for _ in range(actions):
+            json.dumps(_per_recipient_state(room, 0))
+            json.dumps(_per_recipient_state(room, 1))
+
+    def encode_once():
+        for version in range(actions):
+            frame = StateFrame(room)
+            frame.encode(0, version)
+            frame.encode(1, version)
+
+    _report(f"State fan-out per action (2 players, {actions} actions)", [
+        ("dumps per recipient", _per_op_ns(per_recipient, number=3) / actions),
+        ("StateFrame encode-once", _per_op_ns(encode_once, number=3) / actions),
+    ])
+
+
+def bench_wire_format(frames: int = 5000):
+    """Frame size and encode/parse cost: JSON text vs binary WireFormat"""
+    room = GameRoom("bench", "A", seed=1)
+    for _ in range(4):
+        room.engine.start_incoming_phase()
+        room.engine.start_action_phase()
+        room.engine.cast_spell(room.engine.state.player, room.engine.state.enemy, 1)
+        room.engine.end_turn()
+    frame = StateFrame(room)
+    view = {**frame.views[0], "version": 9}
+    incoming = {"type": "magic_incoming", "your_received": 3,
+                "your_dropped": 0, "your_overflow": 0, "enemy_received": 2}
+    messages = {  # name -> (JSON message, binary message)
+        "state_update": (view, {**view, "log": frame.events}),  # Binary log is events
+        "magic_incoming": (incoming, incoming),
+    }
+
+    for name, (message, wire_message) in messages.items():
+        text, binary = json.dumps(message), SERVER_WIRE.encode(wire_message)
+        print(f"{name} frame: {len(text)} bytes JSON, {len(binary)} bytes binary")
+        _report(f"{name} ({frames} frames)", [
+            ("json.dumps", _per_op_ns(lambda: json.dumps(message), number=frames)),
+            ("binary encode", _per_op_ns(lambda: SERVER_WIRE.encode(wire_message),
+                                         number=frames)),
+            ("json.loads", _per_op_ns(lambda: json.loads(text), number=frames)),
+            ("binary decode", _per_op_ns(lambda: SERVER_WIRE.decode(binary), number=frames)),
+        ])
+
+
+# ============================================================================
+# Matchmaking - joins and batched pairing ticks
+# ============================================================================
+
+def bench_matchmaking(players: int = 20000, ticks: int = 50):
+    """Steady stream of rated joins, paired by periodic ticks"""
+    rng = random.Random(3)
+    ratings = [max(1, int(rng.gauss(1500, 300))) for _ in range(players)]
+    per_tick = players // ticks
+
+    def joins_only():
+        queue = MatchQueue()
+        for i, rating in enumerate(ratings):
+            queue.add(rating, now=i * 0.001)
+
+    def joins_and_ticks():
+        queue = MatchQueue()
+        for t in range(ticks):
+            for i in range(t * per_tick, (t + 1) * per_tick):
+                queue.add(ratings[i], now=i * 0.001)
+            queue.tick(now=(t + 1) * per_tick * 0.001)
+
+    _report(f"Matchmaking ({players} players, {ticks} ticks)", [
+        ("add", _per_op_ns(joins_only, number=1) / players),
+        ("add + tick (per player)", _per_op_ns(joins_and_ticks, number=1) / players),
+    ])
+
+
+# ============================================================================
+# Phase deadlines - one timer wheel for every room
+# ============================================================================
+
+def bench_timer_wheel(rooms: int = 10000, turns: int = 5):
+    """Each room arms a 5s deadline per turn; half cancel early (both ready)"""
+    def run():
+        wheel = TimerWheel(tick=0.1)
+        timers = [wheel.schedule(5.0, room) for room in range(rooms)]
+        now = 0.0
+        for _ in range(turns):
+            for room in range(0, rooms, 2):
+                wheel.cancel(timers[room])
+                timers[room] = wheel.schedule(now + 5.0, room)
+            for _ in range(50):
+                now += 0.1
+                for room in wheel.advance(now):
+                    timers[room] = wheel.schedule(now + 5.0, room)
+
+    _report(f"Timer wheel ({rooms} rooms, {turns} phases)", [
+        ("per room per phase", _per_op_ns(run, number=1, repeat=3) / (rooms * turns)),
+    ])
+
+
+def bench_room_pool(rooms: int = 2000):
+    """Open a room for a new match: allocate vs recycle from the pool"""
+    pool = RoomPool(limit=1)
+    pool.release(pool.acquire("r", "A", seed=1))
+
+    def recycled():
+        pool.release(pool.acquire("r", "A", seed=1))
+
+    _report("Room open", [
+        ("new GameRoom", _per_op_ns(lambda: GameRoom("r", "A", seed=1), rooms)),
+        ("pooled reset", _per_op_ns(recycled, rooms)),
+    ])
+
+
+class _ScriptedClient:
+    """Websocket stand-in: yields a fixed list of client frames, drops sends"""
+    def __init__(self, frames: List[str]):
+        self._frames = iter(frames)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        for frame in self._frames:
+            return frame
+        raise StopAsyncIteration
+
+    async def send(self, frame):
+        pass
+
+
+def bench_metrics(messages: int = 20000):
+    """Whole handle_client path for a stream of room messages, metrics off/on"""
+    frames = [json.dumps({"type": "join", "player_name": "A"})]
+    frames += [json.dumps({"type": "get_state"}), json.dumps({"type": "ack", "version": 1})] * (
+        messages // 2)
+
+    def run(metrics):
+        server = MultiplayerServer(metrics=metrics)
+        asyncio.run(server.handle_client(_ScriptedClient(frames), "/"))
+
+    _report(f"Server message path ({messages} messages)", [
+        ("metrics off", _per_op_ns(lambda: run(None), 1) / messages),
+        ("metrics on", _per_op_ns(lambda: run(Metrics()), 1) / messages),
+    ])
+
+
+def bench_dispatch(messages: int = 20000):
+    """Per-message decode + validation, and the dispatched handler path"""
+    sample = [{"type": "cast", "essence_count": 2},
+              {"type": "configure_rule", "chain": "INPUT", "action": "DROP",
+               "magic_type": 3, "source_filter": False},
+              {"type": "ack", "version": 12}]
+    texts = [json.dumps(message) for message in sample]
+    frames = [CLIENT_WIRE.encode(message) for message in sample]
+
+    def decode_all(decode, batch):
+        for frame in batch:
+            decode(frame)
+
+    def reject():
+        try:
+            decode_client_frame('{"type": "configure_rule", "chain": "FORWARD"}')
+        except ProtocolError:
+            pass
+
+    server = MultiplayerServer()
+    room = GameRoom("bench", "A", seed=1)
+    room.add_player(0, _ScriptedClient([]), "A")
+    room.add_player(1, _ScriptedClient([]), "B")
+    server.rooms["bench"] = room
+    ack = {"type": "ack", "version": 0}
+
+    async def dispatch():
+        for _ in range(messages):
+            await server.handle_game_action(room, 0, ack)
+
+    n = len(sample)
+    _report(f"Client message dispatch ({messages} messages)", [
+        ("json.loads only", _per_op_ns(lambda: decode_all(json.loads, texts), messages) / n),
+        ("decode + validate (JSON)",
+         _per_op_ns(lambda: decode_all(decode_client_frame, texts), messages) / n),
+        ("decode + validate (binary)",
+         _per_op_ns(lambda: decode_all(decode_client_frame, frames), messages) / n),
+        ("reject malformed", _per_op_ns(reject, messages)),
+        ("table dispatch to handler", _per_op_ns(lambda: asyncio.run(dispatch()), 1) / messages),
+    ])
+
+
+def bench_replay_log(actions: int = 20000):
+    """Action path with and without match recording, and replay speed"""
+    with tempfile.TemporaryDirectory() as directory:
+        log = ReplayLog(directory)
+        plain, recorded = MultiplayerServer(), MultiplayerServer(replay=log)
+        rooms = []
+        for server in (plain, recorded):
+            room = server.open_room("A")
+            room.add_player(1, _ScriptedClient([]), "B")
+            room.engine.start_incoming_phase()
+            rooms.append(room)
+        rule = {"type": "configure_rule", "chain": "INPUT", "action": "DROP", "magic_type": 2}
+
+        def act(server, room):
+            room.get_wand(0).cpu = 10 ** 9
+            room.get_wand(0).rules.clear()
+            server.apply_action(room, 0, rule)
+
+        def hook():
+            rooms[1].recorder.cast(0, 2)
+
+        rows = [
+            ("configure_rule, not recorded", _per_op_ns(lambda: act(plain, rooms[0]), actions)),
+            ("configure_rule, recorded", _per_op_ns(lambda: act(recorded, rooms[1]), actions)),
+            ("record hook alone", _per_op_ns(hook, actions)),
+        ]
+
+        # Replay: a long match of simple turns
+        recorder = rooms[1].recorder
+        recorder.buffer.clear()
+        recorder.log.pending.clear()
+        for _ in range(200):
+            recorder.phase(INCOMING)
+            recorder.cast(0, 1)
+            recorder.cast(1, 1)
+            recorder.discard(0, 0)
+            recorder.phase(RESOLVE)
+        recorder.close("bench")
+        log.flush()
+        match = next(iter(read_matches([log.path()]).values()))
+        rows.append(("replay per record",
+                     _per_op_ns(lambda: replay_match(match, plain), 20, 3) / len(match.records)))
+        size = os.path.getsize(log.path())
+    _report(f"Replay log ({size} bytes for a {len(match.records)}-record match)", rows)
+
+
+def bench_snapshot(rooms: int = 10000, lookups: int = 20000):
+    """Drain cost per room, and the cost of bringing one back on resume"""
+    room = GameRoom("bench", "A", seed=7)
+    room.player_names[1] = "B"
+    room.game_started = True
+    engine = room.engine
+    for chain in (RuleChain.PREROUTING, RuleChain.INPUT):
+        engine.state.player.rules.add_rule(DefenseRule(chain, RuleAction.DROP, MagicType.FIRE))
+    for _ in range(12):
+        engine.start_incoming_phase()
+        engine.start_action_phase()
+        engine.end_turn()
+    tokens = [new_tokens() for _ in range(rooms)]
+    record = pack_room(room, tokens[0])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rooms.snap")
+        start = time.perf_counter()
+        write_snapshot(path, (tokens[i][0] + tokens[i][1] + record[32:] for i in range(rooms)))
+        write_ns = (time.perf_counter() - start) / rooms * 1e9
+        snapshot = RoomSnapshot(path)
+        target = GameRoom("", "")
+        probes = [random.choice(tokens)[random.randrange(2)] for _ in range(64)]
+        cycle = iter(probes * (lookups // len(probes) + 1) * 10)
+
+        def restore():
+            offset, length, _ = snapshot.find(next(cycle))
+            unpack_room(snapshot.record(offset, length), target)
+
+        rows = [
+            ("pack_room", _per_op_ns(lambda: pack_room(room, tokens[0]), lookups)),
+            ("write_snapshot per room", write_ns),
+            (f"find token ({rooms} rooms)", _per_op_ns(lambda: snapshot.find(probes[0]), lookups)),
+            ("find + unpack_room", _per_op_ns(restore, lookups // 10)),
+        ]
+        snapshot.close()
+        size = os.path.getsize(path)
+    _report(f"Room snapshot ({len(record)}-byte record, {size // 1024} KB file)", rows)
+
+
+def bench_spectators(spectators: int = 10000, actions: int = 2000):
+    """
+    Player action cost with a crowd attached, and one snapshot fan-out
+
+    While watched, spectator_tick runs alongside the actions as run_timers
+    would (interval 0: every action leaves a snapshot due). The p99 stall
+    is how long an action waits behind a SPECTATOR_CHUNK of the fan-out.
+    """
+    async def run():
+        server = MultiplayerServer(spectator_interval=0.0)
+        room = GameRoom("bench", "A", seed=1)
+        room.add_player(0, _ScriptedClient([]), "A")
+        room.add_player(1, _ScriptedClient([]), "B")
+        server.rooms["bench"] = room
+        await server.start_game(room)
+
+        async def act():
+            stalls = []
+            for _ in range(actions):
+                start = time.perf_counter()
+                await server.handle_game_action(room, 0, {"type": "get_state"})
+                await asyncio.sleep(0)
+                stalls.append(time.perf_counter() - start)
+            return sorted(stalls)[actions * 99 // 100]
+
+        start = time.perf_counter()
+        await act()
+        alone = time.perf_counter() - start
+
+        async def tick():
+            while True:
+                await server.spectator_tick(time.monotonic())
+                await asyncio.sleep(0)
+
+        room.spectators = {Outbox(_ScriptedClient([])): "json" for _ in range(spectators)}
+        server.watched.add(room)
+        ticker = asyncio.create_task(tick())
+        start = time.perf_counter()
+        stall = await act()
+        watched = time.perf_counter() - start
+        ticker.cancel()
+
+        await asyncio.sleep(0)  # Writers drain
+        room.spectators_dirty = True
+        start = time.perf_counter()
+        await server.spectator_tick(time.monotonic())
+        await asyncio.sleep(0)
+        fanout = time.perf_counter() - start
+        for outbox in room.spectators:
+            outbox.close()
+        await room.flush()
+        return alone, watched, stall, fanout
+
+    alone, watched, stall, fanout = asyncio.run(run())
+    _report(f"Spectators ({spectators} watching)", [
+        ("player action, no spectators", alone / actions * 1e9),
+        ("player action, watched", watched / actions * 1e9),
+        ("p99 action stall, watched", stall * 1e9),
+        ("snapshot fan-out per spectator", fanout / spectators * 1e9),
+    ])
+
+
+if __name__ == "__main__":
+    print("=== Kernel Duel Benchmarks ===\n")
+    bench_essence_buffer()
+    bench_prerouting()
+    bench_spell_lookup()
+    bench_discard_scan()
+    bench_magic_source()
+    bench_match_logging()
+    bench_state_fanout()
+    bench_wire_format()
+    bench_matchmaking()
+    bench_timer_wheel()
+    bench_room_pool()
+    bench_metrics()
+    bench_dispatch()
+    bench_replay_log()
+    bench_snapshot()
+    bench_spectators()
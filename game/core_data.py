@@ -4,9 +4,13 @@ Kernel Duel - Core Data Structures
 Linux kernel style: Data first, simple relationships, clear ownership
 """
 
+from collections import deque
+from collections.abc import Sequence
 from dataclasses import dataclass, field
 from enum import IntEnum
-from typing import List, Optional
+from itertools import islice
+from operator import ge
+from typing import Deque, List, Optional, Tuple
 import time
 
 
@@ -44,31 +48,138 @@ class MagicType(IntEnum):
         return self.name.capitalize()
 
 
+# Wire code -> MagicType (index 0 unused), avoids enum lookups on hot paths
+MAGIC_BY_CODE = (None,) + tuple(MagicType)
+
+# Packed combo codes: up to 3 MagicType codes, 3 bits each, first in the
+# low bits. Codes are never 0, so the length is implicit (0 = empty)
+PACKED_COMBO_LIMIT = 1 << 9
+
+# Element histograms have one slot per MagicType
+MAGIC_SLOTS = len(MagicType)
+
+
+def pack_magic(essences) -> int:
+    """Pack 1-3 magic types into one base-8 integer"""
+    code = 0
+    shift = 0
+    for magic in essences:
+        code |= magic << shift
+        shift += 3
+    return code
+
+
+def element_counts(essences) -> Tuple[int, ...]:
+    """7-slot histogram of a combo, slot magic - 1 (see EssenceBuffer.counts)"""
+    counts = [0] * MAGIC_SLOTS
+    for magic in essences:
+        counts[magic - 1] += 1
+    return tuple(counts)
+
+
+def unpack_magic(code: int) -> List[MagicType]:
+    """Inverse of pack_magic"""
+    essences = []
+    while code:
+        essences.append(MAGIC_BY_CODE[code & 7])
+        code >>= 3
+    return essences
+
+
 # ============================================================================
 # Essence Buffer - Like sk_buff queue in kernel
 # ============================================================================
 
+class EssenceView(Sequence):
+    """
+    Read-only view of an EssenceBuffer's list
+
+    Indexing, slicing, iteration and `in` see essences oldest-first,
+    straight out of the buffer's list (`in` and slices walk it, like any
+    list). The buffer hands out the same view every time, so getting it
+    costs nothing.
+    """
+    __slots__ = ("_items",)
+
+    def __init__(self, items: List[MagicType]):
+        self._items = items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, magic) -> bool:
+        return magic in self._items
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (EssenceView, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def copy(self) -> List[MagicType]:
+        """Snapshot as a plain list (safe to mutate)"""
+        return self._items[:]
+
+    def __repr__(self) -> str:
+        return repr(self._items)
+
+
 @dataclass
 class EssenceBuffer:
     """
-    Circular buffer for magic essence - like ring buffer in NIC driver
+    FIFO of magic essence - like an sk_buff queue in the kernel
+
+    One plain list, oldest first, changed only in place: adds append,
+    and removals delete from it (a C-level memmove of at most capacity
+    slots). The list object is never replaced, so the view over it stays
+    valid. consume() returns the removed essences as a new list; pull()
+    is the variant that removes them without allocating anything.
+
+    The histogram and presence bitmask are kept up to date by add,
+    consume, pull and discard in O(1) per essence, so AI queries never
+    walk the list.
 
     Data:
-        essences: List of magic types (max 10)
         capacity: Max buffer size (10)
         overflow_count: How many overflowed this turn
+        essences: Read-only view, oldest first (EssenceView)
+        counts: Histogram, counts[magic - 1] = essences of that type
+        mask: Presence bitmask, bit (magic - 1) set if any of that type
     """
     capacity: int = 10
-    essences: List[MagicType] = field(default_factory=list)
     overflow_count: int = 0
+    _items: List[MagicType] = field(init=False, repr=False, compare=False)
+    _counts: List[int] = field(init=False, repr=False, compare=False)
+    _mask: int = field(init=False, repr=False, compare=False)
+    _view: EssenceView = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Every field set here, in one order - instance attributes, not class defaults
+        self._items = []
+        self._counts = [0] * MAGIC_SLOTS
+        self._mask = 0
+        self._view = EssenceView(self._items)
+
+    @property
+    def essences(self) -> EssenceView:
+        """Essences oldest-first, as a view over the buffer"""
+        return self._view
 
     def add(self, magic: MagicType) -> bool:
         """
         Add essence to buffer
         Returns: True if added, False if overflow
         """
-        if len(self.essences) < self.capacity:
-            self.essences.append(magic)
+        items = self._items
+        if len(items) < self.capacity:
+            items.append(magic)
+            self._counts[magic - 1] += 1
+            self._mask |= 1 << (magic - 1)
             return True
         else:
             self.overflow_count += 1
@@ -76,37 +187,102 @@ class EssenceBuffer:
 
     def consume(self, count: int) -> List[MagicType]:
         """
-        Consume N essences from front (FIFO)
+        Consume N essences from front (FIFO) - allocates the returned list
+        (see pull() to drop them without one)
         Returns: List of consumed essences
         """
-        if count > len(self.essences):
-            count = len(self.essences)
-
-        consumed = self.essences[:count]
-        self.essences = self.essences[count:]
+        if count <= 0:
+            return []
+        items = self._items
+        consumed = items[:count]
+        del items[:count]
+        for magic in consumed:
+            self._forget(magic)
         return consumed
 
+    def peek_code(self, count: int) -> int:
+        """
+        Packed code (pack_magic) of the first N essences, without consuming
+        Returns: 0 if count is 0; for N <= 3 pass to lookup_spell_code
+        """
+        code = 0
+        for shift, magic in zip(range(0, 3 * count, 3), self._items):
+            code |= magic << shift
+        return code
+
+    def pull(self, count: int) -> int:
+        """
+        Drop N essences from front without returning them - like skb_pull
+        Returns: How many were dropped
+        """
+        items = self._items
+        if count > len(items):
+            count = len(items)
+        if count <= 0:
+            return 0
+        for magic in islice(items, count):
+            self._forget(magic)
+        del items[:count]
+        return count
+
+    def _forget(self, magic: MagicType):
+        """Drop one essence of this type from the histogram and mask"""
+        slot = magic - 1
+        left = self._counts[slot] - 1
+        self._counts[slot] = left
+        if not left:
+            self._mask &= ~(1 << slot)
+
     def discard(self, index: int) -> bool:
         """Remove essence at index"""
-        if 0 <= index < len(self.essences):
-            self.essences.pop(index)
-            return True
-        return False
+        items = self._items
+        if not 0 <= index < len(items):
+            return False
+        self._forget(items.pop(index))
+        return True
 
     @property
     def count(self) -> int:
         """Current essence count"""
-        return len(self.essences)
+        return len(self._items)
 
     @property
     def is_full(self) -> bool:
         """Check if buffer full"""
-        return len(self.essences) >= self.capacity
+        return len(self._items) >= self.capacity
+
+    @property
+    def counts(self) -> List[int]:
+        """Per-element histogram (do not mutate)"""
+        return self._counts
+
+    @property
+    def mask(self) -> int:
+        """Presence bitmask - bit (magic - 1) set if buffer holds that type"""
+        return self._mask
+
+    def count_of(self, magic: MagicType) -> int:
+        """How many essences of this type are buffered"""
+        return self._counts[magic - 1]
+
+    def has_all(self, needed: Tuple[int, ...]) -> bool:
+        """
+        Check buffer covers a 7-slot element count (see element_counts)
+        Order doesn't matter - this is "could I cast it after rearranging"
+        """
+        return all(map(ge, self.counts, needed))
 
     def reset_overflow(self):
         """Reset overflow counter (called each turn)"""
         self.overflow_count = 0
 
+    def clear(self):
+        """Empty the buffer in place (pooled wands) - the list object is kept"""
+        self._items.clear()
+        self._counts[:] = [0] * MAGIC_SLOTS
+        self._mask = 0
+        self.overflow_count = 0
+
 
 # ============================================================================
 # Defense Rules - Like iptables rules
@@ -126,10 +302,11 @@ class RuleChain(IntEnum):
     POSTROUTING = 2  # Outgoing transform
 
 
-@dataclass
+@dataclass(frozen=True)
 class DefenseRule:
     """
-    Single iptables-like rule
+    Single iptables-like rule - immutable once built, so a compiled
+    verdict table never goes stale under it
 
     Data:
         chain: Which hook point (PREROUTING/INPUT/POSTROUTING)
@@ -148,16 +325,16 @@ class DefenseRule:
         """Calculate CPU cost - like processing overhead"""
         if self.source_filter and self.magic_type:
             # Compound rule: enemy + type = expensive
-            self.cpu_cost = 25
+            object.__setattr__(self, "cpu_cost", 25)
         elif self.source_filter:
             # Source filtering
-            self.cpu_cost = 10
+            object.__setattr__(self, "cpu_cost", 10)
         elif self.action == RuleAction.STRIP:
             # DPI is expensive
-            self.cpu_cost = 30
+            object.__setattr__(self, "cpu_cost", 30)
         else:
             # Simple type filter
-            self.cpu_cost = 5
+            object.__setattr__(self, "cpu_cost", 5)
 
     def matches(self, magic: MagicType, from_enemy: bool) -> bool:
         """Check if rule matches this magic"""
@@ -168,35 +345,97 @@ class DefenseRule:
         return type_match and source_match
 
 
+def verdict_index(magic: MagicType, from_enemy: bool, chain: RuleChain) -> int:
+    """
+    Slot in a compiled verdict table - chain:2 | from_enemy:1 | magic:3 bits
+    Like a hash into nf_conntrack, except the key space is tiny and dense
+    """
+    return (chain << 4) | (from_enemy << 3) | magic
+
+
+VERDICT_TABLE_SIZE = (max(RuleChain) + 1) << 4
+
+
 @dataclass
 class RuleSet:
     """
     Collection of rules - like iptables ruleset
 
+    The linear first-match scan is compiled into a flat verdict table
+    (one RuleAction per chain x source x magic type), rebuilt lazily
+    after add_rule/remove_rule/clear, so classifying an essence is a
+    single index. Those methods are the only way to change the rules:
+    rules is a tuple and DefenseRule is frozen.
+
     Data:
-        rules: List of active rules
+        rules: Active rules, in match order (read-only tuple)
         max_rules: Maximum allowed (10)
     """
-    rules: List[DefenseRule] = field(default_factory=list)
     max_rules: int = 10
+    _rules: Tuple[DefenseRule, ...] = field(default=(), init=False)
+    _verdicts: Optional[List[RuleAction]] = field(
+        default=None, init=False, repr=False, compare=False)
+    _cpu_cost: int = field(default=0, init=False, repr=False, compare=False)
+
+    @property
+    def rules(self) -> Tuple[DefenseRule, ...]:
+        """Active rules, in match order"""
+        return self._rules
 
     def add_rule(self, rule: DefenseRule) -> bool:
         """Add rule if space available"""
-        if len(self.rules) < self.max_rules:
-            self.rules.append(rule)
+        if len(self._rules) < self.max_rules:
+            self._rules += (rule,)
+            self._verdicts = None
             return True
         return False
 
     def remove_rule(self, index: int) -> bool:
         """Remove rule at index"""
-        if 0 <= index < len(self.rules):
-            self.rules.pop(index)
+        rules = self._rules
+        if 0 <= index < len(rules):
+            self._rules = rules[:index] + rules[index + 1:]
+            self._verdicts = None
             return True
         return False
 
+    def clear(self):
+        """Remove all rules"""
+        self._rules = ()
+        self._verdicts = None
+
+    def compile(self) -> List[RuleAction]:
+        """
+        Build the verdict table from the rule list (first match wins)
+        Returns: Table indexed by verdict_index()
+        """
+        verdicts = [RuleAction.ACCEPT] * VERDICT_TABLE_SIZE
+        for chain in RuleChain:
+            chain_rules = [rule for rule in self.rules if rule.chain == chain]
+            for from_enemy in (False, True):
+                for magic in MagicType:
+                    for rule in chain_rules:
+                        if rule.matches(magic, from_enemy):
+                            verdicts[verdict_index(magic, from_enemy, chain)] = rule.action
+                            break
+
+        self._verdicts = verdicts
+        self._cpu_cost = sum(rule.cpu_cost for rule in self.rules)
+        return verdicts
+
+    @property
+    def verdicts(self) -> List[RuleAction]:
+        """Compiled verdict table (compiled on first use after a change)"""
+        verdicts = self._verdicts
+        if verdicts is None:
+            verdicts = self.compile()
+        return verdicts
+
     def total_cpu_cost(self) -> int:
         """Calculate total CPU cost per turn"""
-        return sum(rule.cpu_cost for rule in self.rules)
+        if self._verdicts is None:
+            self.compile()
+        return self._cpu_cost
 
     def process_magic(self, magic: MagicType, from_enemy: bool,
                      chain: RuleChain) -> RuleAction:
@@ -204,10 +443,7 @@ class RuleSet:
         Process magic through rules in this chain
         Returns: Action to take (default ACCEPT)
         """
-        for rule in self.rules:
-            if rule.chain == chain and rule.matches(magic, from_enemy):
-                return rule.action
-        return RuleAction.ACCEPT
+        return self.verdicts[(chain << 4) | (from_enemy << 3) | magic]
 
 
 # ============================================================================
@@ -244,6 +480,16 @@ class Wand:
         """Refresh CPU at start of turn"""
         self.cpu = self.max_cpu
 
+    def reset(self, owner: str):
+        """Back to a fresh wand for a new owner, reusing buffer and rules"""
+        self.owner = owner
+        self.hp = self.max_hp
+        self.cpu = self.max_cpu
+        self.buffer.clear()
+        self.rules.clear()
+        self.shield = 0
+        self.frozen_essences = 0
+
     def spend_cpu(self, amount: int) -> bool:
         """Spend CPU, return True if successful"""
         if self.cpu >= amount:
@@ -293,11 +539,13 @@ class Wand:
 # Magic Spell - The result of consuming essence
 # ============================================================================
 
-@dataclass
+@dataclass(frozen=True)
 class Spell:
     """
     Spell cast from essence combination
 
+    Immutable: spell_database hands out one shared instance per combo.
+
     Data:
         name: Spell name
         elements: Essences consumed
@@ -305,7 +553,7 @@ class Spell:
         special: Special effect description
     """
     name: str
-    elements: List[MagicType]
+    elements: Tuple[MagicType, ...]
     damage: int
     special: str = ""
     shield: int = 0
@@ -377,6 +625,29 @@ class TurnState:
 # Game State - Everything
 # ============================================================================
 
+# Log event kind -> message template, formatted only when someone reads it
+# Like printk: store the format and args, render on dmesg
+LOG_FORMATS = {
+    "message": "{0}",
+    "incoming": "{actor} incoming: {0} accepted, {1} dropped, {2} overflow",
+    "rule": "{actor} configured rule",
+    "cast_damage": "{actor} cast {0} → {1} dmg to {2}",
+    "cast_heal": "{actor} cast {0} → healed {1} HP",
+    "shield": "{actor} gained {0} shield",
+    "discard": "{actor} discarded essence",
+    "starved": "{actor} starved! (5 turns no cast)",
+    "timeout": "action phase timed out",
+}
+
+LOG_LIMIT = 50  # Events kept per game
+
+
+def format_log_event(event: Tuple) -> str:
+    """Render one (turn, kind, actor, values) log event"""
+    turn, kind, actor, values = event
+    return f"Turn {turn}: " + LOG_FORMATS[kind].format(*values, actor=actor)
+
+
 @dataclass
 class GameState:
     """
@@ -386,25 +657,47 @@ class GameState:
         player: Player's wand
         enemy: Enemy's wand
         turn: Turn state
-        log: Event log
+        log: Ring of (turn, kind, actor, values) events, last LOG_LIMIT kept
+        log_enabled: False drops events at the source (batch simulation)
         winner: Who won (None if ongoing)
     """
     player: Wand
     enemy: Wand
     turn: TurnState = field(default_factory=TurnState)
-    log: List[str] = field(default_factory=list)
+    log: Deque[Tuple] = field(default_factory=lambda: deque(maxlen=LOG_LIMIT))
+    log_enabled: bool = True
     winner: Optional[str] = None
 
     # Starvation tracking
     player_no_cast_turns: int = 0
     enemy_no_cast_turns: int = 0
 
+    def reset(self, player_name: str, enemy_name: str):
+        """Back to turn 1 with fresh wands, reusing every allocation"""
+        self.player.reset(player_name)
+        self.enemy.reset(enemy_name)
+        self.turn.turn_number = 1
+        self.turn.phase = "incoming"
+        self.turn.start_time = time.time()
+        self.log.clear()
+        self.winner = None
+        self.player_no_cast_turns = 0
+        self.enemy_no_cast_turns = 0
+
     def add_log(self, message: str):
-        """Add message to log"""
-        self.log.append(f"Turn {self.turn.turn_number}: {message}")
-        # Keep last 50 messages
-        if len(self.log) > 50:
-            self.log = self.log[-50:]
+        """Add free-form message to log"""
+        if self.log_enabled:
+            self.log.append((self.turn.turn_number, "message", None, (message,)))
+
+    def log_event(self, kind: str, actor: Optional[str], *values):
+        """Record a structured event (see LOG_FORMATS) - no formatting here"""
+        if self.log_enabled:
+            self.log.append((self.turn.turn_number, kind, actor, values))
+
+    def recent_log(self, count: int = 5) -> List[str]:
+        """Last N events, formatted for display"""
+        start = max(len(self.log) - count, 0)
+        return [format_log_event(self.log[i]) for i in range(start, len(self.log))]
 
     def check_victory(self) -> Optional[str]:
         """
@@ -422,11 +715,11 @@ class GameState:
         # Starvation-based victory (5 turns no cast)
         if self.player_no_cast_turns >= 5:
             self.winner = self.enemy.owner
-            self.add_log(f"{self.player.owner} starved! (5 turns no cast)")
+            self.log_event("starved", self.player.owner)
             return self.winner
         if self.enemy_no_cast_turns >= 5:
             self.winner = self.player.owner
-            self.add_log(f"{self.enemy.owner} starved! (5 turns no cast)")
+            self.log_event("starved", self.enemy.owner)
             return self.winner
 
         return None
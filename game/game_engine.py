@@ -6,10 +6,12 @@ This makes networking easy - UI is just another client
 """
 
 import random
+import time
+from abc import ABC, abstractmethod
 from typing import List, Optional, Tuple
 from core_data import (GameState, Wand, MagicType, DefenseRule,
-                      RuleAction, RuleChain, TurnState)
-from spell_database import lookup_spell
+                      RuleChain, Spell)
+from spell_database import lookup_spell_code
 from ai_opponents import AIStrategy
 
 
@@ -17,12 +19,17 @@ from ai_opponents import AIStrategy
 # Magic Generation - Incoming essence system
 # ============================================================================
 
-def generate_incoming_magic(count: int = 3) -> List[Tuple[MagicType, bool]]:
+MAGIC_TYPES = tuple(MagicType)
+
+
+def generate_incoming_magic(count: int = 3,
+                            rng: random.Random = random) -> List[Tuple[MagicType, bool]]:
     """
     Generate incoming magic essences
 
     Args:
         count: How many to generate (default 3)
+        rng: Random source (default: global random module)
 
     Returns:
         List of (magic_type, from_enemy) tuples
@@ -32,11 +39,11 @@ def generate_incoming_magic(count: int = 3) -> List[Tuple[MagicType, bool]]:
 
     for _ in range(count):
         # Random magic type
-        magic = random.choice(list(MagicType))
+        magic = rng.choice(MAGIC_TYPES)
 
         # 70% from enemy direct, 30% from routes
         # Of routes: 2/3 enemy route, 1/3 ally route
-        roll = random.random()
+        roll = rng.random()
         if roll < 0.70:
             from_enemy = True  # Direct attack
         elif roll < 0.90:
@@ -49,10 +56,121 @@ def generate_incoming_magic(count: int = 3) -> List[Tuple[MagicType, bool]]:
     return magic_list
 
 
+# ============================================================================
+# Magic Sources - Pluggable incoming essence stream
+# ============================================================================
+
+class MagicSource(ABC):
+    """
+    Where incoming magic comes from - like a NIC driver behind a common API
+
+    The engine calls draw() once per wand per incoming phase, player first.
+    """
+    @abstractmethod
+    def draw(self, count: int = 3) -> List[Tuple[MagicType, bool]]:
+        """Next `count` (magic_type, from_enemy) pairs"""
+
+
+class RandomMagicSource(MagicSource):
+    """
+    generate_incoming_magic on a random.Random stream (the default)
+
+    Data:
+        rng: Random source (global random module if not given)
+    """
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng if rng is not None else random
+
+    def draw(self, count: int = 3) -> List[Tuple[MagicType, bool]]:
+        return generate_incoming_magic(count, self.rng)
+
+
+# Interned (magic, from_enemy) pairs indexed by (from_enemy << 3) | magic
+INCOMING_PAIRS = tuple(
+    (MagicType(code & 7), bool(code >> 3)) if code & 7 else None
+    for code in range(16)
+)
+
+
+class BatchedMagicSource(MagicSource):
+    """
+    Counter-based batched essence stream - needs numpy
+
+    Essences come a block at a time from one random_raw() call on a
+    Philox generator keyed by the seed: one 64-bit word per essence, low
+    bits pick the magic type, high 32 bits the 90% enemy roll. Philox is
+    counter-based, so any position can be reached with advance() instead
+    of replaying the draws - a match replays (or resumes mid-match with
+    seek()) from its seed alone.
+
+    Data:
+        seed: Match seed (Philox key)
+        block_size: Essences generated per vectorized draw (multiple of 4)
+        position: Essences handed out so far
+    """
+    ENEMY_THRESHOLD = int(0.90 * 2**32)
+
+    def __init__(self, seed: int, block_size: int = 120):
+        import numpy as np
+        if block_size % 4:
+            raise ValueError("block_size must be a multiple of 4 (Philox words per counter)")
+        self._np = np
+        self.seed = seed
+        self.block_size = block_size
+        self.position = 0
+        self._bits = None
+        self._block_index = -1
+        self._block_start = 0
+        self._block: List[Tuple[MagicType, bool]] = []
+
+    def _load_block(self, index: int):
+        """Generate block `index` of the stream"""
+        np = self._np
+        if self._bits is None or index != self._block_index + 1:
+            self._bits = np.random.Philox(key=self.seed)
+            self._bits.advance(index * self.block_size // 4)
+        raw = self._bits.random_raw(self.block_size)
+        magic = (raw % np.uint64(len(MAGIC_TYPES))).astype(np.int64) + 1
+        from_enemy = np.where((raw >> np.uint64(32)) < self.ENEMY_THRESHOLD, 8, 0)
+        self._block = [INCOMING_PAIRS[code] for code in (from_enemy | magic).tolist()]
+        self._block_index = index
+        self._block_start = index * self.block_size
+
+    def seek(self, position: int):
+        """Jump to essence `position` (e.g. 6 * turns played, for 3 per wand)"""
+        self.position = position
+
+    def draw(self, count: int = 3) -> List[Tuple[MagicType, bool]]:
+        offset = self.position - self._block_start
+        if 0 <= offset and offset + count <= len(self._block):
+            self.position += count
+            return self._block[offset:offset + count]
+
+        drawn = []
+        while len(drawn) < count:
+            index, offset = divmod(self.position, self.block_size)
+            if index != self._block_index:
+                self._load_block(index)
+            take = min(count - len(drawn), self.block_size - offset)
+            drawn.extend(self._block[offset:offset + take])
+            self.position += take
+        return drawn
+
+
 # ============================================================================
 # Rules Engine - Process magic through filters
 # ============================================================================
 
+# PREROUTING outcome per verdict: (accepted, cpu_cost), indexed by RuleAction
+# STRIP is DPI - 30 CPU to inspect, then accepted: an essence is one element,
+# so there is nothing mixed in it to extract
+PREROUTING_OUTCOMES = (
+    (False, 0),   # DROP - blocked, no processing cost
+    (True, 0),    # ACCEPT - explicitly accepted
+    (True, 30),   # STRIP - deep inspection
+)
+
+
 def process_prerouting(magic: MagicType, from_enemy: bool,
                        wand: Wand) -> Tuple[bool, int]:
     """
@@ -66,28 +184,8 @@ def process_prerouting(magic: MagicType, from_enemy: bool,
     Returns:
         (accepted, cpu_cost) - True if magic passes, CPU cost incurred
     """
-    cpu_cost = 0
-
-    # Check each rule
-    for rule in wand.rules.rules:
-        if rule.chain != RuleChain.PREROUTING:
-            continue
-
-        if rule.matches(magic, from_enemy):
-            # Rule matches!
-            if rule.action == RuleAction.DROP:
-                return (False, 0)  # Blocked, no processing cost
-            elif rule.action == RuleAction.ACCEPT:
-                return (True, 0)  # Explicitly accepted
-            elif rule.action == RuleAction.STRIP:
-                # DPI - expensive operation
-                # For now, just accept the magic
-                # TODO: Handle mixed magic parsing
-                cpu_cost += 30
-                return (True, cpu_cost)
-
-    # Default: ACCEPT if no rule matched
-    return (True, 0)
+    action = wand.rules.process_magic(magic, from_enemy, RuleChain.PREROUTING)
+    return PREROUTING_OUTCOMES[action]
 
 
 def apply_incoming_magic(wand: Wand, magic_list: List[Tuple[MagicType, bool]]) -> dict:
@@ -110,10 +208,13 @@ def apply_incoming_magic(wand: Wand, magic_list: List[Tuple[MagicType, bool]]) -
     }
 
     wand.buffer.reset_overflow()
+    verdicts = wand.rules.verdicts
+    chain_base = RuleChain.PREROUTING << 4
 
     for magic, from_enemy in magic_list:
-        # PREROUTING filter
-        accepted, cpu_cost = process_prerouting(magic, from_enemy, wand)
+        # PREROUTING filter - one lookup in the compiled verdict table
+        accepted, cpu_cost = PREROUTING_OUTCOMES[
+            verdicts[chain_base | (from_enemy << 3) | magic]]
         stats['cpu_used'] += cpu_cost
 
         if not accepted:
@@ -142,38 +243,54 @@ class GameEngine:
     Data:
         state: Current game state
         ai: AI opponent (None if PvP)
+        source: Incoming magic stream (seed it to replay a match)
+        last_spell: Spell from the most recent successful cast
     """
-    def __init__(self, player_name: str = "Player", ai: Optional[AIStrategy] = None):
+    def __init__(self, player_name: str = "Player", ai: Optional[AIStrategy] = None,
+                 rng: Optional[random.Random] = None, log: bool = True,
+                 source: Optional[MagicSource] = None):
         self.state = GameState(
             player=Wand(owner=player_name),
-            enemy=Wand(owner=ai.name if ai else "Opponent")
+            enemy=Wand(owner=ai.name if ai else "Opponent"),
+            log_enabled=log
         )
         self.ai = ai
+        self.source = source if source is not None else RandomMagicSource(rng)
+        self.last_spell: Optional[Spell] = None
+
+    def reset(self, player_name: str, enemy_name: str = "Opponent",
+              source: Optional[MagicSource] = None):
+        """Reuse this engine for a new game (pooled multiplayer rooms)"""
+        self.state.reset(player_name, enemy_name)
+        if source is not None:
+            self.source = source
+        self.last_spell = None
 
     def start_incoming_phase(self):
         """Start incoming phase - magic arrives for both players"""
         # Generate magic for player
-        player_magic = generate_incoming_magic(3)
+        player_magic = self.source.draw(3)
         player_stats = apply_incoming_magic(self.state.player, player_magic)
 
-        self.state.add_log(f"{self.state.player.owner} incoming: "
-                          f"{player_stats['accepted']} accepted, "
-                          f"{player_stats['dropped']} dropped, "
-                          f"{player_stats['overflow']} overflow")
+        self.state.log_event("incoming", self.state.player.owner,
+                             player_stats['accepted'], player_stats['dropped'],
+                             player_stats['overflow'])
 
         # Generate magic for enemy
-        enemy_magic = generate_incoming_magic(3)
+        enemy_magic = self.source.draw(3)
         enemy_stats = apply_incoming_magic(self.state.enemy, enemy_magic)
 
-        self.state.add_log(f"{self.state.enemy.owner} incoming: "
-                          f"{enemy_stats['accepted']} accepted, "
-                          f"{enemy_stats['dropped']} dropped, "
-                          f"{enemy_stats['overflow']} overflow")
+        self.state.log_event("incoming", self.state.enemy.owner,
+                             enemy_stats['accepted'], enemy_stats['dropped'],
+                             enemy_stats['overflow'])
 
         return player_stats, enemy_stats
 
     def start_action_phase(self):
         """Start action phase - players can configure and cast"""
+        self.state.turn.phase = "action"
+        self.state.turn.start_time = time.time()
+
         # Refresh CPU for both
         self.state.player.refresh_cpu()
         self.state.enemy.refresh_cpu()
@@ -187,26 +304,38 @@ class GameEngine:
         if not self.ai:
             return
 
+        if self.run_ai_turn(self.ai, self.state.enemy, self.state.player):
+            self.state.enemy_no_cast_turns = 0
+        else:
+            self.state.enemy_no_cast_turns += 1
+
+    def run_ai_turn(self, ai: AIStrategy, me: Wand, target: Wand) -> bool:
+        """
+        Apply one AI's decisions to a wand - defenses, cast, discard
+        Used for the enemy AI, and for the player side in AI-vs-AI runs
+
+        Returns:
+            True if the AI chose to cast (resets its starvation counter)
+        """
         # AI configures defenses
-        new_rules = self.ai.configure_defenses(self.state, self.state.enemy)
+        new_rules = ai.configure_defenses(self.state, me)
         for rule in new_rules:
-            if self.state.enemy.spend_cpu(20):  # Cost to configure
-                self.state.enemy.rules.add_rule(rule)
-                self.state.add_log(f"{self.state.enemy.owner} configured rule")
+            if me.spend_cpu(20):  # Cost to configure
+                me.rules.add_rule(rule)
+                self.state.log_event("rule", me.owner)
 
         # AI decides to cast
-        cast_count = self.ai.choose_cast(self.state, self.state.enemy)
+        cast_count = ai.choose_cast(self.state, me)
         if cast_count:
-            self.cast_spell(self.state.enemy, self.state.player, cast_count)
-            self.state.enemy_no_cast_turns = 0
-        else:
-            self.state.enemy_no_cast_turns += 1
+            self.cast_spell(me, target, cast_count)
 
         # AI decides to discard
-        discard_idx = self.ai.should_discard(self.state, self.state.enemy)
+        discard_idx = ai.should_discard(self.state, me)
         if discard_idx is not None:
-            if self.state.enemy.spend_cpu(5):
-                self.state.enemy.buffer.discard(discard_idx)
+            if me.spend_cpu(5):
+                me.buffer.discard(discard_idx)
+
+        return bool(cast_count)
 
     def cast_spell(self, caster: Wand, target: Wand, essence_count: int) -> bool:
         """
@@ -226,27 +355,26 @@ class GameEngine:
         if caster.buffer.count < essence_count:
             return False
 
-        # Consume essences
-        essences = caster.buffer.consume(essence_count)
-
-        # Lookup spell
-        spell = lookup_spell(essences)
+        # Consume essences - lookup by packed code, nothing allocated
+        spell = lookup_spell_code(caster.buffer.peek_code(essence_count))
+        caster.buffer.pull(essence_count)
+        self.last_spell = spell
 
         # Apply effects
         if spell.damage > 0:
             # Damage spell
             target.take_damage(spell.damage)
-            self.state.add_log(f"{caster.owner} cast {spell.name} → "
-                             f"{spell.damage} dmg to {target.owner}")
+            self.state.log_event("cast_damage", caster.owner,
+                                 spell.name, spell.damage, target.owner)
         elif spell.damage < 0:
             # Healing spell
             caster.heal(abs(spell.damage))
-            self.state.add_log(f"{caster.owner} cast {spell.name} → "
-                             f"healed {abs(spell.damage)} HP")
+            self.state.log_event("cast_heal", caster.owner,
+                                 spell.name, -spell.damage)
 
         if spell.shield > 0:
             caster.add_shield(spell.shield)
-            self.state.add_log(f"{caster.owner} gained {spell.shield} shield")
+            self.state.log_event("shield", caster.owner, spell.shield)
 
         return True
 
@@ -261,7 +389,7 @@ class GameEngine:
         """Player adds defense rule"""
         if self.state.player.spend_cpu(20):
             if self.state.player.rules.add_rule(rule):
-                self.state.add_log(f"{self.state.player.owner} configured rule")
+                self.state.log_event("rule", self.state.player.owner)
                 return True
         return False
 
@@ -269,7 +397,7 @@ class GameEngine:
         """Player discards essence"""
         if self.state.player.spend_cpu(5):
             if self.state.player.buffer.discard(index):
-                self.state.add_log(f"{self.state.player.owner} discarded essence")
+                self.state.log_event("discard", self.state.player.owner)
                 return True
         return False
 
@@ -307,7 +435,7 @@ class GameEngine:
                 'buffer_count': self.state.enemy.buffer.count,  # Hidden in real game
                 'rules_count': len(self.state.enemy.rules.rules),
             },
-            'log': self.state.log[-5:],  # Last 5 messages
+            'log': self.state.recent_log(5),  # Last 5 messages
             'winner': self.state.winner,
         }
 
@@ -0,0 +1,218 @@
+"""
+Server Metrics - Counters, histograms and event-loop health
+
+Like /proc/net/snmp plus a scheduler latency probe: plain integer
+counters bumped on the hot path, bucketed histograms for latencies, and
+gauges read from the server only when someone asks. The server keeps a
+Metrics only when instrumentation is on; off, every hook is a single
+`is None` test.
+
+Exposed as Prometheus-style text (render, served on /metrics by
+serve_metrics) and as a JSON-able dict (snapshot, for the admin
+`stats` message).
+"""
+
+import asyncio
+import bisect
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+# Latency bucket upper bounds in seconds (100us .. 10s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = "kernel_duel"
+
+
+# ============================================================================
+# Histogram - Fixed buckets
+# ============================================================================
+
+class Histogram:
+    """
+    Bucketed distribution - observe() is a bisect and two adds
+
+    Data:
+        bounds: Bucket upper bounds (ascending, +Inf implied)
+        buckets: Count per bucket (not cumulative; last is +Inf)
+        count: Observations
+        total: Sum of observations
+    """
+    __slots__ = ("bounds", "buckets", "count", "total")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding quantile q (0 if empty)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+# ============================================================================
+# Metrics - Everything one server process counts
+# ============================================================================
+
+class Metrics:
+    """
+    Instrumentation for one MultiplayerServer
+
+    Data:
+        messages: Inbound messages per type
+        handlers: Handler latency per message type
+        loop_lag: How late the event loop woke a sleeping sampler
+        bytes_in/bytes_out: Frame payload bytes (JSON text counts as chars)
+        connections: Open websocket connections
+        gauges: name -> callable, read at render/snapshot time
+    """
+    def __init__(self):
+        self.messages: Dict[str, int] = {}
+        self.handlers: Dict[str, Histogram] = {}
+        self.loop_lag = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections = 0
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.started = time.monotonic()
+
+    def message_in(self, msg_type: str, size: int):
+        """Count one inbound frame"""
+        self.messages[msg_type] = self.messages.get(msg_type, 0) + 1
+        self.bytes_in += size
+
+    def handled(self, msg_type: str, seconds: float):
+        """Record how long a handler took"""
+        histogram = self.handlers.get(msg_type)
+        if histogram is None:
+            histogram = self.handlers[msg_type] = Histogram()
+        histogram.observe(seconds)
+
+    async def sample_loop_lag(self, interval: float = 0.25):
+        """Sleep interval, forever, recording how late each wakeup is"""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(time.monotonic() - start - interval, 0.0))
+
+    def snapshot(self) -> dict:
+        """Everything as plain data (admin stats message)"""
+        return {
+            "uptime": time.monotonic() - self.started,
+            "connections": self.connections,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "messages": dict(self.messages),
+            "handlers": {name: h.summary() for name, h in self.handlers.items()},
+            "loop_lag": self.loop_lag.summary(),
+            **{name: read() for name, read in self.gauges.items()},
+        }
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        p = METRIC_PREFIX
+        lines = [f"# TYPE {p}_messages_total counter"]
+        lines += [f'{p}_messages_total{{type="{t}"}} {n}' for t, n in sorted(self.messages.items())]
+        lines.append(f"# TYPE {p}_handler_seconds histogram")
+        for t, histogram in sorted(self.handlers.items()):
+            lines += _render_histogram(f"{p}_handler_seconds", histogram, f'type="{t}",')
+        lines.append(f"# TYPE {p}_loop_lag_seconds histogram")
+        lines += _render_histogram(f"{p}_loop_lag_seconds", self.loop_lag, "")
+        for name, value in (("bytes_in_total", self.bytes_in),
+                            ("bytes_out_total", self.bytes_out)):
+            lines += [f"# TYPE {p}_{name} counter", f"{p}_{name} {value}"]
+        gauges = {"connections": self.connections,
+                  **{name: read() for name, read in self.gauges.items()}}
+        for name, value in gauges.items():
+            lines += [f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name: str, histogram: Histogram, labels: str) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, n in zip(histogram.bounds + ("+Inf",), histogram.buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    labels = labels.rstrip(",")
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.total}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+# ============================================================================
+# Metered Socket - Counts bytes out
+# ============================================================================
+
+class MeteredSocket:
+    """
+    Websocket wrapper counting bytes sent - only used with metrics on
+
+    Data:
+        websocket: Wrapped connection (everything but send passes through)
+        metrics: Where bytes_out is counted
+    """
+    __slots__ = ("websocket", "metrics")
+
+    def __init__(self, websocket, metrics: Metrics):
+        self.websocket = websocket
+        self.metrics = metrics
+
+    async def send(self, frame):
+        self.metrics.bytes_out += len(frame)
+        await self.websocket.send(frame)
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+
+# ============================================================================
+# HTTP Endpoint
+# ============================================================================
+
+async def serve_metrics(metrics: Metrics, host: str, port: int) -> asyncio.AbstractServer:
+    """Minimal HTTP server answering GET /metrics (bind it to localhost)"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Skip headers
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -4,13 +4,321 @@ Multiplayer Server for Kernel Duel
 WebSocket-based server for 1v1 PvP matches
 """
 
+import argparse
 import asyncio
+import hmac
+import multiprocessing
+import os
+import signal
 import websockets
+import websockets.exceptions
 import json
+import random
+import sys
+import time
 import uuid
-from typing import Dict, Optional, Set
-from game_engine import GameEngine
-from core_data import DefenseRule, RuleAction, RuleChain, MagicType
+from collections import Counter, deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, List, Optional, Set
+from game_engine import GameEngine, RandomMagicSource
+from core_data import DefenseRule, RuleAction, RuleChain, MagicType, format_log_event
+from network_protocol import (SERVER_WIRE, ProtocolError, decode_client_frame, diff_state,
+                              encode_for, pack_batch, validate_client_message)
+from matchmaking import MatchQueue
+from metrics import MeteredSocket, Metrics, serve_metrics
+from replay_log import INCOMING, RESOLVE, TIMEOUT, TRIM, MatchRecorder, ReplayLog
+from room_snapshot import RoomSnapshot, new_tokens, pack_room, unpack_room, write_snapshot
+from timer_wheel import Timer, TimerWheel
+
+PHASE_TICK = 0.1  # Seconds per timer wheel tick (deadline resolution)
+WAITING_TIMEOUT = 300.0  # Seconds a new room waits for an opponent
+IDLE_TIMEOUT = 120.0  # Seconds without a client message before a room is reaped
+# Approximate bytes of log + delta history per room. Measured over seeded
+# matches: a full log is ~21KB (all a JSON room counts), acking delta rooms
+# peak ~42KB. Delta clients that stop acking reach ~120KB.
+ROOM_MEMORY_BUDGET = 96 * 1024
+ROOM_POOL_SIZE = 64  # Closed rooms kept for reuse
+OUTBOX_LIMIT = 64  # Frames queued per client before it counts as slow
+SLOW_CLIENT_GRACE = 2.0  # Seconds a client may stay over OUTBOX_LIMIT
+MAX_BATCH_ACTIONS = 16  # Actions applied from one "actions" message
+SPECTATOR_INTERVAL = 0.5  # Seconds between spectator snapshots of one room
+SPECTATOR_LIMIT = 10000  # Spectators per room
+SPECTATOR_CHUNK = 256  # Spectators queued per event-loop pass during a fan-out
+MALFORMED_LIMIT = 16  # Malformed messages a connection may send before it is dropped
+
+# Per-action messages a seated player can send, alone or inside "actions"
+ROOM_ACTIONS = ("cast", "configure_rule", "discard")
+
+# Whose view an action changed
+STATE_UNCHANGED, STATE_OWN, STATE_BOTH = 0, 1, 2
+
+
+# ============================================================================
+# Outbox - Per-client send queue
+# ============================================================================
+
+class Outbox:
+    """
+    Bounded send queue drained by its own writer task - like a socket's
+    qdisc: producers enqueue and return, one writer talks to the NIC
+
+    Handlers put() frames and never wait on the client. A state frame
+    replaces any state frame still queued (each view supersedes the
+    last - deltas are always against the client's acked base). A client
+    that stays over limit for grace seconds, or reaches 4x limit, is
+    disconnected.
+
+    Batch clients are corked: whatever is queued when the writer wakes -
+    everything handlers produced in that loop iteration - goes out as one
+    "batch" frame, one write.
+
+    Data:
+        websocket: Client connection (only the writer awaits it)
+        limit: Frames queued before the client counts as slow
+        grace: Seconds it may stay over limit
+        stats: Shared counter - coalesced frames, slow disconnects
+        pending: Frames queued and not yet handed to the socket
+        closed: No more frames accepted
+        batch: Client accepts batch frames (set from its join)
+    """
+    def __init__(self, websocket, limit: int = OUTBOX_LIMIT,
+                 grace: float = SLOW_CLIENT_GRACE, stats: Optional[Counter] = None):
+        self.websocket = websocket
+        self.limit = limit
+        self.grace = grace
+        self.stats = stats if stats is not None else Counter()
+        self.pending = 0
+        self.closed = False
+        self.batch = False
+        self._queue: deque = deque()  # [frame] cells; None = coalesced away
+        self._state: Optional[list] = None  # Queued state frame cell
+        self._over_since: Optional[float] = None
+        self._hangup = False
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+
+    def put(self, frame, state: bool = False) -> bool:
+        """Queue a frame - False if the client is gone (or just got dropped)"""
+        if self.closed:
+            return False
+        cell = [frame]
+        if state:
+            if self._state is not None:
+                self._state[0] = None
+                self.pending -= 1
+                self.stats["coalesced"] += 1
+            self._state = cell
+        self._queue.append(cell)
+        self.pending += 1
+        if self.pending > self.limit and self._too_slow():
+            self.abort()
+            return False
+        self._kick()
+        return True
+
+    def _too_slow(self) -> bool:
+        now = time.monotonic()
+        if self._over_since is None:
+            self._over_since = now
+        return self.pending > 4 * self.limit or now - self._over_since > self.grace
+
+    def _kick(self):
+        self._idle.clear()
+        self._wakeup.set()
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        queue = self._queue
+        try:
+            while True:
+                while queue:
+                    if self.batch and len(queue) > 1:
+                        frames = [cell[0] for cell in queue if cell[0] is not None]
+                        queue.clear()
+                        self._state = None
+                        self.pending = 0
+                        frame = pack_batch(frames) if len(frames) > 1 else frames[0]
+                    else:
+                        cell = queue.popleft()
+                        frame = cell[0]
+                        if frame is None:
+                            continue
+                        if cell is self._state:
+                            self._state = None
+                        self.pending -= 1
+                    await self.websocket.send(frame)
+                    if self.pending <= self.limit:
+                        self._over_since = None
+                if self.closed:
+                    if self._hangup:
+                        await self.websocket.close()
+                    self._idle.set()
+                    return
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+        except websockets.exceptions.ConnectionClosed:
+            self.closed = True
+            queue.clear()
+            self.pending = 0
+            self._idle.set()
+
+    def close(self, hangup: bool = False):
+        """Accept nothing more; the writer sends what's queued, then hangs up if asked"""
+        if self.closed:
+            return
+        self.closed = True
+        self._hangup = hangup
+        self._kick()
+
+    def abort(self):
+        """Slow client - drop everything queued and disconnect"""
+        self.closed = True
+        self.stats["slow_disconnects"] += 1
+        self._queue.clear()
+        self._state = None
+        self.pending = 0
+        self._idle.set()
+        if self._writer is not None:
+            self._writer.cancel()
+        asyncio.get_running_loop().create_task(self.websocket.close(1008, "Too slow"))
+
+    async def flush(self):
+        """Wait until everything queued so far went out"""
+        await self._idle.wait()
+
+
+# ============================================================================
+# State Sync - Versioned per-player views
+# ============================================================================
+
+SYNC_HISTORY = 16  # Unacked views kept before a delta client falls back to full
+
+
+class StateSync:
+    """
+    Versioned view stream for one player - like TCP's snd_una/snd_nxt
+
+    Every distinct view gets the next version. Delta clients are sent
+    only the fields changed since the last version they acked; anyone
+    else (or a client whose ack fell out of history) gets a full
+    state_update.
+
+    Data:
+        delta: Client opted in to state_delta messages
+        version: Latest version sent
+        acked: Latest version the client acknowledged (0 = none)
+        history: version -> view, from acked onward (only the latest
+            for non-delta clients - they never send the acks that prune it)
+    """
+    def __init__(self, delta: bool = False):
+        self.delta = delta
+        self.version = 0
+        self.acked = 0
+        self.history: Dict[int, dict] = {}
+
+    def update(self, view: dict, full: bool = False) -> Optional[dict]:
+        """Message taking the client to view (None if it already has it)"""
+        latest = self.history.get(self.version)
+        if latest == view and not full:
+            return None
+
+        self.version += 1
+        if not self.delta:
+            self.history = {self.version: view}
+            return {**view, "version": self.version}
+
+        self.history[self.version] = view
+        if len(self.history) > SYNC_HISTORY:
+            del self.history[min(self.history)]
+
+        base = self.history.get(self.acked)
+        if full or base is None:
+            return {**view, "version": self.version}
+        return {
+            "type": "state_delta",
+            "version": self.version,
+            "base": self.acked,
+            "changes": diff_state(base, view)
+        }
+
+    def trim(self):
+        """Drop every view but the latest - the next update goes out full"""
+        latest = self.history.get(self.version)
+        self.history = {self.version: latest} if latest is not None else {}
+        self.acked = 0
+
+    def ack(self, version: int):
+        """Client applied version - later deltas are relative to it"""
+        if version in self.history and version > self.acked:
+            self.acked = version
+            for old in [v for v in self.history if v < version]:
+                del self.history[old]
+
+
+# ============================================================================
+# State Frame - One tick of room state, encoded once for every recipient
+# ============================================================================
+
+class StateFrame:
+    """
+    Room state at one tick - like a shared skb with per-destination headers
+
+    The parts every recipient sees (turn, phase, public wand fields,
+    log) are built and JSON-encoded once; only the owner's buffer is
+    spliced in per player. Binary frames carry the log as structured
+    events rather than the formatted lines.
+
+    Data:
+        views: player_id -> view dict (sub-objects shared between views)
+        events: The log events behind the views' log lines
+    """
+    def __init__(self, room: 'GameRoom'):
+        state = room.engine.state
+        wands = (state.player, state.enemy)
+        public = [{
+            "hp": wand.hp,
+            "shield": wand.shield,
+            "cpu": wand.cpu,
+            "buffer_count": wand.buffer.count,
+            "rules_count": len(wand.rules.rules)
+        } for wand in wands]
+        self._buffers = [[int(e) for e in wand.buffer.essences] for wand in wands]
+        self.events = list(islice(state.log, max(len(state.log) - 5, 0), None))
+        log = [format_log_event(event) for event in self.events]
+
+        self.views = {
+            pid: {
+                "type": "state_update",
+                "turn": state.turn.turn_number,
+                "phase": state.turn.phase,
+                "your_wand": {**public[pid], "buffer": self._buffers[pid]},
+                "enemy_wand": public[1 - pid],  # Buffer count only - contents hidden
+                "log": log
+            } for pid in (0, 1)
+        }
+
+        self._head = '{"type": "state_update", "turn": %d, "phase": %s, ' % (
+            state.turn.turn_number, json.dumps(state.turn.phase))
+        self._public = [json.dumps(p) for p in public]
+        self._log = json.dumps(log)
+        self._encoded_buffers = [None, None]
+
+    def encode(self, player_id: int, version: int, encoding: str = "json"):
+        """Full state_update for player_id, spliced from the shared parts"""
+        if encoding == "binary":
+            return SERVER_WIRE.encode({**self.views[player_id], "log": self.events,
+                                       "version": version})
+        buffer = self._encoded_buffers[player_id]
+        if buffer is None:
+            buffer = self._encoded_buffers[player_id] = json.dumps(self._buffers[player_id])
+        return (f'{self._head}"your_wand": {self._public[player_id][:-1]}, '
+                f'"buffer": {buffer}}}, "enemy_wand": {self._public[1 - player_id]}, '
+                f'"log": {self._log}, "version": {version}}}')
 
 
 # ============================================================================
@@ -23,24 +331,91 @@ class GameRoom:
 
     Data:
         room_id: Unique room identifier
+        seed: Incoming magic seed - replays the essence stream of this match
         engine: Game engine instance
-        players: Dict of player_id -> websocket
+        players: Dict of player_id -> Outbox
         player_names: Dict of player_id -> name
         ready_status: Which players are ready for next phase
+        sync: Dict of player_id -> StateSync
+        encodings: Dict of player_id -> negotiated wire encoding ("json"/"binary")
+        deadline: Pending phase deadline on the server's timer wheel
+        lifecycle: Pending waiting/idle timeout on the same wheel
+        last_activity: Monotonic time of the last client message
+        busy: Coroutines currently working on this room
+        closed: Room was reaped/abandoned; goes back to its pool when not busy
+        spectators: Dict of spectator Outbox -> its wire encoding
+        spectators_dirty: State changed since spectators were last sent a snapshot
+        spectators_sent: Monotonic time of that snapshot
+        recorder: Replay recorder for this match (None = not recorded)
+        resume_tokens: Per-seat resume tokens once the room went through a snapshot
     """
-    def __init__(self, room_id: str, player1_name: str):
+    def __init__(self, room_id: str, player1_name: str, seed: Optional[int] = None):
+        self.engine = GameEngine(player_name=player1_name, ai=None,
+                                 source=RandomMagicSource(random.Random()))
+        self.players: Dict[int, Outbox] = {}
+        self.spectators: Dict[Outbox, str] = {}
+        self.sync = {0: StateSync(), 1: StateSync()}
+        self.pool: Optional['RoomPool'] = None
+        self.reset(room_id, player1_name, seed)
+
+    def reset(self, room_id: str, player1_name: str, seed: Optional[int] = None):
+        """Start a new match in this room, reusing engine, wands and RNG"""
         self.room_id = room_id
-        self.engine = GameEngine(player_name=player1_name, ai=None)
-        self.players: Dict[int, websockets.WebSocketServerProtocol] = {}
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self.engine.reset(player1_name)
+        self.engine.source.rng.seed(self.seed)
+        self.players.clear()
+        self.spectators.clear()
+        self.spectators_dirty = False
+        self.spectators_sent = 0.0
         self.player_names = {0: player1_name, 1: None}
         self.ready_status = {0: False, 1: False}
-        self.phase_start_time = 0
+        for sync in self.sync.values():
+            sync.__init__()
+        self.encodings = {0: "json", 1: "json"}
+        self.deadline: Optional[Timer] = None
+        self.lifecycle: Optional[Timer] = None
+        self.last_activity = time.monotonic()
+        self.busy = 0
+        self.closed = False
         self.game_started = False
+        self.recorder: Optional[MatchRecorder] = None
+        self.resume_tokens: Optional[tuple] = None
+
+    @contextmanager
+    def in_use(self):
+        """Hold the room across awaits - a closed room isn't recycled under us"""
+        self.busy += 1
+        try:
+            yield self
+        finally:
+            self.busy -= 1
+            if self.closed and not self.busy and self.pool is not None:
+                self.pool.release(self)
 
-    def add_player(self, player_id: int, websocket, name: str):
-        """Add player to room"""
-        self.players[player_id] = websocket
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the parts that grow: log and delta history"""
+        total = _deep_size(self.engine.state.log)
+        for sync in self.sync.values():
+            if sync.delta:  # Non-delta clients only hold their latest view
+                total += _deep_size(sync.history)
+        return total
+
+    def trim(self):
+        """Shrink to the minimum: empty log, latest view only per player"""
+        self.engine.state.log.clear()
+        for sync in self.sync.values():
+            sync.trim()
+
+    def add_player(self, player_id: int, websocket, name: str, delta: bool = False,
+                   encoding: str = "json"):
+        """Add player to room (a bare websocket gets its own Outbox)"""
+        self.players[player_id] = websocket if isinstance(websocket, Outbox) else Outbox(websocket)
         self.player_names[player_id] = name
+        self.sync[player_id] = StateSync(delta)
+        self.encodings[player_id] = encoding
+        if self.recorder is not None:
+            self.recorder.join(player_id, name)
 
         if player_id == 1:
             # Second player joined, update enemy name
@@ -64,153 +439,685 @@ class GameRoom:
         else:
             return self.engine.state.player
 
-    async def broadcast(self, message: dict, exclude: Optional[int] = None):
-        """Send message to all players (optionally exclude one)"""
-        tasks = []
-        for pid, ws in self.players.items():
+    def broadcast(self, message: dict, exclude: Optional[int] = None,
+                  spectators: bool = False):
+        """Queue message for all players (optionally exclude one, optionally
+        spectators too) - encoded once per encoding"""
+        frames = {}
+        for pid, outbox in self.players.items():
             if exclude is None or pid != exclude:
-                tasks.append(ws.send(json.dumps(message)))
-
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+                encoding = self.encodings[pid]
+                if encoding not in frames:
+                    frames[encoding] = encode_for(encoding, message)
+                outbox.put(frames[encoding])
+        if spectators:
+            for outbox, encoding in self.spectators.items():
+                if encoding not in frames:
+                    frames[encoding] = encode_for(encoding, message)
+                outbox.put(frames[encoding])
 
-    async def send_to(self, player_id: int, message: dict):
-        """Send message to specific player"""
+    def send_to(self, player_id: int, message: dict):
+        """Queue message for specific player"""
         if player_id in self.players:
-            await self.players[player_id].send(json.dumps(message))
+            self.players[player_id].put(encode_for(self.encodings[player_id], message))
 
-    def get_state_for_player(self, player_id: int) -> dict:
-        """Get game state from player's perspective"""
-        my_wand = self.get_wand(player_id)
-        enemy_wand = self.get_enemy_wand(player_id)
+    def send_state(self, player_id: int, full: bool = False,
+                   frame: Optional[StateFrame] = None):
+        """Send player whatever changed since their last acked state"""
+        if frame is None:
+            frame = StateFrame(self)
+        message = self.sync[player_id].update(frame.views[player_id], full)
+        if message is None or player_id not in self.players:
+            return
+        self.spectators_dirty = True
+        encoding = self.encodings[player_id]
+        if message["type"] == "state_update":
+            data = frame.encode(player_id, message["version"], encoding)
+        else:
+            data = encode_for(encoding, message)
+        self.players[player_id].put(data, state=True)
 
+    def send_states(self):
+        """Send both players their state from one shared frame"""
+        frame = StateFrame(self)
+        for pid in (0, 1):
+            self.send_state(pid, frame=frame)
+
+    def spectator_view(self) -> dict:
+        """Both wands' public fields - buffer contents hidden from everyone"""
+        state = self.engine.state
+        public = [{
+            "hp": wand.hp,
+            "shield": wand.shield,
+            "cpu": wand.cpu,
+            "buffer_count": wand.buffer.count,
+            "rules_count": len(wand.rules.rules)
+        } for wand in (state.player, state.enemy)]
         return {
-            "type": "state_update",
-            "turn": self.engine.state.turn.turn_number,
-            "phase": self.engine.state.turn.phase,
-            "your_wand": {
-                "hp": my_wand.hp,
-                "shield": my_wand.shield,
-                "cpu": my_wand.cpu,
-                "buffer": [int(e) for e in my_wand.buffer.essences],
-                "buffer_count": my_wand.buffer.count,
-                "rules_count": len(my_wand.rules.rules)
-            },
-            "enemy_wand": {
-                "hp": enemy_wand.hp,
-                "shield": enemy_wand.shield,
-                "cpu": enemy_wand.cpu,
-                "buffer_count": enemy_wand.buffer.count,  # Hidden
-                "rules_count": len(enemy_wand.rules.rules)
-            },
-            "log": self.engine.state.log[-5:]
+            "type": "spectator_update",
+            "turn": state.turn.turn_number,
+            "phase": state.turn.phase,
+            "host": self.player_names[0] or "",
+            "guest": self.player_names[1] or "",
+            "host_wand": public[0],
+            "guest_wand": public[1],
+            "log": state.recent_log(5),
+            "spectators": len(self.spectators)
         }
 
+    async def send_spectators(self, now: float):
+        """
+        Snapshot to every spectator - encoded once per encoding, the same
+        bytes object queued for all of them (a slow spectator's stale
+        snapshot is replaced, not queued behind)
+
+        Queued SPECTATOR_CHUNK spectators at a time, yielding to the loop
+        in between, so a full room doesn't stall every other room for the
+        whole fan-out. A change during the fan-out marks the room dirty
+        again for the next tick.
+        """
+        view = self.spectator_view()
+        self.spectators_dirty = False
+        self.spectators_sent = now
+        crowd = list(self.spectators.items())  # Joins/leaves while we yield
+        frames = {}
+        with self.in_use():
+            for start in range(0, len(crowd), SPECTATOR_CHUNK):
+                if start:
+                    await asyncio.sleep(0)
+                    if self.closed:
+                        return
+                for outbox, encoding in islice(crowd, start, start + SPECTATOR_CHUNK):
+                    frame = frames.get(encoding)
+                    if frame is None:
+                        frame = frames[encoding] = encode_for(encoding, view)
+                    outbox.put(frame, state=True)
+
+    async def flush(self):
+        """Wait until every player's queued frames went out"""
+        for outbox in list(self.players.values()):
+            await outbox.flush()
+
+    def get_state_for_player(self, player_id: int) -> dict:
+        """Get game state from player's perspective"""
+        return StateFrame(self).views[player_id]
+
+
+def _deep_size(obj) -> int:
+    """sys.getsizeof over nested dicts/lists/tuples/deques"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key) + _deep_size(value)
+    elif isinstance(obj, (list, tuple, deque)):
+        for item in obj:
+            size += _deep_size(item)
+    return size
+
+
+# ============================================================================
+# Room Pool - Recycled rooms
+# ============================================================================
+
+class RoomPool:
+    """
+    Free list of closed rooms - like a kmem_cache for GameRoom
+
+    A recycled room keeps its GameEngine, both Wands, their essence
+    buffers and rule sets, and its Random; acquire() only rewrites
+    per-game values. A released room lets go of its clients - players,
+    spectators, and its place in the server's watched set - so a pooled
+    room pins no sockets.
+
+    Data:
+        limit: Closed rooms kept (the rest are left to the GC)
+        created: Rooms allocated new
+        reused: Rooms handed out again from the free list
+        watched: The server's rooms-with-spectators set (None = no server)
+    """
+    def __init__(self, limit: int = ROOM_POOL_SIZE,
+                 watched: Optional[Set[GameRoom]] = None):
+        self.limit = limit
+        self.created = 0
+        self.reused = 0
+        self.watched = watched
+        self._free: List[GameRoom] = []
+
+    def __len__(self) -> int:
+        return len(self._free)
+
+    def acquire(self, room_id: str, player1_name: str,
+                seed: Optional[int] = None) -> GameRoom:
+        """A fresh room - recycled when one is free"""
+        if self._free:
+            room = self._free.pop()
+            room.reset(room_id, player1_name, seed)
+            self.reused += 1
+        else:
+            room = GameRoom(room_id, player1_name, seed)
+            room.pool = self
+            self.created += 1
+        return room
+
+    def release(self, room: GameRoom):
+        """Take a closed room back once nothing is using it"""
+        room.closed = True
+        if room.busy or room in self._free:
+            return  # the last in_use() exit hands it back
+        room.players.clear()  # Don't pin sockets while pooled
+        for outbox in room.spectators:
+            outbox.close(hangup=True)  # No-op if close_room already did
+        room.spectators.clear()
+        if self.watched is not None:
+            self.watched.discard(room)
+        if len(self._free) < self.limit:
+            self._free.append(room)
+
 
 # ============================================================================
 # Server - Manages rooms and connections
 # ============================================================================
 
+class ClientSession:
+    """
+    One client connection - what handle_client knows about it
+
+    Data:
+        outbox: Send queue for the client connection
+        name: Player name from join
+        delta: Client opted in to state_delta messages
+        encoding: Negotiated wire encoding ("json"/"binary")
+        room_id: Room the client sits in (None until seated)
+        player_id: Seat in that room
+        ticket: Matchmaking ticket while queued
+        watching: Room the client spectates (None unless spectating)
+        malformed: Messages from this client rejected as malformed
+    """
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+        self.name = "Player"
+        self.delta = False
+        self.encoding = "json"
+        self.room_id: Optional[str] = None
+        self.player_id: Optional[int] = None
+        self.ticket: Optional[int] = None
+        self.watching: Optional[GameRoom] = None
+        self.malformed = 0
+
+    def send(self, message: dict):
+        """Queue message in this client's encoding"""
+        self.outbox.put(encode_for(self.encoding, message))
+
+
+def room_shard(room_id: str) -> Optional[int]:
+    """Shard that owns room_id ("<shard>-<id>"), or None for unsharded ids"""
+    shard, sep, _ = room_id.partition("-")
+    return int(shard) if sep and shard.isdigit() else None
+
+
 class MultiplayerServer:
     """
     Main server managing multiple game rooms
 
+    In sharded mode every shard runs one of these in its own process.
+    Room ids carry the owning shard as a prefix, which is the whole room
+    directory: a join for another shard's room is answered with a
+    redirect to that shard's direct port, so each room's state lives in
+    exactly one process.
+
     Data:
         rooms: Dict of room_id -> GameRoom
-        waiting_players: Players waiting for match
+        queue: Matchmaking queue (players who joined with a rating)
+        timers: Phase deadlines and room timeouts (one wheel, one task)
+        pool: Closed rooms recycled for new matches
+        reclaimed: Closed rooms counted by reason (waiting/idle/disconnect)
+        trimmed: Rooms shrunk for going over ROOM_MEMORY_BUDGET
+        timer_errors: Timer or spectator work whose room raised (logged, skipped)
+        shard_id: This process's shard (None when unsharded)
+        shard_ports: Direct port per shard, indexed by shard id
+        metrics: Instrumentation (None = off, every hook is one test)
+        admin_token: Secret the admin stats message must carry
+        watched: Rooms with spectators
+        spectator_interval: Minimum seconds between a room's spectator snapshots
+        outbox_stats: Coalesced frames and slow-client disconnects, all clients
+        malformed: Rejected client messages by ProtocolError kind
+        handlers: Message type -> handler for any connection (join, stats)
+        room_handlers: Message type -> handler for seated players
+        actions: cast/configure_rule/discard -> apply function
+        replay: Replay log every match is recorded to (None = off)
+        snapshot: Previous process's rooms, mapped, restored on resume
+        restored: Snapshot record offset -> room_id it was restored as
+        draining: Shutting down - no new joins
     """
-    def __init__(self):
+    def __init__(self, shard_id: Optional[int] = None,
+                 shard_ports: Optional[List[int]] = None,
+                 metrics: Optional[Metrics] = None,
+                 admin_token: Optional[str] = None,
+                 spectator_interval: float = SPECTATOR_INTERVAL,
+                 replay: Optional[ReplayLog] = None,
+                 snapshot: Optional[RoomSnapshot] = None):
         self.rooms: Dict[str, GameRoom] = {}
-        self.waiting_players: Dict[websockets.WebSocketServerProtocol, str] = {}
+        self.queue = MatchQueue()
+        self.timers = TimerWheel(tick=PHASE_TICK, now=time.monotonic())
+        self.watched: Set[GameRoom] = set()
+        self.pool = RoomPool(watched=self.watched)
+        self.reclaimed: Counter = Counter()
+        self.trimmed = 0
+        self.timer_errors = 0
+        self.shard_id = shard_id
+        self.shard_ports = shard_ports or []
+        self.metrics = metrics
+        self.admin_token = admin_token
+        self.outbox_stats: Counter = Counter()
+        self.spectator_interval = spectator_interval
+        self.malformed: Counter = Counter()
+        self.replay = replay
+        self.snapshot = snapshot
+        self.restored: Dict[int, str] = {}
+        self.draining = False
+
+        # Dispatch tables - message type -> handler (types are validated first)
+        self.handlers = {"join": self.handle_join, "stats": self.handle_stats}
+        self.room_handlers = {
+            **{kind: self.handle_room_action for kind in ROOM_ACTIONS},
+            "actions": self.handle_actions,
+            "ready": self.handle_ready,
+            "get_state": self.handle_get_state,
+            "resync": self.handle_get_state,
+            "ack": self.handle_ack,
+        }
+        self.actions = {"cast": self.apply_cast,
+                        "configure_rule": self.apply_configure_rule,
+                        "discard": self.apply_discard}
+        if metrics is not None:
+            metrics.gauges.update(
+                coalesced=lambda: self.outbox_stats["coalesced"],
+                slow_disconnects=lambda: self.outbox_stats["slow_disconnects"],
+                rooms=lambda: len(self.rooms),
+                matches=lambda: sum(room.game_started for room in self.rooms.values()),
+                queued=lambda: len(self.queue),
+                spectators=lambda: sum(len(room.spectators) for room in self.watched),
+                malformed=lambda: sum(self.malformed.values()),
+                rooms_pooled=lambda: len(self.pool),
+                match_wait_p50=lambda: self.queue.wait_percentiles((50,))["p50"],
+                match_wait_p99=lambda: self.queue.wait_percentiles((99,))["p99"])
+
+    def new_room_id(self) -> str:
+        """Fresh room id, prefixed with our shard when sharded"""
+        room_id = str(uuid.uuid4())[:8]
+        return room_id if self.shard_id is None else f"{self.shard_id}-{room_id}"
+
+    def owner_port(self, room_id: str) -> Optional[int]:
+        """Direct port of the shard owning room_id, if that isn't us"""
+        shard = room_shard(room_id)
+        if shard is None or shard == self.shard_id or shard >= len(self.shard_ports):
+            return None
+        return self.shard_ports[shard]
 
     async def handle_client(self, websocket, path):
         """Handle new client connection"""
-        player_id = None
-        room_id = None
+        metrics = self.metrics
+        frames = websocket
+        if metrics is not None:
+            websocket = MeteredSocket(websocket, metrics)
+            metrics.connections += 1
+        session = ClientSession(Outbox(websocket, stats=self.outbox_stats))
 
         try:
-            async for message in websocket:
-                data = json.loads(message)
-                msg_type = data.get("type")
-
-                if msg_type == "join":
-                    # Player wants to join
-                    player_name = data.get("player_name", "Player")
-                    requested_room = data.get("room_id")
-
-                    if requested_room and requested_room in self.rooms:
-                        # Join existing room
-                        room = self.rooms[requested_room]
-                        if not room.is_full():
-                            player_id = 1
-                            room_id = requested_room
-                            room.add_player(player_id, websocket, player_name)
-
-                            await websocket.send(json.dumps({
-                                "type": "joined",
-                                "player_id": player_id,
-                                "room_id": room_id,
-                                "message": f"Joined room {room_id}"
-                            }))
-
-                            # Start game!
-                            await self.start_game(room)
-                        else:
-                            await websocket.send(json.dumps({
-                                "type": "error",
-                                "message": "Room is full"
-                            }))
-                    else:
-                        # Create new room
-                        room_id = str(uuid.uuid4())[:8]
-                        room = GameRoom(room_id, player_name)
-                        player_id = 0
-                        room.add_player(player_id, websocket, player_name)
-                        self.rooms[room_id] = room
-
-                        await websocket.send(json.dumps({
-                            "type": "joined",
-                            "player_id": player_id,
-                            "room_id": room_id,
-                            "message": f"Created room {room_id}. Waiting for opponent..."
-                        }))
-
-                elif room_id:
+            async for message in frames:
+                try:
+                    data = decode_client_frame(message)
+                except ProtocolError as error:
+                    if metrics is not None:  # Abuse shows up in bytes_in too
+                        metrics.message_in("malformed", len(message))
+                    if self.reject(session, error):
+                        break
+                    continue
+                msg_type = data["type"]
+                if metrics is not None:
+                    metrics.message_in(msg_type, len(message))
+
+                handler = self.handlers.get(msg_type)
+                if handler is not None:
+                    if await handler(session, data):
+                        break
+
+                elif session.room_id in self.rooms:
                     # Player is in a room, handle game actions
-                    room = self.rooms[room_id]
-                    await self.handle_game_action(room, player_id, data)
+                    room = self.rooms[session.room_id]
+                    room.last_activity = time.monotonic()
+                    with room.in_use():
+                        if metrics is None:
+                            await self.handle_game_action(room, session.player_id, data)
+                        else:
+                            start = time.perf_counter()
+                            await self.handle_game_action(room, session.player_id, data)
+                            metrics.handled(msg_type, time.perf_counter() - start)
 
         except websockets.exceptions.ConnectionClosed:
-            print(f"Player {player_id} disconnected from room {room_id}")
+            print(f"Player {session.player_id} disconnected from room {session.room_id}")
         finally:
-            # Cleanup
-            if room_id and room_id in self.rooms:
+            # Cleanup - our own queued replies still go out
+            session.outbox.close()
+            if metrics is not None:
+                metrics.connections -= 1
+            if session.ticket is not None:
+                self.queue.remove(session.ticket)
+            if session.watching is not None:
+                self.unwatch(session.watching, session)
+            room = self.rooms.get(session.room_id) if session.room_id else None
+            if room is not None:
                 # Notify other player
-                room = self.rooms[room_id]
-                await room.broadcast({
+                await self.close_room(room, "disconnect", "Opponent disconnected",
+                                      exclude=session.player_id)
+            await session.outbox.flush()
+
+    def reject(self, session: 'ClientSession', error: ProtocolError) -> bool:
+        """Count a malformed frame and tell the client - True once it
+        passed MALFORMED_LIMIT and should be disconnected"""
+        self.malformed[error.kind] += 1
+        session.malformed += 1
+        if session.malformed > MALFORMED_LIMIT:
+            session.send({"type": "error", "message": "Too many malformed messages"})
+            return True
+        session.send({"type": "error", "message": f"Malformed message: {error}"})
+        return False
+
+    async def handle_join(self, session: 'ClientSession', data: dict) -> bool:
+        """Seat, queue or attach a spectator - True if the client was redirected"""
+        if (session.room_id is not None or session.ticket is not None
+                or session.watching is not None):
+            return False  # Already joined
+        session.name = data.get("player_name") or "Player"
+        requested_room = data.get("room_id")
+        rating = data.get("rating") or 0
+        session.delta = bool(data.get("delta"))
+        session.encoding = "binary" if data.get("encoding") == "binary" else "json"
+        session.outbox.batch = bool(data.get("batch"))
+
+        owner_port = self.owner_port(requested_room) if requested_room else None
+        if owner_port is not None:
+            # Room lives in another shard - send the client there
+            session.send({
+                "type": "redirect",
+                "room_id": requested_room,
+                "port": owner_port
+            })
+            return True
+
+        if self.draining:
+            session.send({"type": "error", "message": "Server restarting"})
+            return True
+
+        if data.get("resume"):
+            # Back after a restart - take the seat the token was issued for
+            await self.resume(session, data["resume"])
+
+        elif data.get("spectate"):
+            # Watch a match - rate-limited snapshots, no seat
+            room = self.rooms.get(requested_room or "")
+            if room is None:
+                session.send({"type": "error", "message": "Room not found"})
+            elif len(room.spectators) >= SPECTATOR_LIMIT:
+                session.send({"type": "error", "message": "Too many spectators"})
+            else:
+                self.watch(room, session)
+
+        elif not requested_room and rating > 0:
+            # Matchmaking - paired with a similar rating on a later tick
+            session.ticket = self.queue.add(rating, session).ticket_id
+            session.send({
+                "type": "queued",
+                "ticket": session.ticket,
+                "rating": rating
+            })
+
+        elif requested_room and requested_room in self.rooms:
+            # Join existing room (a restored one only takes its own players back)
+            room = self.rooms[requested_room]
+            if not room.game_started:
+                with room.in_use():
+                    self.seat(room, 1, session, f"Joined room {requested_room}")
+
+                    # Start game!
+                    await self.start_game(room)
+            else:
+                session.send({
                     "type": "error",
-                    "message": "Opponent disconnected"
-                }, exclude=player_id)
-                del self.rooms[room_id]
+                    "message": "Room is full"
+                })
+        else:
+            # Create new room
+            room = self.open_room(session.name)
+            room.lifecycle = self.timers.schedule(
+                room.last_activity + WAITING_TIMEOUT, ("waiting", room.room_id))
+            with room.in_use():
+                self.seat(room, 0, session,
+                          f"Created room {room.room_id}. Waiting for opponent...")
+        return False
+
+    async def resume(self, session: 'ClientSession', token: str):
+        """Seat a client where its resume token says, restoring the room
+        from the snapshot if it's the first of the two back"""
+        try:
+            entry = self.snapshot.find(bytes.fromhex(token)) if self.snapshot else None
+        except ValueError:
+            entry = None
+        if entry is None:
+            session.send({"type": "error", "message": "Unknown resume token"})
+            return
+        offset, length, seat = entry
+        room_id = self.restored.get(offset)
+        room = self.restore_room(offset, length) if room_id is None else self.rooms.get(room_id)
+        if room is None or seat in room.players:
+            session.send({"type": "error", "message": "Resume token expired"})
+            return
+        session.name = room.player_names[seat]
+        with room.in_use():
+            self.seat(room, seat, session, f"Resumed room {room.room_id}")
+            room.send_state(seat, full=True)
+
+    def restore_room(self, offset: int, length: int) -> GameRoom:
+        """
+        Decode one snapshot record into a live room, mid-action-phase
+
+        The phase clock restarts now; a player who never comes back is
+        treated like an idle one (turns time out, the room is reaped).
+        """
+        room = self.pool.acquire("", "")
+        unpack_room(self.snapshot.record(offset, length), room)
+        self.rooms[room.room_id] = room
+        self.restored[offset] = room.room_id
+        if self.replay is not None:
+            room.recorder = self.replay.recorder(room.seed, room.room_id, room.player_names[0])
+        room.lifecycle = self.timers.schedule(
+            room.last_activity + IDLE_TIMEOUT, ("idle", room.room_id))
+        room.deadline = self.timers.schedule(
+            time.monotonic() + room.engine.state.turn.action_duration, ("phase", room.room_id))
+        return room
+
+    async def drain(self, path: str) -> int:
+        """
+        Stop taking joins and write every live match to a snapshot at path
+
+        Players of those matches get a "restarting" message with their
+        seat's resume token, then every room is closed. Rooms that aren't
+        mid-match (waiting, finished) are just closed. Rooms from our own
+        snapshot nobody came back for are carried over.
+
+        Returns: Rooms written
+        """
+        self.draining = True
+        records, outboxes = [], []
+        for room in list(self.rooms.values()):
+            outboxes += room.players.values()
+            if room.game_started and not room.engine.state.winner:
+                if room.resume_tokens is None:
+                    room.resume_tokens = new_tokens()
+                records.append(pack_room(room, room.resume_tokens))
+                for player_id in room.players:
+                    room.send_to(player_id, {
+                        "type": "restarting",
+                        "room_id": room.room_id,
+                        "player_id": player_id,
+                        "token": room.resume_tokens[player_id].hex()
+                    })
+                if room.recorder is not None:
+                    room.recorder.flush()  # The match goes on in the next process's log
+                    room.recorder = None
+            await self.close_room(room, "drain", "Server restarting")
+        if self.snapshot is not None:
+            records += [record for offset, record in self.snapshot.records()
+                        if offset not in self.restored]
+        count = write_snapshot(path, records)
+        for outbox in outboxes:
+            await outbox.flush()
+        return count
+
+    def watch(self, room: GameRoom, session: 'ClientSession'):
+        """Attach a spectator and send it the current snapshot right away"""
+        session.watching = room
+        room.spectators[session.outbox] = session.encoding
+        self.watched.add(room)
+        session.send({
+            "type": "joined",
+            "player_id": -1,
+            "room_id": room.room_id,
+            "message": f"Spectating {room.player_names[0]} vs {room.player_names[1]}"
+        })
+        session.outbox.put(encode_for(session.encoding, room.spectator_view()), state=True)
+
+    def unwatch(self, room: GameRoom, session: 'ClientSession'):
+        """Detach a spectator (no-op if the room was closed and recycled since)"""
+        session.watching = None
+        if room.spectators.pop(session.outbox, None) is not None and not room.spectators:
+            self.watched.discard(room)
+
+    async def spectator_tick(self, now: float):
+        """Send watched rooms that changed a snapshot, at most one per spectator_interval"""
+        for room in list(self.watched):  # Fan-outs yield - rooms may come and go
+            if room.spectators_dirty and now - room.spectators_sent >= self.spectator_interval:
+                try:
+                    await room.send_spectators(now)
+                except Exception as error:  # Same task as the timers - keep going
+                    self.timer_errors += 1
+                    print(f"Room {room.room_id} spectator update failed: {error!r}",
+                          file=sys.stderr)
+
+    def open_room(self, player1_name: str, seed: Optional[int] = None) -> GameRoom:
+        """Register a room for a new match, recycled from the pool if possible"""
+        room = self.pool.acquire(self.new_room_id(), player1_name, seed)
+        self.rooms[room.room_id] = room
+        if self.replay is not None:
+            room.recorder = self.replay.recorder(room.seed, room.room_id, player1_name)
+        return room
+
+    async def close_room(self, room: GameRoom, reason: str, message: str,
+                         exclude: Optional[int] = None):
+        """Drop a room, tell its players why, and recycle it"""
+        # Unregister first - both players can be leaving at once
+        del self.rooms[room.room_id]
+        self.timers.cancel(room.deadline)
+        self.timers.cancel(room.lifecycle)
+        self.reclaimed[reason] += 1
+        self.watched.discard(room)
+        if room.recorder is not None:
+            room.recorder.close(reason)
+            room.recorder = None
+        with room.in_use():
+            room.closed = True
+            room.broadcast({"type": "error", "message": message}, exclude=exclude,
+                           spectators=True)
+            for outbox in room.spectators:
+                outbox.close(hangup=True)
+            room.spectators.clear()
+            if reason != "disconnect":
+                for outbox in room.players.values():
+                    outbox.close(hangup=True)
+
+    async def handle_stats(self, session: 'ClientSession', data: dict):
+        """Admin stats message - metrics snapshot for holders of the token"""
+        token = data.get("token")
+        if self.metrics is None:
+            session.send({"type": "error", "message": "Metrics disabled"})
+        elif (self.admin_token is None or type(token) is not str
+              or not hmac.compare_digest(token.encode(), self.admin_token.encode())):
+            session.send({"type": "error", "message": "Not authorized"})
+        else:
+            session.send({
+                "type": "stats",
+                "metrics": {**self.metrics.snapshot(), **self.lifecycle_report()}
+            })
+
+    def lifecycle_report(self) -> Dict[str, object]:
+        """Room counts for monitoring - live, allocated, recycled, reclaimed - and queue waits"""
+        return {
+            "rooms_active": len(self.rooms),
+            "rooms_created": self.pool.created,
+            "rooms_reused": self.pool.reused,
+            "rooms_pooled": len(self.pool),
+            "reclaimed": dict(self.reclaimed),
+            "trimmed": self.trimmed,
+            "timer_errors": self.timer_errors,
+            "match_wait": self.queue.wait_percentiles(),
+        }
+
+    def seat(self, room: GameRoom, player_id: int, session: 'ClientSession',
+                   message: str):
+        """Put a session in a room seat and tell the client"""
+        session.room_id = room.room_id
+        session.player_id = player_id
+        session.ticket = None
+        room.add_player(player_id, session.outbox, session.name,
+                        session.delta, session.encoding)
+        session.send({
+            "type": "joined",
+            "player_id": player_id,
+            "room_id": room.room_id,
+            "message": message
+        })
+
+    async def run_matchmaking(self, interval: float = 0.25):
+        """Pair queued players in batches, forever"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.matchmaking_tick()
+
+    async def matchmaking_tick(self):
+        """One batch of queue pairings - each pair gets a fresh room"""
+        for first, second in self.queue.tick():
+            host, guest = first.payload, second.payload
+            room = self.open_room(host.name)
+            with room.in_use():
+                self.seat(room, 0, host, f"Matched with {guest.name} "
+                                               f"(rating {second.rating})")
+                self.seat(room, 1, guest, f"Matched with {host.name} "
+                                                f"(rating {first.rating})")
+                await self.start_game(room)
 
     async def start_game(self, room: GameRoom):
         """Start game when both players joined"""
         room.game_started = True
+        self.timers.cancel(room.lifecycle)
+        room.lifecycle = self.timers.schedule(
+            room.last_activity + IDLE_TIMEOUT, ("idle", room.room_id))
 
         # Send initial state to both players
-        await room.send_to(0, room.get_state_for_player(0))
-        await room.send_to(1, room.get_state_for_player(1))
+        room.send_states()
 
         # Start first turn
         await self.run_incoming_phase(room)
 
     async def run_incoming_phase(self, room: GameRoom):
         """Run incoming phase for room"""
+        if room.recorder is not None:
+            room.recorder.phase(INCOMING)
+
         # Generate and apply incoming magic
         p_stats, e_stats = room.engine.start_incoming_phase()
 
         # Notify both players
-        await room.send_to(0, {
+        room.send_to(0, {
             "type": "magic_incoming",
             "your_received": p_stats['accepted'],
             "your_dropped": p_stats['dropped'],
@@ -218,7 +1125,7 @@ class MultiplayerServer:
             "enemy_received": e_stats['accepted']
         })
 
-        await room.send_to(1, {
+        room.send_to(1, {
             "type": "magic_incoming",
             "your_received": e_stats['accepted'],
             "your_dropped": e_stats['dropped'],
@@ -226,143 +1133,342 @@ class MultiplayerServer:
             "enemy_received": p_stats['accepted']
         })
 
-        # Move to action phase
+        # Move to action phase - resolves when both are ready or time runs out
         room.engine.start_action_phase()
         room.ready_status = {0: False, 1: False}
+        self.timers.cancel(room.deadline)
+        room.deadline = self.timers.schedule(
+            time.monotonic() + room.engine.state.turn.action_duration,
+            ("phase", room.room_id))
 
         # Send updated states
-        await room.send_to(0, room.get_state_for_player(0))
-        await room.send_to(1, room.get_state_for_player(1))
+        room.send_states()
 
-    async def handle_game_action(self, room: GameRoom, player_id: int, data: dict):
-        """Handle player action in game"""
-        msg_type = data.get("type")
-
-        if msg_type == "cast":
-            # Player casts spell
-            essence_count = data.get("essence_count", 1)
-            my_wand = room.get_wand(player_id)
-            enemy_wand = room.get_enemy_wand(player_id)
-
-            success = room.engine.cast_spell(my_wand, enemy_wand, essence_count)
-
-            if success:
-                # Get spell info
-                from spell_database import lookup_spell
-                essences = my_wand.buffer.essences[:essence_count]
-                spell = lookup_spell(essences)
-
-                await room.send_to(player_id, {
-                    "type": "action_result",
-                    "success": True,
-                    "message": f"Cast {spell.name}!",
-                    "spell_cast": spell.name
-                })
+    async def resolve_turn(self, room: GameRoom):
+        """End the action phase - game over or on to the next turn"""
+        self.timers.cancel(room.deadline)
+        room.deadline = None
+        recorder = room.recorder
+        if recorder is not None:
+            recorder.phase(RESOLVE)
+        winner = room.engine.end_turn()
+        if room.memory_usage() > ROOM_MEMORY_BUDGET:
+            if recorder is not None:
+                recorder.phase(TRIM)
+            room.trim()
+            self.trimmed += 1
 
-                # Update both players
-                await room.send_to(0, room.get_state_for_player(0))
-                await room.send_to(1, room.get_state_for_player(1))
-            else:
-                await room.send_to(player_id, {
-                    "type": "action_result",
-                    "success": False,
-                    "message": "Cast failed"
-                })
+        if winner:
+            # Game over
+            room.broadcast({
+                "type": "game_over",
+                "winner": winner,
+                "reason": "hp"
+            }, spectators=True)
+        else:
+            # Next turn
+            await self.run_incoming_phase(room)
 
-        elif msg_type == "configure_rule":
-            # Player configures defense rule
-            my_wand = room.get_wand(player_id)
-
-            # Parse rule
-            chain_str = data.get("chain", "PREROUTING")
-            action_str = data.get("action", "DROP")
-            magic_type_val = data.get("magic_type")
-            source_filter = data.get("source_filter", False)
-
-            chain = RuleChain[chain_str]
-            action = RuleAction[action_str]
-            magic_type = MagicType(magic_type_val) if magic_type_val else None
-
-            rule = DefenseRule(
-                chain=chain,
-                action=action,
-                magic_type=magic_type,
-                source_filter=source_filter
-            )
-
-            if my_wand.spend_cpu(20):
-                if my_wand.rules.add_rule(rule):
-                    await room.send_to(player_id, {
-                        "type": "action_result",
-                        "success": True,
-                        "message": "Rule configured"
-                    })
-                    await room.send_to(player_id, room.get_state_for_player(player_id))
+    async def run_timers(self):
+        """Drive every room's deadlines and timeouts from one wheel, and
+        spectator snapshots, forever"""
+        while True:
+            await asyncio.sleep(PHASE_TICK)
+            now = time.monotonic()
+            await self.expire_deadlines(now)
+            await self.spectator_tick(now)
+
+    async def expire_deadlines(self, now: float):
+        """
+        Fire every timer due by now
+
+        phase: the action phase ran out - resolve the turn
+        waiting: nobody joined the room - reap it
+        idle: no client message since last_activity - reap it, or check
+              again IDLE_TIMEOUT after the latest message (activity never
+              touches the wheel)
+
+        One task runs this for every room, so a room that raises is logged
+        and skipped - its idle timer still reaps it - and the rest still fire.
+        """
+        for kind, room_id in self.timers.advance(now):
+            room = self.rooms.get(room_id)
+            if room is None:
+                continue
+            try:
+                if kind == "phase":
+                    room.deadline = None
+                    if room.recorder is not None:
+                        room.recorder.phase(TIMEOUT)
+                    room.engine.state.log_event("timeout", None)
+                    with room.in_use():
+                        await self.resolve_turn(room)
+                elif kind == "idle" and room.last_activity + IDLE_TIMEOUT > now:
+                    room.lifecycle = self.timers.schedule(
+                        room.last_activity + IDLE_TIMEOUT, ("idle", room_id))
                 else:
-                    await room.send_to(player_id, {
-                        "type": "action_result",
-                        "success": False,
-                        "message": "Too many rules"
-                    })
+                    room.lifecycle = None
+                    await self.close_room(room, kind, f"Room closed ({kind})")
+            except Exception as error:
+                self.timer_errors += 1
+                print(f"Room {room_id} {kind} timer failed: {error!r}", file=sys.stderr)
+
+    async def handle_game_action(self, room: GameRoom, player_id: int, data: dict):
+        """Handle player action in game - data was validated on receipt"""
+        handler = self.room_handlers.get(data.get("type"))
+        if handler is not None:
+            await handler(room, player_id, data)
+
+    async def handle_room_action(self, room: GameRoom, player_id: int, data: dict):
+        """Cast, configure_rule or discard - one result, then the changed state"""
+        result, changed = self.apply_action(room, player_id, data)
+        if result["success"] or data["type"] != "discard":  # Failed discards stay silent
+            room.send_to(player_id, {"type": "action_result", **result})
+        self.send_changed(room, player_id, changed)
+
+    async def handle_actions(self, room: GameRoom, player_id: int, data: dict):
+        """Several actions in one pass - one results message, one state update"""
+        results, changed, ready = [], STATE_UNCHANGED, False
+        for action in (data.get("actions") or [])[:MAX_BATCH_ACTIONS]:
+            try:
+                kind = validate_client_message(action)
+            except ProtocolError as error:
+                self.malformed[error.kind] += 1
+                results.append({"success": False, "message": str(error)})
+                continue
+            if kind in ROOM_ACTIONS:
+                result, scope = self.apply_action(room, player_id, action)
+                results.append(result)
+                changed = max(changed, scope)
+            elif kind == "ready":
+                ready = True
+                results.append({"success": True, "message": "Ready"})
             else:
-                await room.send_to(player_id, {
-                    "type": "action_result",
-                    "success": False,
-                    "message": "Not enough CPU"
-                })
+                results.append({"success": False, "message": "Unknown action"})
+        room.send_to(player_id, {"type": "action_results", "results": results})
+        self.send_changed(room, player_id, changed)
+        if ready:
+            await self.player_ready(room, player_id)
 
-        elif msg_type == "discard":
-            # Player discards essence
-            my_wand = room.get_wand(player_id)
-            index = data.get("index", 0)
-
-            if my_wand.spend_cpu(5):
-                if my_wand.buffer.discard(index):
-                    await room.send_to(player_id, {
-                        "type": "action_result",
-                        "success": True,
-                        "message": "Essence discarded"
-                    })
-                    await room.send_to(player_id, room.get_state_for_player(player_id))
-
-        elif msg_type == "ready":
-            # Player ready for next phase
-            room.ready_status[player_id] = True
-
-            if all(room.ready_status.values()):
-                # Both ready, end turn
-                winner = room.engine.end_turn()
-
-                if winner:
-                    # Game over
-                    await room.broadcast({
-                        "type": "game_over",
-                        "winner": winner,
-                        "reason": "hp"
-                    })
-                else:
-                    # Next turn
-                    await self.run_incoming_phase(room)
+    async def handle_ready(self, room: GameRoom, player_id: int, data: dict):
+        await self.player_ready(room, player_id)
+
+    async def handle_get_state(self, room: GameRoom, player_id: int, data: dict):
+        """get_state or resync - send current state in full"""
+        room.send_state(player_id, full=True)
+
+    async def handle_ack(self, room: GameRoom, player_id: int, data: dict):
+        """Delta client applied a state version"""
+        room.sync[player_id].ack(data.get("version") or 0)
+
+    def apply_action(self, room: GameRoom, player_id: int, data: dict):
+        """
+        Apply one cast/configure_rule/discard to the room
+
+        Returns (result, changed): result is the action_result body,
+        changed says whose state moved (STATE_UNCHANGED/OWN/BOTH).
+        """
+        return self.actions[data["type"]](room, player_id, data)
+
+    def apply_cast(self, room: GameRoom, player_id: int, data: dict):
+        essence_count = data.get("essence_count")
+        if essence_count is None:
+            essence_count = 1
+        if room.recorder is not None:
+            room.recorder.cast(player_id, essence_count)
+        my_wand = room.get_wand(player_id)
+        enemy_wand = room.get_enemy_wand(player_id)
+
+        if room.engine.cast_spell(my_wand, enemy_wand, essence_count):
+            # Spell the engine looked up before consuming the essences
+            spell = room.engine.last_spell
+            return ({"success": True, "message": f"Cast {spell.name}!",
+                     "spell_cast": spell.name}, STATE_BOTH)
+        return {"success": False, "message": "Cast failed"}, STATE_UNCHANGED
 
-        elif msg_type == "get_state":
-            # Send current state
-            await room.send_to(player_id, room.get_state_for_player(player_id))
+    def apply_configure_rule(self, room: GameRoom, player_id: int, data: dict):
+        # Names and magic type range were checked by the validator
+        magic_type_val = data.get("magic_type")
+        rule = DefenseRule(
+            chain=RuleChain[data.get("chain") or "PREROUTING"],
+            action=RuleAction[data.get("action") or "DROP"],
+            magic_type=MagicType(magic_type_val) if magic_type_val else None,
+            source_filter=bool(data.get("source_filter"))
+        )
+        if room.recorder is not None:
+            room.recorder.rule(player_id, rule)
 
+        my_wand = room.get_wand(player_id)
+        if not my_wand.spend_cpu(20):
+            return {"success": False, "message": "Not enough CPU"}, STATE_UNCHANGED
+        if my_wand.rules.add_rule(rule):
+            return {"success": True, "message": "Rule configured"}, STATE_OWN
+        return {"success": False, "message": "Too many rules"}, STATE_UNCHANGED
 
-async def main():
+    def apply_discard(self, room: GameRoom, player_id: int, data: dict):
+        index = data.get("index") or 0
+        if room.recorder is not None:
+            room.recorder.discard(player_id, index)
+        my_wand = room.get_wand(player_id)
+        if my_wand.spend_cpu(5) and my_wand.buffer.discard(index):
+            return {"success": True, "message": "Essence discarded"}, STATE_OWN
+        return {"success": False, "message": "Discard failed"}, STATE_UNCHANGED
+
+    def send_changed(self, room: GameRoom, player_id: int, changed: int):
+        """State update for whoever an action touched"""
+        if changed == STATE_BOTH:
+            room.send_states()
+        elif changed == STATE_OWN:
+            room.send_state(player_id)
+
+    async def player_ready(self, room: GameRoom, player_id: int):
+        """Player ready for next phase"""
+        room.ready_status[player_id] = True
+
+        if all(room.ready_status.values()):
+            # Both ready, end turn without waiting for the deadline
+            await self.resolve_turn(room)
+
+
+# ============================================================================
+# Entry Point - Single process or one process per shard
+# ============================================================================
+
+async def serve(server: MultiplayerServer, host: str, port: int,
+                direct_port: Optional[int] = None, metrics_port: Optional[int] = None,
+                snapshot_path: Optional[str] = None):
+    """
+    Run server on port until cancelled
+
+    Shards all bind the public port with SO_REUSEPORT (the kernel spreads
+    new connections across them) plus their own direct port for
+    redirected joins. With metrics on, the loop-lag sampler runs too and
+    metrics_port (localhost only) answers GET /metrics. With a replay log,
+    its writer runs too and flushes on the way out. With snapshot_path,
+    SIGTERM drains every live room into it and returns.
+    """
+    background = [asyncio.create_task(server.run_matchmaking()),
+                  asyncio.create_task(server.run_timers())]
+    if server.metrics is not None:
+        background.append(asyncio.create_task(server.metrics.sample_loop_lag()))
+        if metrics_port:
+            endpoint = await serve_metrics(server.metrics, "127.0.0.1", metrics_port)
+            background.append(asyncio.create_task(endpoint.serve_forever()))
+    if server.replay is not None:
+        background.append(asyncio.create_task(server.replay.run()))
+
+    stop = asyncio.get_running_loop().create_future()  # Never resolves without a snapshot
+    if snapshot_path:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: stop.done() or stop.set_result(None))
+
+    async def run_until_stopped():
+        await stop
+        rooms = await server.drain(snapshot_path)
+        print(f"Drained {rooms} rooms to {snapshot_path}")
+
+    try:
+        if direct_port is None:
+            async with websockets.serve(server.handle_client, host, port):
+                await run_until_stopped()
+        else:
+            async with websockets.serve(server.handle_client, host, port, reuse_port=True), \
+                    websockets.serve(server.handle_client, host, direct_port):
+                await run_until_stopped()
+    finally:
+        for room in server.rooms.values():
+            if room.recorder is not None:
+                room.recorder.flush()  # Unfinished matches go out with the final write
+        for task in background:
+            task.cancel()
+
+
+def open_snapshot(path: Optional[str]) -> Optional[RoomSnapshot]:
+    """Map the previous process's snapshot, if there is one"""
+    if path and os.path.exists(path):
+        snapshot = RoomSnapshot(path)
+        print(f"{len(snapshot)} rooms waiting in {path}")
+        return snapshot
+    return None
+
+
+def run_shard(shard_id: int, host: str, port: int, shard_ports: List[int],
+              metrics_port: Optional[int] = None, admin_token: Optional[str] = None,
+              spectator_interval: float = SPECTATOR_INTERVAL,
+              replay_dir: Optional[str] = None, snapshot_path: Optional[str] = None):
+    """Worker process entry point - one event loop, one slice of the rooms"""
+    metrics = Metrics() if metrics_port or admin_token else None
+    replay = ReplayLog(replay_dir, f"replay-shard{shard_id}") if replay_dir else None
+    if snapshot_path:
+        snapshot_path = f"{snapshot_path}.{shard_id}"
+    server = MultiplayerServer(shard_id, shard_ports, metrics, admin_token, spectator_interval,
+                               replay, open_snapshot(snapshot_path))
+    if metrics_port:
+        metrics_port += shard_id
+    try:
+        asyncio.run(serve(server, host, port, shard_ports[shard_id], metrics_port,
+                          snapshot_path))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv: Optional[List[str]] = None):
     """Start the multiplayer server"""
-    server = MultiplayerServer()
+    parser = argparse.ArgumentParser(description="Kernel Duel multiplayer server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Worker processes; shard i also listens on port+1+i")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Turn metrics on, serve /metrics here (shard i: +i)")
+    parser.add_argument("--admin-token", default=None,
+                        help="Turn metrics on, answer stats messages carrying this token")
+    parser.add_argument("--spectator-interval", type=float, default=SPECTATOR_INTERVAL,
+                        help="Minimum seconds between spectator snapshots of a room")
+    parser.add_argument("--replay-dir", default=None,
+                        help="Record every match to daily replay logs here (see replay.py)")
+    parser.add_argument("--snapshot", default=None,
+                        help="Resume rooms saved here at startup; SIGTERM saves live rooms here")
+    args = parser.parse_args(argv)
 
     print("=" * 60)
     print("Kernel Duel Multiplayer Server")
     print("=" * 60)
-    print("Starting WebSocket server on ws://localhost:8765")
-    print("Waiting for players to connect...")
-    print()
+    print(f"Starting WebSocket server on ws://{args.host}:{args.port}")
+
+    if args.shards <= 1:
+        print("Waiting for players to connect...")
+        print()
+        metrics = Metrics() if args.metrics_port or args.admin_token else None
+        replay = ReplayLog(args.replay_dir) if args.replay_dir else None
+        server = MultiplayerServer(metrics=metrics, admin_token=args.admin_token,
+                                   spectator_interval=args.spectator_interval,
+                                   replay=replay, snapshot=open_snapshot(args.snapshot))
+        asyncio.run(serve(server, args.host, args.port, metrics_port=args.metrics_port,
+                          snapshot_path=args.snapshot))
+        return
 
-    async with websockets.serve(server.handle_client, "localhost", 8765):
-        await asyncio.Future()  # Run forever
+    shard_ports = [args.port + 1 + i for i in range(args.shards)]
+    print(f"{args.shards} shards, direct ports {shard_ports[0]}-{shard_ports[-1]}")
+    print()
+    workers = [multiprocessing.Process(target=run_shard, name=f"shard-{i}",
+                                       args=(i, args.host, args.port, shard_ports,
+                                             args.metrics_port, args.admin_token,
+                                             args.spectator_interval, args.replay_dir,
+                                             args.snapshot))
+               for i in range(args.shards)]
+    for worker in workers:
+        worker.start()
+    # Pass SIGTERM on - stopping this process stops every shard (with
+    # --snapshot, each shard drains into its own PATH.<shard>)
+    signal.signal(signal.SIGTERM, lambda signum, frame: [w.terminate() for w in workers])
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
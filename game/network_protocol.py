@@ -1,9 +1,17 @@
 """
 Network Protocol for Kernel Duel Multiplayer
 
-Simple JSON-based protocol for client-server communication
+Simple JSON-based protocol for client-server communication, plus a
+compact binary encoding generated from the same schemas
 """
 
+import json
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core_data import LOG_FORMATS, MagicType, RuleAction, RuleChain, format_log_event
+from spell_database import SPELL_TABLE
+
 # ============================================================================
 # Message Types - Client to Server
 # ============================================================================
@@ -13,7 +21,13 @@ CLIENT_MESSAGES = {
     "join": {
         "type": "join",
         "player_name": str,
-        "room_id": str  # Optional, creates new room if None
+        "room_id": str,  # Optional, creates new room if None
+        "rating": int,  # Optional, > 0 without room_id enters matchmaking
+        "delta": bool,  # Optional, opt in to state_delta messages
+        "encoding": str,  # Optional, "binary" for WireFormat frames (default "json")
+        "batch": bool,  # Optional, accept "batch" frames (several messages per write)
+        "spectate": bool,  # Optional, watch room_id instead of playing
+        "resume": str  # Optional, token from "restarting" - take that seat back
     },
 
     # Actions (during action phase)
@@ -42,6 +56,28 @@ CLIENT_MESSAGES = {
     # Info requests
     "get_state": {
         "type": "get_state"
+    },
+
+    # State sync (delta clients)
+    "ack": {
+        "type": "ack",
+        "version": int  # Latest state version applied
+    },
+
+    "resync": {
+        "type": "resync"  # Lost track - send a full state_update
+    },
+
+    # Admin: metrics snapshot (server needs --admin-token)
+    "stats": {
+        "type": "stats",
+        "token": str
+    },
+
+    # Several actions applied in order in one handler pass
+    "actions": {
+        "type": "actions",
+        "actions": list  # cast/configure_rule/discard/ready messages, max 16
     }
 }
 
@@ -85,7 +121,16 @@ SERVER_MESSAGES = {
             "rules_count": int
         },
         "log": list,  # Recent messages
-        "phase_time_remaining": float
+        "phase_time_remaining": float,
+        "version": int  # Per-player state version
+    },
+
+    # Changed fields only, relative to a version the client acked
+    "state_delta": {
+        "type": "state_delta",
+        "version": int,  # Version after applying
+        "base": int,  # Version the changes apply to
+        "changes": dict  # Same shape as state_update, changed keys only
     },
 
     # Action results
@@ -109,10 +154,578 @@ SERVER_MESSAGES = {
         "type": "game_over",
         "winner": str,
         "reason": str  # "hp", "starvation"
+    },
+
+    # Sharded servers: the room lives on another shard
+    "redirect": {
+        "type": "redirect",
+        "room_id": str,
+        "port": int  # Reconnect to this port on the same host and join again
+    },
+
+    # Matchmaking: waiting for an opponent (then "joined" as usual)
+    "queued": {
+        "type": "queued",
+        "ticket": int,
+        "rating": int
+    },
+
+    # Admin: answer to stats
+    "stats": {
+        "type": "stats",
+        "metrics": dict  # Counters, handler/loop-lag summaries, gauges
+    },
+
+    # Answer to actions: one action_result body per action, in order
+    "action_results": {
+        "type": "action_results",
+        "results": list
+    },
+
+    # Clients that joined with "batch": every frame queued in one loop
+    # iteration, sent as one write
+    "batch": {
+        "type": "batch",
+        "frames": list  # Complete frames in send order (JSON objects / binary frames)
+    },
+
+    # Spectators: both sides' public state, rate-limited snapshots
+    "spectator_update": {
+        "type": "spectator_update",
+        "turn": int,
+        "phase": str,
+        "host": str,
+        "guest": str,
+        "host_wand": {
+            "hp": int,
+            "shield": int,
+            "cpu": int,
+            "buffer_count": int,  # Counts only - no buffer contents
+            "rules_count": int
+        },
+        "guest_wand": {
+            "hp": int,
+            "shield": int,
+            "cpu": int,
+            "buffer_count": int,
+            "rules_count": int
+        },
+        "log": list,
+        "spectators": int  # Watching this room
+    },
+
+    # Server draining for a restart - reconnect and join with "resume": token
+    "restarting": {
+        "type": "restarting",
+        "room_id": str,
+        "player_id": int,
+        "token": str
     }
 }
 
 
+# ============================================================================
+# State Deltas - Changed fields only
+# ============================================================================
+
+def _window_shift(old: list, new: list) -> Optional[int]:
+    """
+    How far new slides past old, if new is old with items dropped from
+    the front and appended at the back (the log and essence buffer move
+    like this). None if they share nothing.
+    """
+    for shift in range(len(old)):
+        overlap = len(old) - shift
+        if old[shift:] == new[:overlap]:
+            return shift
+    return None
+
+
+def diff_state(old: dict, new: dict) -> dict:
+    """
+    Fields of new that differ from old
+
+    Nested dicts (the wands) are diffed key by key. A list that slid
+    forward is sent as {"shift": dropped_from_front, "append": [...]};
+    other changed lists and scalars are sent whole. Views have a fixed
+    shape, so no key is ever removed.
+    """
+    changes = {}
+    for key, value in new.items():
+        before = old.get(key)
+        if value == before:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            changes[key] = diff_state(before, value)
+        elif isinstance(value, list) and isinstance(before, list):
+            shift = _window_shift(before, value)
+            if shift is None:
+                changes[key] = value
+            else:
+                changes[key] = {"shift": shift, "append": value[len(before) - shift:]}
+        else:
+            changes[key] = value
+    return changes
+
+
+def apply_state_delta(state: dict, changes: dict) -> dict:
+    """Client side of diff_state: new state dict with changes merged in"""
+    merged = dict(state)
+    for key, value in changes.items():
+        before = merged.get(key)
+        if isinstance(value, dict) and isinstance(before, dict):
+            merged[key] = apply_state_delta(before, value)
+        elif isinstance(value, dict) and isinstance(before, list):
+            merged[key] = before[value["shift"]:] + value["append"]
+        else:
+            merged[key] = value
+    return merged
+
+
+# ============================================================================
+# Binary Wire Format - Generated from the schemas above
+# ============================================================================
+
+# struct codes for int fields that don't fit the default signed 16-bit
+WIRE_INT_FORMATS = {
+    "version": "I",
+    "base": "I",
+    "player_id": "b",
+    "essence_count": "B",
+    "index": "b",
+    "magic_type": "B",  # 0 = None (all types)
+    "your_received": "B",
+    "your_dropped": "B",
+    "your_overflow": "B",
+    "enemy_received": "B",
+    "port": "H",
+    "ticket": "I",
+    "spectators": "I",
+}
+
+# Element encoding for list fields (anything else goes as a JSON blob)
+WIRE_LIST_ITEMS = {
+    "buffer": "B",  # Packed MagicType values
+    "log": "events",  # Structured log events (see _pack_log)
+    "frames": bytes,  # Nested binary frames (batch)
+}
+
+
+class MessageCodec:
+    """
+    Binary layout of one message type, compiled from its schema
+
+    Frame: type byte and every fixed-width field (int, bool, float -
+    nested wand dicts flattened) in one little-endian struct, then the
+    variable fields in schema order: str as u16 length + UTF-8, byte
+    lists as u8 count + bytes, string lists as u8 count + strings, log
+    lists as structured events (_pack_log), frame lists as u16 count +
+    (u32 length + frame) each, and anything else as a str of JSON.
+    Missing or None fields go out as 0/""/[].
+
+    encode/decode are generated Python source per message type, so a
+    frame is one struct call plus straight-line field code.
+
+    Data:
+        name: Message type
+        code: Type byte
+        fixed: struct.Struct for type byte + fixed-width fields
+        source: Generated encode/decode source (for debugging)
+    """
+    def __init__(self, name: str, code: int, schema: dict):
+        self.name = name
+        self.code = code
+        formats = ["<B"]
+        fixed_paths: List[Tuple[str, ...]] = []
+        var_fields: List[Tuple[Tuple[str, ...], str]] = []
+        self._compile(schema, (), formats, fixed_paths, var_fields)
+        self.fixed = struct.Struct("".join(formats))
+        self.source = self._generate(schema, fixed_paths, var_fields)
+        namespace = {"json": json, "struct": struct, "_pack_str": _pack_str,
+                     "_unpack_str": _unpack_str, "_pack_log": _pack_log,
+                     "_unpack_log": _unpack_log, "fixed": self.fixed, "CODE": code, "NAME": name}
+        exec(self.source, namespace)
+        self.encode = namespace["encode"]
+        self.decode = namespace["decode"]
+
+    @classmethod
+    def _compile(cls, schema: dict, prefix: Tuple[str, ...], formats: List[str],
+                 fixed_paths: list, var_fields: list):
+        for key, kind in schema.items():
+            if key == "type":
+                continue
+            path = prefix + (key,)
+            if isinstance(kind, dict):
+                cls._compile(kind, path, formats, fixed_paths, var_fields)
+            elif kind in (int, bool, float):
+                formats.append(WIRE_INT_FORMATS.get(key, "h") if kind is int
+                               else "?" if kind is bool else "f")
+                fixed_paths.append(path)
+            else:
+                item = WIRE_LIST_ITEMS.get(key) if kind is list else None
+                var_fields.append((path, "str" if kind is str else "bytes" if item == "B"
+                                   else "strs" if item is str else "blobs" if item is bytes
+                                   else "events" if item == "events" else "json"))
+
+    @staticmethod
+    def _generate(schema: dict, fixed_paths: list, var_fields: list) -> str:
+        """Straight-line encode/decode source for this layout"""
+        enc = ["def encode(message):"]
+        owners = {(): "message"}
+
+        def get(path):
+            # Bind each nested dict to a local once, then plain .get()s
+            for depth in range(1, len(path)):
+                prefix = path[:depth]
+                if prefix not in owners:
+                    owners[prefix] = f"d{len(owners)}"
+                    enc.append(f"    {owners[prefix]} = "
+                               f"{owners[prefix[:-1]]}.get({prefix[-1]!r}) or {{}}")
+            return f"{owners[path[:-1]]}.get({path[-1]!r})"
+
+        fixed_values = "".join(f"{get(p)} or 0, " for p in fixed_paths)
+        enc.append(f"    parts = [fixed.pack(CODE, {fixed_values})]")
+        dec = ["def decode(frame):",
+               "    f = fixed.unpack_from(frame)",
+               "    o = fixed.size"]
+        for i, (path, var) in enumerate(var_fields):
+            if var == "str":
+                enc.append(f"    _pack_str(parts, {get(path)} or '')")
+                dec.append(f"    v{i}, o = _unpack_str(frame, o)")
+            elif var == "bytes":
+                enc.append(f"    v = {get(path)} or ()")
+                enc.append("    parts.append(bytes((len(v),)))")
+                enc.append("    parts.append(bytes(v))")
+                dec.append("    n = frame[o]")
+                dec.append(f"    v{i} = list(frame[o + 1:o + 1 + n])")
+                dec.append("    o += 1 + n")
+            elif var == "strs":
+                enc.append(f"    v = {get(path)} or ()")
+                enc.append("    parts.append(bytes((len(v),)))")
+                enc.append("    for text in v:")
+                enc.append("        _pack_str(parts, text)")
+                dec.append("    n = frame[o]")
+                dec.append("    o += 1")
+                dec.append(f"    v{i} = []")
+                dec.append("    for _ in range(n):")
+                dec.append("        text, o = _unpack_str(frame, o)")
+                dec.append(f"        v{i}.append(text)")
+            elif var == "events":
+                enc.append(f"    _pack_log(parts, {get(path)} or ())")
+                dec.append(f"    v{i}, o = _unpack_log(frame, o)")
+            elif var == "blobs":
+                enc.append(f"    v = {get(path)} or ()")
+                enc.append("    parts.append(struct.pack('<H', len(v)))")
+                enc.append("    for blob in v:")
+                enc.append("        parts.append(struct.pack('<I', len(blob)))")
+                enc.append("        parts.append(blob)")
+                dec.append("    (n,) = struct.unpack_from('<H', frame, o)")
+                dec.append("    o += 2")
+                dec.append(f"    v{i} = []")
+                dec.append("    for _ in range(n):")
+                dec.append("        (size,) = struct.unpack_from('<I', frame, o)")
+                dec.append(f"        v{i}.append(bytes(frame[o + 4:o + 4 + size]))")
+                dec.append("        o += 4 + size")
+            else:
+                enc.append(f"    _pack_str(parts, json.dumps({get(path)}))")
+                dec.append(f"    v{i}, o = _unpack_str(frame, o)")
+                dec.append(f"    v{i} = json.loads(v{i})")
+        enc.append("    return b''.join(parts)")
+
+        slots = {path: f"f[{i + 1}]" for i, path in enumerate(fixed_paths)}
+        slots.update({path: f"v{i}" for i, (path, _) in enumerate(var_fields)})
+
+        def literal(schema, prefix):
+            items = [] if prefix else ["'type': NAME"]
+            for key, kind in schema.items():
+                if key == "type":
+                    continue
+                path = prefix + (key,)
+                value = literal(kind, path) if isinstance(kind, dict) else slots[path]
+                items.append(f"{key!r}: {value}")
+            return "{" + ", ".join(items) + "}"
+
+        dec.append(f"    return {literal(schema, ())}")
+        return "\n".join(enc) + "\n\n" + "\n".join(dec) + "\n"
+
+
+def _pack_str(parts: List[bytes], text: str):
+    data = text.encode()
+    parts.append(struct.pack("<H", len(data)))
+    parts.append(data)
+
+
+def _unpack_str(frame: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from("<H", frame, offset)
+    offset += 2
+    return frame[offset:offset + length].decode(), offset + length
+
+
+# Log events on the wire: kind ids follow LOG_FORMATS order (append new
+# kinds at the end, like message types), spells go as their interned
+# SPELL_TABLE code, and names as an index into a table sent up front
+LOG_KINDS = tuple(LOG_FORMATS)
+LOG_KIND_IDS = {kind: i for i, kind in enumerate(LOG_KINDS)}
+SPELL_CODES: Dict[str, int] = {}
+for _code, _spell in enumerate(SPELL_TABLE):
+    if _spell is not None:
+        SPELL_CODES.setdefault(_spell.name, _code)
+
+_EVENT = struct.Struct("<BHBB")  # kind, turn, actor (NO_NAME = none), value count
+_VALUE_INT = struct.Struct("<Bh")
+_VALUE_SPELL = struct.Struct("<BH")
+RAW_EVENT = 0xFF  # Kind byte of an already-formatted line (u16 length + UTF-8)
+NO_NAME = 0xFF
+INT_VALUE, SPELL_VALUE, NAME_VALUE, STR_VALUE = range(4)
+
+
+def _pack_log(parts: List[bytes], events):
+    """
+    Log as u8 name count + names, u8 event count, then per event its
+    _EVENT header and tagged values (i16, spell code, name index or str).
+    Events are GameState.log tuples; plain strings go through as RAW_EVENT.
+    """
+    names: Dict[str, int] = {}
+    body = [bytes((len(events),))]
+    for event in events:
+        if type(event) is not str and len(names) + 1 + len(event[3]) >= NO_NAME:
+            event = format_log_event(event)  # Name table full - send the line
+        if type(event) is str:
+            body.append(bytes((RAW_EVENT,)))
+            _pack_str(body, event)
+            continue
+        turn, kind, actor, values = event
+        actor_id = NO_NAME if actor is None else names.setdefault(actor, len(names))
+        body.append(_EVENT.pack(LOG_KIND_IDS[kind], turn, actor_id, len(values)))
+        for value in values:
+            if type(value) is int and -0x8000 <= value < 0x8000:
+                body.append(_VALUE_INT.pack(INT_VALUE, value))
+            elif type(value) is str and value in SPELL_CODES:
+                body.append(_VALUE_SPELL.pack(SPELL_VALUE, SPELL_CODES[value]))
+            elif type(value) is str:
+                body.append(bytes((NAME_VALUE, names.setdefault(value, len(names)))))
+            else:
+                body.append(bytes((STR_VALUE,)))
+                _pack_str(body, format(value))  # As LOG_FORMATS would render it
+    parts.append(bytes((len(names),)))
+    for name in names:
+        _pack_str(parts, name)
+    parts.extend(body)
+
+
+def _unpack_log(frame: bytes, offset: int) -> Tuple[List[str], int]:
+    """Log events back to the lines a JSON client gets (format_log_event)"""
+    names = []
+    count = frame[offset]
+    offset += 1
+    for _ in range(count):
+        name, offset = _unpack_str(frame, offset)
+        names.append(name)
+
+    log = []
+    count = frame[offset]
+    offset += 1
+    for _ in range(count):
+        if frame[offset] == RAW_EVENT:
+            line, offset = _unpack_str(frame, offset + 1)
+            log.append(line)
+            continue
+        kind, turn, actor, value_count = _EVENT.unpack_from(frame, offset)
+        offset += _EVENT.size
+        values = []
+        for _ in range(value_count):
+            tag = frame[offset]
+            if tag == INT_VALUE:
+                values.append(_VALUE_INT.unpack_from(frame, offset)[1])
+                offset += _VALUE_INT.size
+            elif tag == SPELL_VALUE:
+                values.append(SPELL_TABLE[_VALUE_SPELL.unpack_from(frame, offset)[1]].name)
+                offset += _VALUE_SPELL.size
+            elif tag == NAME_VALUE:
+                values.append(names[frame[offset + 1]])
+                offset += 2
+            else:
+                text, offset = _unpack_str(frame, offset + 1)
+                values.append(text)
+        log.append(format_log_event((turn, LOG_KINDS[kind],
+                                     None if actor == NO_NAME else names[actor], values)))
+    return log, offset
+
+
+class WireFormat:
+    """
+    Binary codecs for one direction of the protocol
+
+    Type bytes follow schema order starting at 1, so new message types
+    must be appended to keep old codes stable.
+
+    Data:
+        codecs: message type -> MessageCodec
+    """
+    def __init__(self, messages: dict):
+        self.codecs: Dict[str, MessageCodec] = {
+            name: MessageCodec(name, code, schema)
+            for code, (name, schema) in enumerate(messages.items(), start=1)
+        }
+        self._by_code = {codec.code: codec for codec in self.codecs.values()}
+
+    def encode(self, message: dict) -> bytes:
+        return self.codecs[message["type"]].encode(message)
+
+    def decode(self, frame: bytes) -> dict:
+        return self._by_code[frame[0]].decode(frame)
+
+
+CLIENT_WIRE = WireFormat(CLIENT_MESSAGES)
+SERVER_WIRE = WireFormat(SERVER_MESSAGES)
+
+
+def encode_for(encoding: str, message: dict):
+    """Server -> client frame in the client's negotiated encoding"""
+    if encoding == "binary":
+        return SERVER_WIRE.encode(message)
+    return json.dumps(message)
+
+
+def pack_batch(frames: list):
+    """
+    One "batch" frame carrying already-encoded frames
+
+    JSON frames are spliced in as text (nothing re-encoded); binary
+    frames go through the batch codec.
+    """
+    if isinstance(frames[0], bytes):
+        return SERVER_WIRE.encode({"type": "batch", "frames": frames})
+    return '{"type": "batch", "frames": [' + ", ".join(frames) + "]}"
+
+
+def decode_server_frame(frame) -> List[dict]:
+    """Client side: the messages in one server frame (a batch expands in order)"""
+    if isinstance(frame, bytes):
+        message = SERVER_WIRE.decode(frame)
+        if message["type"] == "batch":
+            return [SERVER_WIRE.decode(inner) for inner in message["frames"]]
+        return [message]
+    message = json.loads(frame)
+    return message["frames"] if message["type"] == "batch" else [message]
+
+
+# ============================================================================
+# Validation - Client messages checked before any game logic sees them
+# ============================================================================
+
+# Allowed values for str fields the server looks up by name
+CLIENT_FIELD_CHOICES = {
+    "chain": frozenset(RuleChain.__members__),
+    "action": frozenset(RuleAction.__members__),
+}
+
+# Int ranges tighter than the field's wire format
+CLIENT_FIELD_RANGES = {
+    "magic_type": (0, max(MagicType)),  # 0 = None (all types)
+}
+
+# Longest str that always fits the wire's u16 byte length (4 UTF-8 bytes a char)
+MAX_STR_CHARS = 0xFFFF // 4
+
+# Tighter str lengths (chars) for fields we know the shape of
+CLIENT_FIELD_LENGTHS = {
+    "player_name": 32,
+    "room_id": 64,  # "<shard>-<8 hex>" today
+    "encoding": 16,
+    "resume": 64,  # 32 hex today
+    "token": 256,
+}
+
+ECHO_CHARS = 64  # Client text quoted back in an error is cut to this
+
+
+class ProtocolError(ValueError):
+    """
+    Client message rejected before reaching a handler
+
+    Data:
+        kind: "frame" (undecodable, or not an object), "type" (unknown
+              message type) or "field" (a field breaks its schema)
+    """
+    def __init__(self, kind: str, detail: str):
+        super().__init__(detail)
+        self.kind = kind
+
+
+def _int_range(key: str) -> Tuple[int, int]:
+    """Bounds of an int field - the wire format's, unless overridden"""
+    if key in CLIENT_FIELD_RANGES:
+        return CLIENT_FIELD_RANGES[key]
+    code = WIRE_INT_FORMATS.get(key, "h")
+    bits = struct.calcsize(code) * 8
+    if code.islower():
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+
+def compile_validator(schema: dict) -> Callable[[dict], Optional[str]]:
+    """
+    Generated field check for one message type
+
+    The returned function gives the name of the first bad field, or
+    None. Every field is optional (absent/None passes); present ones
+    must have the schema's exact type (a bool is not an int), ints and
+    strs must fit their wire format (strs also CLIENT_FIELD_LENGTHS), and
+    choice fields must name a member.
+    Unknown extra fields are ignored.
+    """
+    lines = ["def validate(message):"]
+    namespace: Dict[str, object] = {}
+    for key, kind in schema.items():
+        if key == "type":
+            continue
+        if kind is int:
+            low, high = _int_range(key)
+            bad = f"type(v) is not int or not {low} <= v <= {high}"
+        elif key in CLIENT_FIELD_CHOICES:
+            namespace[f"CHOICES_{key}"] = CLIENT_FIELD_CHOICES[key]
+            bad = f"type(v) is not str or v not in CHOICES_{key}"
+        elif kind is str:
+            limit = CLIENT_FIELD_LENGTHS.get(key, MAX_STR_CHARS)
+            bad = f"type(v) is not str or len(v) > {limit}"
+        else:
+            bad = f"type(v) is not {kind.__name__}"
+        lines.append(f"    v = message.get({key!r})")
+        lines.append(f"    if v is not None and ({bad}):")
+        lines.append(f"        return {key!r}")
+    lines.append("    return None")
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
+
+CLIENT_VALIDATORS = {name: compile_validator(schema)
+                     for name, schema in CLIENT_MESSAGES.items()}
+
+
+def validate_client_message(message) -> str:
+    """Check one decoded client message against its schema, return its type"""
+    if type(message) is not dict:
+        raise ProtocolError("frame", "Message is not an object")
+    msg_type = message.get("type")
+    validate = CLIENT_VALIDATORS.get(msg_type) if type(msg_type) is str else None
+    if validate is None:
+        raise ProtocolError("type", f"Unknown message type {repr(msg_type)[:ECHO_CHARS]}")
+    field = validate(message)
+    if field is not None:
+        raise ProtocolError("field", f"Bad {field!r} in {msg_type}")
+    return msg_type
+
+
+def decode_client_frame(frame) -> dict:
+    """Server side: decode and validate one client frame, or raise ProtocolError"""
+    try:
+        message = CLIENT_WIRE.decode(frame) if isinstance(frame, bytes) else json.loads(frame)
+    except (ValueError, KeyError, IndexError, struct.error, RecursionError):
+        raise ProtocolError("frame", "Undecodable frame") from None
+    validate_client_message(message)
+    return message
+
 # ============================================================================
 # Protocol Flow Example
 # ============================================================================
@@ -137,6 +750,11 @@ SERVER_MESSAGES = {
    Server → Client: {"type": "action_result", "success": true, "spell_cast": "Inferno Storm"}
    Server → Both: {"type": "state_update", ...}
 
+   (Delta clients get {"type": "state_delta", "version": 8, "base": 7,
+    "changes": {"your_wand": {"buffer": {"shift": 1, "append": []},
+                              "buffer_count": 2}}}
+    and answer {"type": "ack", "version": 8})
+
 6. READY:
    Client → Server: {"type": "ready"}
    (When both ready, advance to next turn)
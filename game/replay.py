@@ -0,0 +1,116 @@
+"""
+Match Replay - Rebuild recorded matches from the replay log
+
+Each match is replayed through a GameRoom seeded like the original and
+the server's own apply functions, so it ends in exactly the state the
+players saw. Nothing waits on a clock - a whole match replays in
+milliseconds.
+
+Usage:
+    python3 multiplayer_server.py --replay-dir replays
+    python3 replay.py replays                      # one line per match
+    python3 replay.py replays --room 1f3a9c0e --log  # one match, full game log
+"""
+
+import argparse
+import glob
+import os
+import time
+from typing import Iterable, List, Optional
+
+from core_data import RuleAction, RuleChain, format_log_event
+from multiplayer_server import GameRoom, MultiplayerServer
+from replay_log import (CAST, CLOSE, DISCARD, INCOMING, JOIN, RESOLVE, RULE, TIMEOUT, TRIM,
+                        MatchLog, read_matches)
+
+
+def replay_match(match: MatchLog, server: Optional[MultiplayerServer] = None) -> GameRoom:
+    """Play match's records into a fresh room, return the room as it ended"""
+    server = server if server is not None else MultiplayerServer()
+    room = GameRoom(match.room_id, match.host, seed=match.seed)
+    engine = room.engine
+    for record in match.records:
+        kind = record[0]
+        if kind == CAST:
+            server.apply_action(room, record[1], {"type": "cast", "essence_count": record[2]})
+        elif kind == RULE:
+            _, player_id, chain, action, magic_type, source_filter = record
+            server.apply_action(room, player_id, {
+                "type": "configure_rule",
+                "chain": RuleChain(chain).name,
+                "action": RuleAction(action).name,
+                "magic_type": magic_type,
+                "source_filter": bool(source_filter)
+            })
+        elif kind == DISCARD:
+            server.apply_action(room, record[1], {"type": "discard", "index": record[2]})
+        elif kind == INCOMING:
+            engine.start_incoming_phase()
+            engine.start_action_phase()
+        elif kind == RESOLVE:
+            engine.end_turn()
+        elif kind == TIMEOUT:
+            engine.state.log_event("timeout", None)
+        elif kind == TRIM:
+            room.trim()
+        elif kind == JOIN:
+            _, player_id, name = record
+            room.player_names[player_id] = name
+            if player_id == 1:
+                engine.state.enemy.owner = name
+        elif kind == CLOSE:
+            break
+    return room
+
+
+def log_files(paths: Iterable[str]) -> List[str]:
+    """Replay files named directly, plus every *.bin in named directories"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*.bin")))
+        else:
+            files.append(path)
+    return files
+
+
+def summarize(match: MatchLog, room: GameRoom, seconds: float) -> str:
+    """One line: who played, how it ended, how long it took then and now"""
+    state = room.engine.state
+    guest = room.player_names[1] or "-"
+    reason = match.records[-1][1] if match.finished else "unfinished"
+    played = match.finished_at - match.started if match.finished else 0.0
+    return (f"{match.room_id:<12} {match.host} vs {guest}: turn {state.turn.turn_number}, "
+            f"winner {state.winner or '-'} ({reason}) - played {played:.0f}s, "
+            f"replayed in {seconds * 1000:.2f}ms")
+
+
+def main(argv: Optional[List[str]] = None):
+    """CLI entry point"""
+    parser = argparse.ArgumentParser(description="Replay recorded Kernel Duel matches")
+    parser.add_argument("paths", nargs="+", help="Replay log files or directories")
+    parser.add_argument("--room", help="Only the match(es) played in this room")
+    parser.add_argument("--log", action="store_true", help="Print each match's game log")
+    args = parser.parse_args(argv)
+
+    matches = read_matches(log_files(args.paths))
+    server = MultiplayerServer()
+    total = 0.0
+    replayed = 0
+    for match in sorted(matches.values(), key=lambda m: m.started):
+        if args.room and match.room_id != args.room:
+            continue
+        start = time.perf_counter()
+        room = replay_match(match, server)
+        seconds = time.perf_counter() - start
+        total += seconds
+        replayed += 1
+        print(summarize(match, room, seconds))
+        if args.log:
+            for event in room.engine.state.log:
+                print("    " + format_log_event(event))
+    print(f"{replayed} matches replayed in {total:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Replay Log - Append-only binary record of every match
+
+Like a filesystem journal: each room appends small fixed-layout records
+(its seed, joins, every applied action, every phase transition) to an
+in-memory buffer on the event loop. Full buffers are handed to the log
+as chunks, and a background thread appends them to one file per day.
+The seed replays the incoming magic, so seed + records rebuild the
+whole match (replay.py).
+
+File: MAGIC, then chunks. Chunk: u64 seed (the match key), u32 length,
+records. A long match spans several chunks, possibly across day files;
+read_matches() joins them back up by seed.
+
+Record: u8 kind, then
+    OPEN:     f64 wall time, str room_id, str host name
+    JOIN:     u8 player_id, str name
+    CAST:     u8 player_id, u8 essence_count
+    RULE:     u8 player_id, u8 chain, u8 action, u8 magic_type (0 = all),
+              u8 source_filter
+    DISCARD:  u8 player_id, i8 index
+    INCOMING/TIMEOUT/RESOLVE/TRIM: nothing
+    CLOSE:    f64 wall time, str reason
+with str as u16 length + UTF-8.
+"""
+
+import asyncio
+import os
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core_data import DefenseRule
+
+
+MAGIC = b"KDRP\x01"
+FLUSH_INTERVAL = 1.0  # Seconds between background writes
+CHUNK_SIZE = 4096  # Bytes a match buffers before handing a chunk to the log
+
+# Record kinds
+OPEN, JOIN, CAST, RULE, DISCARD, INCOMING, TIMEOUT, RESOLVE, TRIM, CLOSE = range(1, 11)
+
+# Record kinds that carry no payload, by name (for printing)
+PHASES = {INCOMING: "incoming", TIMEOUT: "timeout", RESOLVE: "resolve", TRIM: "trim"}
+
+_CHUNK = struct.Struct("<QI")
+_STAMPED = struct.Struct("<Bd")  # Kind + wall time
+_PLAYER = struct.Struct("<BB")
+_CAST = struct.Struct("<BBB")
+_RULE = struct.Struct("<BBBBBB")
+_DISCARD = struct.Struct("<BBb")
+_STR = struct.Struct("<H")
+
+
+def _pack_str(buffer: bytearray, text: str):
+    data = text.encode()
+    buffer += _STR.pack(len(data))
+    buffer += data
+
+
+def _unpack_str(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = _STR.unpack_from(data, offset)
+    offset += _STR.size
+    return data[offset:offset + length].decode(), offset + length
+
+
+# ============================================================================
+# Writer - Chunks in, day files out
+# ============================================================================
+
+class ReplayLog:
+    """
+    Append-only replay files, one per day, written off the event loop
+
+    append() only queues bytes; run() hands whatever queued up to a
+    worker thread every interval, like a journal's commit thread.
+
+    Data:
+        directory: Where the day files go
+        prefix: File name prefix (one per shard, so processes never share a file)
+        pending: Chunks queued since the last write
+        written: Bytes written so far
+    """
+    def __init__(self, directory: str, prefix: str = "replay",
+                 interval: float = FLUSH_INTERVAL):
+        self.directory = directory
+        self.prefix = prefix
+        self.interval = interval
+        self.pending: List[bytes] = []
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def recorder(self, seed: int, room_id: str, host: str) -> 'MatchRecorder':
+        """Start recording a new match"""
+        return MatchRecorder(self, seed, room_id, host)
+
+    def append(self, seed: int, records: bytes):
+        """Queue one chunk of a match's records"""
+        self.pending.append(_CHUNK.pack(seed, len(records)) + records)
+
+    def path(self, when: Optional[float] = None) -> str:
+        """Day file for time when (UTC date, default now)"""
+        day = time.strftime("%Y-%m-%d", time.gmtime(when))
+        return os.path.join(self.directory, f"{self.prefix}-{day}.bin")
+
+    async def run(self):
+        """Write queued chunks every interval, forever (final flush on cancel)"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self.pending:
+                    chunks, self.pending = self.pending, []
+                    await asyncio.to_thread(self._write, chunks)
+        finally:
+            self.flush()
+
+    def flush(self):
+        """Write everything queued now, on the calling thread"""
+        chunks, self.pending = self.pending, []
+        if chunks:
+            self._write(chunks)
+
+    def _write(self, chunks: List[bytes]):
+        data = b"".join(chunks)
+        with open(self.path(), "ab") as out:
+            if out.tell() == 0:
+                out.write(MAGIC)
+            out.write(data)
+        self.written += len(data)
+
+
+# ============================================================================
+# Recorder - One match's records
+# ============================================================================
+
+class MatchRecorder:
+    """
+    Record buffer for one match - every hook is one struct pack and a
+    bytearray append
+
+    Data:
+        log: Where full chunks go
+        seed: Match key (the room's incoming magic seed)
+        buffer: Records not yet handed to the log
+    """
+    __slots__ = ("log", "seed", "buffer")
+
+    def __init__(self, log: ReplayLog, seed: int, room_id: str, host: str):
+        self.log = log
+        self.seed = seed
+        self.buffer = bytearray(_STAMPED.pack(OPEN, time.time()))
+        _pack_str(self.buffer, room_id)
+        _pack_str(self.buffer, host)
+
+    def join(self, player_id: int, name: str):
+        self.buffer += _PLAYER.pack(JOIN, player_id)
+        _pack_str(self.buffer, name)
+
+    def cast(self, player_id: int, essence_count: int):
+        self.buffer += _CAST.pack(CAST, player_id, essence_count)
+
+    def rule(self, player_id: int, rule: DefenseRule):
+        self.buffer += _RULE.pack(RULE, player_id, rule.chain, rule.action,
+                                  rule.magic_type or 0, rule.source_filter)
+
+    def discard(self, player_id: int, index: int):
+        self.buffer += _DISCARD.pack(DISCARD, player_id, index)
+
+    def phase(self, kind: int):
+        """INCOMING/TIMEOUT/RESOLVE/TRIM - once a turn, so chunks are cut here"""
+        self.buffer.append(kind)
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def close(self, reason: str):
+        """Last record of the match - everything goes to the log"""
+        self.buffer += _STAMPED.pack(CLOSE, time.time())
+        _pack_str(self.buffer, reason)
+        self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.log.append(self.seed, bytes(self.buffer))
+            self.buffer.clear()
+
+
+# ============================================================================
+# Reader
+# ============================================================================
+
+@dataclass
+class MatchLog:
+    """
+    One recorded match, decoded
+
+    Data:
+        seed: Incoming magic seed
+        room_id: Room it was played in
+        host: Player 0's name
+        started: Wall time the room opened
+        finished_at: Wall time it closed (0 while still open)
+        records: (kind, *fields) in order, OPEN excluded
+    """
+    seed: int
+    room_id: str = ""
+    host: str = ""
+    started: float = 0.0
+    finished_at: float = 0.0
+    records: List[tuple] = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.records) and self.records[-1][0] == CLOSE
+
+
+def read_chunks(path: str) -> Iterable[Tuple[int, bytes]]:
+    """(seed, records) for every chunk in one replay file"""
+    with open(path, "rb") as source:
+        data = source.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path}: not a replay log")
+    offset = len(MAGIC)
+    while offset + _CHUNK.size <= len(data):
+        seed, length = _CHUNK.unpack_from(data, offset)
+        offset += _CHUNK.size
+        yield seed, data[offset:offset + length]
+        offset += length
+
+
+def decode_records(match: MatchLog, data: bytes):
+    """Append the records in one chunk to match"""
+    offset = 0
+    while offset < len(data):
+        kind = data[offset]
+        if kind == OPEN:
+            # A seed that opens again continues its match - keep the first
+            _, started = _STAMPED.unpack_from(data, offset)
+            room_id, offset = _unpack_str(data, offset + _STAMPED.size)
+            host, offset = _unpack_str(data, offset)
+            if not match.room_id:
+                match.started, match.room_id, match.host = started, room_id, host
+            continue
+        if kind == JOIN:
+            _, player_id = _PLAYER.unpack_from(data, offset)
+            name, offset = _unpack_str(data, offset + _PLAYER.size)
+            record = (JOIN, player_id, name)
+        elif kind == CAST:
+            record = _CAST.unpack_from(data, offset)
+            offset += _CAST.size
+        elif kind == RULE:
+            record = _RULE.unpack_from(data, offset)
+            offset += _RULE.size
+        elif kind == DISCARD:
+            record = _DISCARD.unpack_from(data, offset)
+            offset += _DISCARD.size
+        elif kind == CLOSE:
+            _, match.finished_at = _STAMPED.unpack_from(data, offset)
+            reason, offset = _unpack_str(data, offset + _STAMPED.size)
+            record = (CLOSE, reason)
+        elif kind in PHASES:
+            record = (kind,)
+            offset += 1
+        else:
+            raise ValueError(f"Unknown replay record {kind} at offset {offset}")
+        match.records.append(record)
+
+
+def read_matches(paths: Iterable[str]) -> Dict[int, MatchLog]:
+    """Every match in the given files (in order), keyed by seed"""
+    matches: Dict[int, MatchLog] = {}
+    for path in paths:
+        for seed, data in read_chunks(path):
+            match = matches.get(seed)
+            if match is None:
+                match = matches[seed] = MatchLog(seed)
+            decode_records(match, data)
+    return matches
@@ -0,0 +1,258 @@
+"""
+Room Snapshots - Live matches carried across a server restart
+
+Like suspend-to-disk: a draining server writes every live room (both
+wands with their essence buffers and rule lists, the turn, the log, and
+the incoming magic RNG mid-stream) into one file. The next process
+memory-maps it and decodes a room only when one of its players comes
+back with a resume token, so startup costs nothing per room and a
+resume is one record decode - no history is replayed.
+
+File: MAGIC, header (u32 index entries, u64 index offset), room
+records, then the index: one 32-byte entry per seat, sorted by token,
+so a token is found by binary search straight over the mapping.
+
+Room record: two 16-byte resume tokens (seat 0, seat 1), the room
+head struct, str room_id/phase/names/winner, two wands, the RNG state
+and the log as JSON. str is u16 length + UTF-8.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import Iterable, Iterator, Optional, Tuple
+
+from core_data import DefenseRule, EssenceBuffer, MagicType, RuleAction, RuleChain, Wand
+
+
+MAGIC = b"KDSN\x01"
+TOKEN_SIZE = 16
+
+_HEADER = struct.Struct("<IQ")  # index entries, index offset
+_ENTRY = struct.Struct("<16sQIB3x")  # token, record offset, record length, seat
+_ROOM = struct.Struct("<QIHH??ddd")  # seed, turn, no-cast turns x2, ready x2, durations
+_WAND = struct.Struct("<iiiiiiBHBBB")  # hp..frozen, capacity, overflow, essences, max/rules
+_RULE = struct.Struct("<BBBB")  # chain, action, magic_type (0 = all), source_filter
+_RNG = struct.Struct("<I?d")  # version, has gauss_next, gauss_next
+_STR = struct.Struct("<H")
+_LOG = struct.Struct("<I")
+
+
+def _pack_str(parts: list, text: str):
+    data = text.encode()
+    parts.append(_STR.pack(len(data)))
+    parts.append(data)
+
+
+def _unpack_str(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = _STR.unpack_from(data, offset)
+    offset += _STR.size
+    return data[offset:offset + length].decode(), offset + length
+
+
+# ============================================================================
+# Room Records
+# ============================================================================
+
+def _pack_wand(parts: list, wand: Wand):
+    buffer, rules = wand.buffer, wand.rules
+    parts.append(_WAND.pack(wand.hp, wand.max_hp, wand.cpu, wand.max_cpu, wand.shield,
+                            wand.frozen_essences, buffer.capacity, buffer.overflow_count,
+                            buffer.count, rules.max_rules, len(rules.rules)))
+    _pack_str(parts, wand.owner)
+    parts.append(bytes(buffer.essences))
+    for rule in rules.rules:
+        parts.append(_RULE.pack(rule.chain, rule.action, rule.magic_type or 0,
+                                rule.source_filter))
+
+
+def _unpack_wand(data: bytes, offset: int, wand: Wand) -> int:
+    (wand.hp, wand.max_hp, wand.cpu, wand.max_cpu, wand.shield, wand.frozen_essences,
+     capacity, overflow, count, max_rules, rule_count) = _WAND.unpack_from(data, offset)
+    wand.owner, offset = _unpack_str(data, offset + _WAND.size)
+
+    # Rebuild through add()/add_rule() so histograms and verdicts stay in step
+    if wand.buffer.capacity != capacity:
+        wand.buffer = EssenceBuffer(capacity)
+    buffer = wand.buffer
+    buffer.clear()
+    for code in data[offset:offset + count]:
+        buffer.add(MagicType(code))
+    buffer.overflow_count = overflow
+    offset += count
+
+    wand.rules.clear()
+    wand.rules.max_rules = max_rules
+    for _ in range(rule_count):
+        chain, action, magic_type, source_filter = _RULE.unpack_from(data, offset)
+        wand.rules.add_rule(DefenseRule(RuleChain(chain), RuleAction(action),
+                                        MagicType(magic_type) if magic_type else None,
+                                        bool(source_filter)))
+        offset += _RULE.size
+    return offset
+
+
+def pack_room(room, tokens: Tuple[bytes, bytes]) -> bytes:
+    """One room record - room is a GameRoom mid-match"""
+    state = room.engine.state
+    turn = state.turn
+    parts = [tokens[0], tokens[1],
+             _ROOM.pack(room.seed, turn.turn_number, state.player_no_cast_turns,
+                        state.enemy_no_cast_turns, room.ready_status[0], room.ready_status[1],
+                        turn.incoming_duration, turn.action_duration, turn.resolution_duration)]
+    for text in (room.room_id, turn.phase, room.player_names[0],
+                 room.player_names[1] or "", state.winner or ""):
+        _pack_str(parts, text)
+    _pack_wand(parts, state.player)
+    _pack_wand(parts, state.enemy)
+
+    version, internal, gauss = room.engine.source.rng.getstate()
+    parts.append(_RNG.pack(version, gauss is not None, gauss or 0.0))
+    parts.append(_STR.pack(len(internal)))
+    parts.append(array("I", internal).tobytes())
+
+    log = json.dumps([[turn_number, kind, actor, list(values)]
+                      for turn_number, kind, actor, values in state.log]).encode()
+    parts.append(_LOG.pack(len(log)))
+    parts.append(log)
+    return b"".join(parts)
+
+
+def record_tokens(record: bytes) -> Tuple[bytes, bytes]:
+    """Resume tokens of a record, seat 0 and seat 1"""
+    return record[:TOKEN_SIZE], record[TOKEN_SIZE:2 * TOKEN_SIZE]
+
+
+def unpack_room(record: bytes, room) -> Tuple[bytes, bytes]:
+    """
+    Restore a record into room (a fresh or pooled GameRoom), return its
+    tokens. The room comes back mid-action-phase with no players seated.
+    """
+    offset = 2 * TOKEN_SIZE
+    (seed, turn_number, player_no_cast, enemy_no_cast, ready0, ready1,
+     incoming, action, resolution) = _ROOM.unpack_from(record, offset)
+    offset += _ROOM.size
+    room_id, offset = _unpack_str(record, offset)
+    phase, offset = _unpack_str(record, offset)
+    host, offset = _unpack_str(record, offset)
+    guest, offset = _unpack_str(record, offset)
+    winner, offset = _unpack_str(record, offset)
+
+    room.reset(room_id, host, seed)
+    room.player_names[1] = guest or None
+    room.ready_status = {0: ready0, 1: ready1}
+    room.game_started = True
+
+    state = room.engine.state
+    state.player_no_cast_turns = player_no_cast
+    state.enemy_no_cast_turns = enemy_no_cast
+    state.winner = winner or None
+    turn = state.turn
+    turn.turn_number, turn.phase = turn_number, phase
+    turn.incoming_duration, turn.action_duration, turn.resolution_duration = (
+        incoming, action, resolution)
+    turn.start_time = time.time()
+    offset = _unpack_wand(record, offset, state.player)
+    offset = _unpack_wand(record, offset, state.enemy)
+
+    version, has_gauss, gauss = _RNG.unpack_from(record, offset)
+    (words,) = _STR.unpack_from(record, offset + _RNG.size)
+    offset += _RNG.size + _STR.size
+    internal = array("I")
+    internal.frombytes(record[offset:offset + 4 * words])
+    room.engine.source.rng.setstate((version, tuple(internal), gauss if has_gauss else None))
+    offset += 4 * words
+
+    (length,) = _LOG.unpack_from(record, offset)
+    offset += _LOG.size
+    state.log.clear()
+    for turn_number, kind, actor, values in json.loads(record[offset:offset + length]):
+        state.log.append((turn_number, kind, actor, tuple(values)))
+    room.resume_tokens = record_tokens(record)
+    return room.resume_tokens
+
+
+# ============================================================================
+# Snapshot File
+# ============================================================================
+
+def write_snapshot(path: str, records: Iterable[bytes]) -> int:
+    """
+    Write room records and their token index to path, atomically
+    (a temp file renamed over it - a mapping of the old file stays valid)
+
+    Returns: Rooms written
+    """
+    entries = []
+    offset = len(MAGIC) + _HEADER.size
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as out:
+        out.write(MAGIC)
+        out.write(bytes(_HEADER.size))
+        for record in records:
+            for seat, token in enumerate(record_tokens(record)):
+                entries.append((token, offset, len(record), seat))
+            out.write(record)
+            offset += len(record)
+        entries.sort()
+        out.write(b"".join(_ENTRY.pack(*entry) for entry in entries))
+        out.seek(len(MAGIC))
+        out.write(_HEADER.pack(len(entries), offset))
+    os.replace(temp, path)
+    return len(entries) // 2
+
+
+class RoomSnapshot:
+    """
+    A snapshot file mapped read-only - rooms are decoded on demand
+
+    Data:
+        path: Snapshot file
+        entries: Index entries (two per room)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a room snapshot")
+        self.entries, self._index = _HEADER.unpack_from(self._map, len(MAGIC))
+
+    def __len__(self) -> int:
+        return self.entries // 2
+
+    def find(self, token: bytes) -> Optional[Tuple[int, int, int]]:
+        """(offset, length, seat) of the record a token resumes, by binary search"""
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            position = self._index + middle * _ENTRY.size
+            key = self._map[position:position + TOKEN_SIZE]
+            if key < token:
+                low = middle + 1
+            elif key > token:
+                high = middle
+            else:
+                return _ENTRY.unpack_from(self._map, position)[1:]
+        return None
+
+    def record(self, offset: int, length: int) -> bytes:
+        return self._map[offset:offset + length]
+
+    def records(self) -> Iterator[Tuple[int, bytes]]:
+        """(offset, record) for every room, in file order"""
+        rooms = sorted(entry[1:3] for entry in _ENTRY.iter_unpack(
+            self._map[self._index:self._index + self.entries * _ENTRY.size]) if entry[3] == 0)
+        for offset, length in rooms:
+            yield offset, self.record(offset, length)
+
+    def close(self):
+        self._map.close()
+
+
+def new_tokens() -> Tuple[bytes, bytes]:
+    """Fresh resume tokens for a room's two seats"""
+    return os.urandom(TOKEN_SIZE), os.urandom(TOKEN_SIZE)
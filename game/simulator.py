@@ -0,0 +1,248 @@
+"""
+Headless Match Simulator - AI vs AI on every core
+
+Runs M matches between two create_ai() levels on a process pool. Each
+match gets its own seeded random.Random stream, so any single match can
+be replayed from (levels, seed) alone. --source batched draws incoming
+magic from the NumPy counter-based stream instead (same replay rule).
+
+Usage:
+    python3 simulator.py --player 3 --enemy 4 -n 10000 --workers 8 \\
+        --json results.json --csv matches.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+
+from ai_opponents import create_ai
+from game_engine import BatchedMagicSource, GameEngine, RandomMagicSource
+
+
+# ============================================================================
+# Single Match - Runs inside a worker process
+# ============================================================================
+
+def play_match(player_level: int, enemy_level: int, seed: int,
+               max_turns: int = 100, log: bool = False,
+               source: str = "random") -> dict:
+    """
+    Play one AI-vs-AI match to completion
+
+    Args:
+        player_level: create_ai() level driving the player wand
+        enemy_level: create_ai() level driving the enemy wand
+        seed: Seed for this match's random stream
+        max_turns: Turn limit (match counts as a draw past it)
+        log: Keep the game log (off by default - nobody reads it here)
+        source: Incoming magic source - "random" (shares the AI stream)
+            or "batched" (BatchedMagicSource keyed by seed, needs numpy)
+
+    Returns:
+        Dict with seed, winner ("player"/"enemy"/None), turns, reason,
+        and spell usage per side
+    """
+    rng = random.Random(seed)
+    player_ai = create_ai(player_level, rng)
+    magic = BatchedMagicSource(seed) if source == "batched" else RandomMagicSource(rng)
+    engine = GameEngine(player_name=player_ai.name,
+                        ai=create_ai(enemy_level, rng), log=log, source=magic)
+    state = engine.state
+    spells = ({}, {})
+
+    while state.turn.turn_number <= max_turns:
+        engine.start_incoming_phase()
+        engine.start_action_phase()
+
+        for side, (ai, me, target) in enumerate(
+                ((player_ai, state.player, state.enemy),
+                 (engine.ai, state.enemy, state.player))):
+            engine.last_spell = None
+            cast = engine.run_ai_turn(ai, me, target)
+            if side == 0:
+                state.player_no_cast_turns = 0 if cast else state.player_no_cast_turns + 1
+            else:
+                state.enemy_no_cast_turns = 0 if cast else state.enemy_no_cast_turns + 1
+            if engine.last_spell:
+                name = engine.last_spell.name
+                spells[side][name] = spells[side].get(name, 0) + 1
+
+        if engine.end_turn():
+            break
+
+    # Both AIs may share a name (same level), so resolve by wand, not owner.
+    # Same order as GameState.check_victory
+    if state.winner is None:
+        winner, reason = None, "turn_limit"
+    elif not state.player.is_alive:
+        winner, reason = "enemy", "hp"
+    elif not state.enemy.is_alive:
+        winner, reason = "player", "hp"
+    elif state.player_no_cast_turns >= 5:
+        winner, reason = "enemy", "starvation"
+    else:
+        winner, reason = "player", "starvation"
+
+    return {
+        'seed': seed,
+        'winner': winner,
+        'turns': state.turn.turn_number if state.winner else max_turns,
+        'reason': reason,
+        'player_hp': state.player.hp,
+        'enemy_hp': state.enemy.hp,
+        'player_spells': spells[0],
+        'enemy_spells': spells[1],
+    }
+
+
+def _play_chunk(player_level: int, enemy_level: int, seeds: List[int],
+                max_turns: int, source: str = "random") -> List[dict]:
+    """Worker entry point - a chunk of matches per task keeps IPC cheap"""
+    return [play_match(player_level, enemy_level, seed, max_turns, source=source)
+            for seed in seeds]
+
+
+# ============================================================================
+# Aggregation
+# ============================================================================
+
+class MatchStats:
+    """
+    Running aggregate over finished matches
+
+    Data:
+        matches: Matches seen
+        wins: Counter of "player"/"enemy"/None
+        reasons: Counter of end reasons
+        total_turns: Sum of match lengths
+        spell_usage: Per-side Counter of spell name -> casts
+    """
+    def __init__(self, player_level: int, enemy_level: int):
+        self.player_level = player_level
+        self.enemy_level = enemy_level
+        self.matches = 0
+        self.wins = Counter()
+        self.reasons = Counter()
+        self.total_turns = 0
+        self.spell_usage = {'player': Counter(), 'enemy': Counter()}
+
+    def add(self, result: dict):
+        """Fold one match result in"""
+        self.matches += 1
+        self.wins[result['winner']] += 1
+        self.reasons[result['reason']] += 1
+        self.total_turns += result['turns']
+        self.spell_usage['player'].update(result['player_spells'])
+        self.spell_usage['enemy'].update(result['enemy_spells'])
+
+    def summary(self) -> dict:
+        """JSON-ready aggregate"""
+        n = max(self.matches, 1)
+        return {
+            'player': {'level': self.player_level, 'name': create_ai(self.player_level).name},
+            'enemy': {'level': self.enemy_level, 'name': create_ai(self.enemy_level).name},
+            'matches': self.matches,
+            'player_win_rate': self.wins['player'] / n,
+            'enemy_win_rate': self.wins['enemy'] / n,
+            'draw_rate': self.wins[None] / n,
+            'avg_turns': self.total_turns / n,
+            'starvation_rate': self.reasons['starvation'] / n,
+            'spell_usage': {side: dict(usage.most_common())
+                            for side, usage in self.spell_usage.items()},
+        }
+
+
+# ============================================================================
+# Parallel Runner
+# ============================================================================
+
+def run_matches(player_level: int, enemy_level: int, matches: int,
+                seed: int = 0, workers: Optional[int] = None,
+                max_turns: int = 100, chunk_size: int = 250,
+                source: str = "random") -> Iterator[dict]:
+    """
+    Play matches across a process pool, yielding results in match order
+    as each chunk completes
+
+    Match i uses seed + i, so results don't depend on worker count.
+    """
+    seeds = [seed + i for i in range(matches)]
+    chunks = [seeds[i:i + chunk_size] for i in range(0, matches, chunk_size)]
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from _play_chunk(player_level, enemy_level, chunk, max_turns, source)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_play_chunk, player_level, enemy_level, chunk,
+                               max_turns, source)
+                   for chunk in chunks]
+        for future in futures:
+            yield from future.result()
+
+
+CSV_FIELDS = ['seed', 'winner', 'turns', 'reason', 'player_hp', 'enemy_hp']
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    """CLI entry point"""
+    parser = argparse.ArgumentParser(description="Headless Kernel Duel AI-vs-AI simulator")
+    parser.add_argument("--player", type=int, default=3, help="Player AI level (1-6)")
+    parser.add_argument("--enemy", type=int, default=4, help="Enemy AI level (1-6)")
+    parser.add_argument("-n", "--matches", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="Base seed (match i uses seed+i)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes (1 = run inline)")
+    parser.add_argument("--max-turns", type=int, default=100)
+    parser.add_argument("--source", choices=["random", "batched"], default="random",
+                        help="Incoming magic source (batched needs numpy)")
+    parser.add_argument("--json", help="Write aggregate summary to this file")
+    parser.add_argument("--csv", help="Stream one row per match to this file")
+    args = parser.parse_args(argv)
+
+    stats = MatchStats(args.player, args.enemy)
+    csv_file = open(args.csv, "w", newline="") if args.csv else None
+    writer = csv.DictWriter(csv_file, CSV_FIELDS, extrasaction="ignore") if csv_file else None
+    if writer:
+        writer.writeheader()
+
+    start = time.perf_counter()
+    try:
+        for result in run_matches(args.player, args.enemy, args.matches, args.seed,
+                                  args.workers, args.max_turns,
+                                  source=args.source):
+            stats.add(result)
+            if writer:
+                writer.writerow(result)
+    finally:
+        if csv_file:
+            csv_file.close()
+    elapsed = time.perf_counter() - start
+
+    summary = stats.summary()
+    summary['elapsed_seconds'] = elapsed
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    print(f"{summary['player']['name']} (L{args.player}) vs "
+          f"{summary['enemy']['name']} (L{args.enemy}): {stats.matches} matches "
+          f"in {elapsed:.2f}s ({stats.matches / elapsed:.0f}/s)", file=sys.stderr)
+    print(f"  Player wins: {summary['player_win_rate']:.1%}  "
+          f"Enemy wins: {summary['enemy_win_rate']:.1%}  "
+          f"Draws: {summary['draw_rate']:.1%}", file=sys.stderr)
+    print(f"  Avg turns: {summary['avg_turns']:.1f}  "
+          f"Starvation: {summary['starvation_rate']:.1%}", file=sys.stderr)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
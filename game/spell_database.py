@@ -6,7 +6,7 @@ Like kernel's protocol handlers - registered in a table
 """
 
 from typing import List, Dict, Tuple
-from core_data import MagicType, Spell
+from core_data import MagicType, Spell, pack_magic, PACKED_COMBO_LIMIT
 
 
 # ============================================================================
@@ -119,22 +119,10 @@ SPELL_DATA: Dict[Tuple[MagicType, ...], Tuple[str, int, str, int]] = {
 # Spell Lookup Functions
 # ============================================================================
 
-def lookup_spell(essences: List[MagicType]) -> Spell:
-    """
-    Look up spell from essence combination
-    Like: Protocol handler lookup in kernel
-
-    Args:
-        essences: List of 1-3 magic types
-
-    Returns:
-        Spell object with damage and effects
-    """
-    # Convert to tuple for dictionary lookup
-    key = tuple(essences)
-
-    if key in SPELL_DATA:
-        name, damage, special, shield = SPELL_DATA[key]
+def _make_spell(essences: Tuple[MagicType, ...]) -> Spell:
+    """Build the Spell for an essence combination (table entry or Wild)"""
+    if essences in SPELL_DATA:
+        name, damage, special, shield = SPELL_DATA[essences]
         return Spell(
             name=name,
             elements=essences,
@@ -153,6 +141,48 @@ def lookup_spell(essences: List[MagicType]) -> Spell:
         )
 
 
+def _build_spell_table() -> List[Spell]:
+    """
+    Intern every 1-3 element combo (7 + 49 + 343) by packed code
+    Like: Protocol handler array indexed by protocol number
+    """
+    table = [None] * PACKED_COMBO_LIMIT
+    combos = [(a,) for a in MagicType]
+    combos += [(a, b) for a in MagicType for b in MagicType]
+    combos += [(a, b, c) for a in MagicType for b in MagicType for c in MagicType]
+    for essences in combos:
+        table[pack_magic(essences)] = _make_spell(essences)
+    return table
+
+
+# Packed code -> shared, immutable Spell (None for code 0 / invalid codes)
+SPELL_TABLE: List[Spell] = _build_spell_table()
+
+
+def lookup_spell_code(code: int) -> Spell:
+    """
+    Look up spell by packed code (core_data.pack_magic / peek_code)
+    Fast path: one list index, no allocation
+    """
+    return SPELL_TABLE[code]
+
+
+def lookup_spell(essences: List[MagicType]) -> Spell:
+    """
+    Look up spell from essence combination
+    Like: Protocol handler lookup in kernel
+
+    Args:
+        essences: List of 1-3 magic types
+
+    Returns:
+        Spell object with damage and effects (shared - do not mutate)
+    """
+    if 0 < len(essences) <= 3:
+        return SPELL_TABLE[pack_magic(essences)]
+    return _make_spell(tuple(essences))
+
+
 def get_spell_info(essences: List[MagicType]) -> str:
     """Get spell description for UI"""
     spell = lookup_spell(essences)
@@ -167,33 +197,36 @@ def get_spell_info(essences: List[MagicType]) -> str:
     return " ".join(parts)
 
 
-def get_top_damage_combos() -> List[Tuple[List[MagicType], str, int]]:
-    """
-    Get highest damage combos for AI planning
-    Returns: List of (elements, name, damage) sorted by damage
-    """
+def _rank_combos(heal: bool) -> List[Tuple[List[MagicType], str, int]]:
+    """Offensive or healing combos, strongest first"""
     combos = []
     for elements, (name, damage, special, shield) in SPELL_DATA.items():
-        if damage > 0:  # Only offensive spells
-            combos.append((list(elements), name, damage))
+        if (damage < 0) if heal else (damage > 0):
+            combos.append((list(elements), name, abs(damage)))
 
-    # Sort by damage descending
     combos.sort(key=lambda x: x[2], reverse=True)
-    return combos[:20]  # Top 20
+    return combos
+
+
+# AI planning indexes - computed once at import, not per call
+TOP_DAMAGE_COMBOS = _rank_combos(heal=False)[:20]
+HEALING_COMBOS = _rank_combos(heal=True)
+
+
+def get_top_damage_combos() -> List[Tuple[List[MagicType], str, int]]:
+    """
+    Get highest damage combos for AI planning
+    Returns: List of (elements, name, damage) sorted by damage (shared - do not mutate)
+    """
+    return TOP_DAMAGE_COMBOS
 
 
 def get_healing_combos() -> List[Tuple[List[MagicType], str, int]]:
     """
     Get healing combos for AI planning
-    Returns: List of (elements, name, heal_amount) sorted by healing
+    Returns: List of (elements, name, heal_amount) sorted by healing (shared - do not mutate)
     """
-    combos = []
-    for elements, (name, damage, special, shield) in SPELL_DATA.items():
-        if damage < 0:  # Healing spells
-            combos.append((list(elements), name, abs(damage)))
-
-    combos.sort(key=lambda x: x[2], reverse=True)
-    return combos
+    return HEALING_COMBOS
 
 
 if __name__ == "__main__":
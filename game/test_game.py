@@ -108,6 +108,604 @@ def test_spell_database():
         print(f"  {i}. {elem_str} {name} - {damage} dmg")
 
 
+def test_essence_buffer_in_place():
+    """EssenceBuffer must behave exactly like the old list FIFO, changing only in place"""
+    import random
+    from core_data import EssenceBuffer
+
+    rng = random.Random(1234)
+    buf = EssenceBuffer(capacity=10)
+    view = buf.essences
+    model = []
+
+    for _ in range(2000):
+        op = rng.randrange(5)
+        if op < 2:
+            magic = rng.choice(list(MagicType))
+            assert buf.add(magic) == (len(model) < 10)
+            if len(model) < 10:
+                model.append(magic)
+        elif op == 2:
+            n = rng.randint(1, 3)
+            assert buf.consume(n) == model[:n]
+            model = model[n:]
+        elif op == 3:
+            idx = rng.randrange(-1, 11)
+            assert buf.discard(idx) == (0 <= idx < len(model))
+            if 0 <= idx < len(model):
+                model.pop(idx)
+        else:
+            n = rng.randint(0, 3)
+            assert buf.pull(n) == min(n, len(model))
+            model = model[n:]
+
+        assert buf.count == len(model)
+        assert buf.essences == model
+        assert buf.counts == [model.count(m) for m in MagicType]
+        assert all(buf.count_of(m) == model.count(m) for m in MagicType)
+        assert buf.mask == sum(1 << (m - 1) for m in set(model))
+        assert all((m in buf.essences) == (m in model) for m in MagicType)
+        assert buf.essences[:3] == model[:3]
+        assert buf.is_full == (len(model) >= 10)
+        assert buf.essences is view
+
+    print("EssenceBuffer matches list FIFO over 2000 random ops")
+
+
+def test_compiled_verdicts():
+    """Compiled verdict table must match the linear first-match scan"""
+    import random
+    from dataclasses import FrozenInstanceError
+    from game_engine import process_prerouting, Wand
+
+    def linear_scan(rules, magic, from_enemy, chain):
+        for rule in rules:
+            if rule.chain == chain and rule.matches(magic, from_enemy):
+                return rule.action
+        return RuleAction.ACCEPT
+
+    rng = random.Random(99)
+    wand = Wand(owner="Test")
+    ruleset = wand.rules
+
+    for _ in range(300):
+        if ruleset.rules and rng.random() < 0.3:
+            ruleset.remove_rule(rng.randrange(len(ruleset.rules)))
+        elif rng.random() < 0.05:
+            ruleset.clear()
+        else:
+            ruleset.add_rule(DefenseRule(
+                chain=rng.choice(list(RuleChain)),
+                action=rng.choice(list(RuleAction)),
+                magic_type=rng.choice([None] + list(MagicType)),
+                source_filter=rng.random() < 0.3
+            ))
+
+        assert ruleset.total_cpu_cost() == sum(r.cpu_cost for r in ruleset.rules)
+        for chain in RuleChain:
+            for from_enemy in (False, True):
+                for magic in MagicType:
+                    expected = linear_scan(ruleset.rules, magic, from_enemy, chain)
+                    assert ruleset.process_magic(magic, from_enemy, chain) == expected
+
+        for from_enemy in (False, True):
+            for magic in MagicType:
+                expected = linear_scan(ruleset.rules, magic, from_enemy,
+                                       RuleChain.PREROUTING)
+                accepted, cost = process_prerouting(magic, from_enemy, wand)
+                assert accepted == (expected != RuleAction.DROP)
+                assert cost == (30 if expected == RuleAction.STRIP else 0)
+
+    # Nothing can change the rules behind the compiled table's back
+    ruleset.add_rule(DefenseRule(RuleChain.INPUT, RuleAction.DROP, MagicType.FIRE))
+    assert type(ruleset.rules) is tuple
+    try:
+        ruleset.rules[-1].action = RuleAction.ACCEPT
+        assert False, "DefenseRule should be frozen"
+    except FrozenInstanceError:
+        pass
+
+    print("Compiled verdict table matches linear scan over 300 ruleset changes")
+
+
+def test_vector_engine_matches_scalar():
+    """VectorizedDuelEngine must replay GameEngine exactly on the same essence stream"""
+    try:
+        from vector_engine import VectorizedDuelEngine, create_policy
+    except ImportError:
+        print("numpy not installed - skipping vector engine check")
+        return
+    from game_engine import apply_incoming_magic
+
+    n, max_turns = 48, 40
+    for p_level, e_level in [(3, 4), (2, 3), (4, 2)]:
+        vec = VectorizedDuelEngine(
+            n, (create_policy(p_level), create_policy(e_level)), seed=7)
+        streams = [vec.generate_incoming_magic() for _ in range(max_turns)]
+
+        scalar_results = []
+        for match in range(n):
+            engine = GameEngine(player_name="P", ai=create_ai(e_level))
+            p_ai = create_ai(p_level)
+            state = engine.state
+            for magic, from_enemy in streams:
+                for side, wand in enumerate((state.player, state.enemy)):
+                    apply_incoming_magic(wand, [
+                        (MagicType(int(m)), bool(f))
+                        for m, f in zip(magic[side, match], from_enemy[side, match])])
+                engine.start_action_phase()
+                if engine.run_ai_turn(p_ai, state.player, state.enemy):
+                    state.player_no_cast_turns = 0
+                else:
+                    state.player_no_cast_turns += 1
+                engine.process_ai_turn()
+                if engine.end_turn():
+                    break
+
+            scalar_results.append((state.player.hp, state.enemy.hp,
+                                   state.turn.turn_number, state.winner))
+
+        for magic, from_enemy in streams:
+            vec.step(magic, from_enemy)
+
+        names = ("P", create_ai(e_level).name)
+        for match, (p_hp, e_hp, turn, winner) in enumerate(scalar_results):
+            assert vec.hp[0, match] == p_hp and vec.hp[1, match] == e_hp
+            assert vec.turn[match] == turn
+            expected = -1 if winner is None else names.index(winner)
+            assert vec.winner[match] == expected
+
+    print("Vectorized engine matches scalar GameEngine turn for turn")
+
+
+def test_simulator_seeded():
+    """A match replays identically from its seed, whatever else ran before"""
+    from simulator import play_match
+
+    first = play_match(3, 6, seed=2024)
+    play_match(1, 2, seed=5)
+    assert play_match(3, 6, seed=2024) == first
+    assert first['winner'] in ("player", "enemy", None)
+    print(f"Seeded match replayed: {first['winner']} won in {first['turns']} turns")
+
+
+def test_interned_spell_table():
+    """Every 1-3 combo is interned and matches SPELL_DATA / the Wild fallback"""
+    from itertools import product
+    from core_data import EssenceBuffer, pack_magic, unpack_magic
+    from spell_database import SPELL_DATA, lookup_spell, lookup_spell_code
+
+    combos = 0
+    for length in (1, 2, 3):
+        for elements in product(list(MagicType), repeat=length):
+            code = pack_magic(elements)
+            spell = lookup_spell_code(code)
+            assert spell is lookup_spell(list(elements))
+            assert unpack_magic(code) == list(elements)
+            assert spell.elements == elements
+            if elements in SPELL_DATA:
+                name, damage, special, shield = SPELL_DATA[elements]
+                assert (spell.name, spell.damage, spell.special, spell.shield) == \
+                    (name, damage, special, shield)
+            else:
+                assert spell.name.startswith("Wild ")
+                assert spell.damage == 5 * length
+            combos += 1
+    assert combos == 7 + 49 + 343
+
+    buf = EssenceBuffer(capacity=4)
+    for magic in (MagicType.ICE, MagicType.FIRE, MagicType.DARK, MagicType.FIRE):
+        buf.add(magic)
+    buf.pull(2)
+    buf.add(MagicType.WATER)  # wraps around
+    assert buf.peek_code(3) == pack_magic([MagicType.DARK, MagicType.FIRE, MagicType.WATER])
+    assert buf.peek_code(0) == 0
+
+    print(f"All {combos} combos interned by packed code")
+
+
+def test_buffer_scanner():
+    """scan_buffer ranks the same options a brute-force copy-and-lookup finds"""
+    import random
+    from core_data import EssenceBuffer
+    from spell_database import lookup_spell
+    from ai_opponents import scan_buffer
+
+    rng = random.Random(8)
+    for _ in range(300):
+        buf = EssenceBuffer()
+        for _ in range(rng.randint(1, 10)):
+            buf.add(rng.choice(list(MagicType)))
+
+        essences = buf.essences.copy()
+        expected = set()
+        for discard in [None] + list(range(len(essences))):
+            remaining = essences.copy()
+            if discard is not None:
+                remaining.pop(discard)
+            for count in range(1, min(3, len(remaining)) + 1):
+                # Discards past index 2 never change the cast
+                key = discard if discard is not None and discard < 3 else None
+                expected.add((key, count, lookup_spell(remaining[:count]).damage))
+
+        options = scan_buffer(buf)
+        assert {(o.discard, o.count, o.spell.damage) for o in options} == expected
+        damages = [o.spell.damage for o in options]
+        assert damages == sorted(damages, reverse=True)
+
+    print("Buffer scanner agrees with brute force over 300 buffers")
+
+
+def test_structured_log():
+    """Log keeps the last 50 events, formats lazily, and can be switched off"""
+    from core_data import GameState, LOG_LIMIT, Wand
+
+    state = GameState(player=Wand(owner="A"), enemy=Wand(owner="B"))
+    for i in range(LOG_LIMIT + 10):
+        state.turn.turn_number = i
+        state.log_event("cast_damage", "A", "Inferno", 25, "B")
+    assert len(state.log) == LOG_LIMIT
+    assert state.log[0][0] == 10
+    assert state.recent_log(2) == ["Turn 58: A cast Inferno → 25 dmg to B",
+                                   "Turn 59: A cast Inferno → 25 dmg to B"]
+
+    engine = GameEngine(ai=create_ai(3), log=False)
+    for _ in range(3):
+        engine.start_incoming_phase()
+        engine.start_action_phase()
+        engine.player_cast(1)
+        engine.process_ai_turn()
+        engine.end_turn()
+    assert len(engine.state.log) == 0
+    assert engine.get_state_snapshot()['log'] == []
+    print("Structured log bounded, lazily formatted, and disableable")
+
+
+def test_magic_source_replay():
+    """Seeded magic sources replay the same essence stream, and seek() resumes it"""
+    import random
+    from game_engine import BatchedMagicSource, RandomMagicSource
+
+    a, b = RandomMagicSource(random.Random(3)), RandomMagicSource(random.Random(3))
+    assert [a.draw(3) for _ in range(50)] == [b.draw(3) for _ in range(50)]
+
+    def draws(seed):
+        source = BatchedMagicSource(seed, block_size=64)
+        return [source.draw(3) for _ in range(100)]  # crosses several blocks
+    stream = draws(42)
+    assert stream == draws(42)
+    assert stream != draws(43)
+    resumed = BatchedMagicSource(42, block_size=64)
+    resumed.seek(3 * 70)
+    assert resumed.draw(3) == stream[70]
+    assert all(isinstance(m, MagicType) and isinstance(e, bool)
+               for turn in stream for m, e in turn)
+
+    def replay(seed):
+        engine = GameEngine(ai=create_ai(4), source=BatchedMagicSource(seed))
+        for _ in range(10):
+            engine.start_incoming_phase()
+            engine.start_action_phase()
+            engine.end_turn()
+        return engine.state.player.buffer.essences.copy(), engine.state.player.cpu
+    assert replay(7) == replay(7)
+    print("Magic sources replay from seed")
+
+
+class _RecordingSocket:
+    """Stand-in websocket that keeps every frame sent to it"""
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+
+def test_state_deltas():
+    """Delta clients rebuild the exact full state from acked deltas"""
+    import asyncio
+    import json
+    from multiplayer_server import GameRoom
+    from network_protocol import apply_state_delta
+
+    async def play():
+        room = GameRoom("t", "A", seed=5)
+        sockets = {0: _RecordingSocket(), 1: _RecordingSocket()}
+        room.add_player(0, sockets[0], "A", delta=True)
+        room.add_player(1, sockets[1], "B")
+        client, states, full_bytes, delta_bytes = {}, {}, 0, 0
+
+        for _ in range(8):
+            room.engine.start_incoming_phase()
+            room.engine.start_action_phase()
+            for pid in (0, 1):
+                room.send_state(pid)
+            await room.flush()
+            room.engine.cast_spell(room.engine.state.player, room.engine.state.enemy, 1)
+            for pid in (0, 1):
+                room.send_state(pid)
+                room.send_state(pid)  # unchanged - sends nothing
+            await room.flush()
+            room.engine.end_turn()
+
+            for frame in sockets[0].sent:
+                msg = json.loads(frame)
+                delta_bytes += len(frame)
+                if msg["type"] == "state_delta":
+                    # Deltas apply to a version we acked, not always the newest
+                    client = apply_state_delta(states[msg["base"]], msg["changes"])
+                else:
+                    client = msg
+                client["version"] = msg["version"]
+                states[msg["version"]] = client
+                room.sync[0].ack(client["version"])
+            latest = room.sync[0].history[room.sync[0].version]
+            assert client == {**latest, "version": room.sync[0].version}
+            full_bytes += sum(len(f) for f in sockets[1].sent)
+            assert len(room.sync[1].history) == 1  # Non-delta: nothing to diff against
+            sockets[0].sent.clear()
+            sockets[1].sent.clear()
+
+        # Unacked history overflow falls back to a full snapshot
+        sync = room.sync[0]
+        for i in range(20):
+            sync.update({"type": "state_update", "turn": 100 + i})
+        assert sync.update({"type": "state_update", "turn": 0})["type"] == "state_update"
+        return full_bytes, delta_bytes
+
+    from network_protocol import diff_state
+    assert diff_state({"log": ["a", "b", "c"]}, {"log": ["b", "c", "d"]}) == \
+        {"log": {"shift": 1, "append": ["d"]}}
+    full_bytes, delta_bytes = asyncio.run(play())
+    assert delta_bytes < full_bytes
+    print(f"State deltas: {delta_bytes} bytes vs {full_bytes} full")
+
+
+def test_state_frame_encoding():
+    """Spliced state_update frames decode to the same views json.dumps gives"""
+    import asyncio
+    import json
+    from multiplayer_server import GameRoom, StateFrame
+
+    room = GameRoom("t", "A", seed=9)
+    sockets = {0: _RecordingSocket(), 1: _RecordingSocket()}
+    room.add_player(0, sockets[0], "A")
+    room.add_player(1, sockets[1], "B")
+    for _ in range(4):
+        room.engine.start_incoming_phase()
+        room.engine.start_action_phase()
+        room.engine.cast_spell(room.engine.state.enemy, room.engine.state.player, 2)
+        frame = StateFrame(room)
+        for pid in (0, 1):
+            assert json.loads(frame.encode(pid, 3)) == {**frame.views[pid], "version": 3}
+        room.engine.end_turn()
+
+    async def bye():
+        room.broadcast({"type": "error", "message": "bye"})
+        await room.flush()
+
+    asyncio.run(bye())
+    assert sockets[0].sent[-1] is sockets[1].sent[-1]  # one encoding shared
+    print("State frames splice to valid JSON and fan out once")
+
+
+class _ScriptedSocket(_RecordingSocket):
+    """Stand-in websocket that yields queued client frames, then closes"""
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = list(frames)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.frames:
+            raise StopAsyncIteration
+        return self.frames.pop(0)
+
+
+def test_binary_wire_format():
+    """Every schema message round-trips through its binary codec"""
+    import asyncio
+    import json
+    from multiplayer_server import MultiplayerServer, StateFrame, GameRoom
+    from network_protocol import (CLIENT_MESSAGES, SERVER_MESSAGES,
+                                  CLIENT_WIRE, SERVER_WIRE)
+
+    samples = {int: 7, bool: True, float: 1.5, str: "Fire", dict: {"hp": 3}}
+    lists = {"buffer": [1, 5, 7], "log": ["Turn 1: A cast Fireball"],
+             "frames": [b"\x01ab", b""]}
+
+    def sample(schema):
+        return {key: (key if key == "type" else sample(kind) if isinstance(kind, dict)
+                      else lists.get(key, [1]) if kind is list else samples[kind])
+                for key, kind in schema.items()}
+
+    for messages, wire in ((CLIENT_MESSAGES, CLIENT_WIRE), (SERVER_MESSAGES, SERVER_WIRE)):
+        for name, schema in messages.items():
+            message = sample(schema)
+            message["type"] = name
+            assert wire.decode(wire.encode(message)) == message, name
+
+    room = GameRoom("t", "A", seed=2)
+    engine = room.engine
+    for _ in range(3):
+        engine.start_incoming_phase()
+        engine.start_action_phase()
+        engine.cast_spell(engine.state.player, engine.state.enemy, 2)
+        engine.end_turn()
+    engine.state.log_event("message", None, "Server notice")
+    frame = StateFrame(room)
+    incoming = {"type": "magic_incoming", "your_received": 3, "your_dropped": 0,
+                "your_overflow": 0, "enemy_received": 2}
+    assert len(SERVER_WIRE.encode(incoming)) * 10 < len(json.dumps(incoming))
+
+    # The log travels as structured events and decodes to the same lines
+    binary, text = frame.encode(0, 4, "binary"), frame.encode(0, 4)
+    assert SERVER_WIRE.decode(binary)["log"] == json.loads(text)["log"]
+    assert any(" cast " in line for line in json.loads(text)["log"])
+    assert len(binary) * 3 < len(text)
+
+    # Binary and JSON clients share a room, each in its own encoding
+    server = MultiplayerServer()
+    host = _ScriptedSocket([CLIENT_WIRE.encode({"type": "join", "player_name": "A",
+                                                "encoding": "binary"})])
+    asyncio.run(server.handle_client(host, "/"))
+    joined = SERVER_WIRE.decode(host.sent[0])
+    assert joined["type"] == "joined" and joined["player_id"] == 0
+
+    server = MultiplayerServer()
+    room = GameRoom("r", "A")
+    room.add_player(0, host, "A", encoding="binary")
+    server.rooms["r"] = room
+    guest = _ScriptedSocket([json.dumps({"type": "join", "player_name": "B", "room_id": "r"})])
+    asyncio.run(server.handle_client(guest, "/"))
+    assert all(isinstance(f, str) for f in guest.sent)
+    host_types = [SERVER_WIRE.decode(f)["type"] for f in host.sent[1:]]
+    assert "state_update" in host_types and host_types[-1] == "error"  # guest left
+    print("Binary wire format round-trips and coexists with JSON")
+
+
+def test_shard_routing():
+    """Joins for another shard's room are redirected to that shard's port"""
+    import asyncio
+    import json
+    from multiplayer_server import MultiplayerServer, room_shard
+
+    shard = MultiplayerServer(shard_id=1, shard_ports=[9001, 9002])
+    host = _ScriptedSocket([json.dumps({"type": "join", "player_name": "A"})])
+    asyncio.run(shard.handle_client(host, "/"))
+    room_id = json.loads(host.sent[0])["room_id"]
+    assert room_shard(room_id) == 1 and room_shard("abcd1234") is None
+
+    guest = _ScriptedSocket([json.dumps({"type": "join", "player_name": "B",
+                                         "room_id": "0-abcd1234"}),
+                             json.dumps({"type": "get_state"})])
+    asyncio.run(shard.handle_client(guest, "/"))
+    assert [json.loads(f) for f in guest.sent] == [
+        {"type": "redirect", "room_id": "0-abcd1234", "port": 9001}]
+    print("Shard routing redirects to the owning shard")
+
+
+def test_matchmaking_queue():
+    """Close ratings pair at once, distant ones only after the window widens"""
+    import asyncio
+    import json
+    from matchmaking import MatchQueue
+    from metrics import Metrics
+    from multiplayer_server import ClientSession, MultiplayerServer, Outbox
+
+    queue = MatchQueue(bucket_width=50, base_window=100, widen_per_second=50)
+    a = queue.add(1500, "a", now=0)
+    b = queue.add(1520, "b", now=1)
+    c = queue.add(1900, "c", now=2)
+    d = queue.add(1610, "d", now=3)
+    gone = queue.add(1000, "gone", now=3)
+    assert queue.remove(gone.ticket_id) is gone and len(queue) == 4
+
+    assert [(x.payload, y.payload) for x, y in queue.tick(now=3)] == [("a", "b")]
+    assert queue.tick(now=4) == []  # 290 apart, d has waited 1s
+    assert [(x.payload, y.payload) for x, y in queue.tick(now=6)] == [("c", "d")]
+    assert len(queue) == 0
+    assert queue.wait_percentiles() == {"p50": 3, "p90": 4, "p99": 4}
+
+    # Server side: two rated joins are seated in one room on the next tick
+    server = MultiplayerServer(metrics=Metrics())
+    sockets = [_RecordingSocket(), _RecordingSocket()]
+    sessions = [ClientSession(Outbox(sock)) for sock in sockets]
+
+    async def play():
+        for session in sessions:
+            server.queue.add(1200, session)
+        await server.matchmaking_tick()
+        for session in sessions:
+            await session.outbox.flush()
+
+    asyncio.run(play())
+    assert sessions[0].room_id == sessions[1].room_id in server.rooms
+    assert [json.loads(s.sent[0])["type"] for s in sockets] == ["joined", "joined"]
+    assert set(server.lifecycle_report()["match_wait"]) == {"p50", "p90", "p99"}
+    assert "match_wait_p99 " in server.metrics.render()
+    print("Matchmaking pairs by rating and widens with wait time")
+
+
+def test_timer_wheel():
+    """Timers fire on their tick across cascades; cancel and ready short-circuit"""
+    import asyncio
+    import random
+    import struct
+    import time
+    from timer_wheel import TimerWheel
+    from multiplayer_server import GameRoom, MultiplayerServer
+
+    rng = random.Random(6)
+    wheel = TimerWheel(tick=1.0, slots=8, levels=3)  # 512-tick range
+    pending = {}
+    for now in range(1, 2000):
+        for _ in range(rng.randint(0, 3)):
+            deadline = now + rng.randint(1, 500)
+            timer = wheel.schedule(deadline, (deadline, len(pending), now))
+            pending[timer.payload] = timer
+        if pending and rng.random() < 0.3:
+            assert wheel.cancel(pending.pop(rng.choice(list(pending))))
+        for payload in wheel.advance(now):
+            assert payload[0] == now
+            del pending[payload]
+        assert len(wheel) == len(pending)
+
+    # Server: an idle room advances when its deadline passes
+    server = MultiplayerServer()
+    room = GameRoom("t", "A", seed=1)
+    room.add_player(0, _RecordingSocket(), "A")
+    room.add_player(1, _RecordingSocket(), "B")
+    server.rooms["t"] = room
+
+    async def play():
+        await server.start_game(room)
+        start = server.timers.origin + server.timers.now_tick * server.timers.tick
+        assert room.engine.state.turn.phase == "action" and room.deadline.pending
+        await server.expire_deadlines(start + 1.0)
+        assert room.engine.state.turn.turn_number == 1
+        await server.expire_deadlines(start + room.engine.state.turn.action_duration + 0.5)
+        assert room.engine.state.turn.turn_number == 2
+        first = room.deadline
+        for pid in (0, 1):
+            await server.handle_game_action(room, pid, {"type": "ready"})
+        assert not first.pending and room.engine.state.turn.turn_number == 3
+
+    asyncio.run(play())
+    assert "action phase timed out" in " ".join(room.engine.state.recent_log(10))
+
+    # One room raising in resolve_turn doesn't stop the other rooms' timers
+    rooms = []
+    for room_id in ("x", "y", "z"):
+        rooms.append(GameRoom(room_id, "A", seed=1))
+        rooms[-1].add_player(0, _RecordingSocket(), "A")
+        rooms[-1].add_player(1, _RecordingSocket(), "B")
+        server.rooms[room_id] = rooms[-1]
+    resolve_turn = server.resolve_turn
+
+    async def broken_resolve(room):
+        if room.room_id == "y":
+            raise struct.error("ushort format requires 0 <= number <= 65535")
+        await resolve_turn(room)
+
+    async def expire():
+        for room in rooms:
+            await server.start_game(room)
+        server.resolve_turn = broken_resolve
+        duration = rooms[0].engine.state.turn.action_duration
+        await server.expire_deadlines(time.monotonic() + duration + 1)
+
+    asyncio.run(expire())
+    assert [room.engine.state.turn.turn_number for room in rooms] == [2, 1, 2]
+    assert server.timer_errors == 1 and server.lifecycle_report()["timer_errors"] == 1
+    print("Timer wheel fires, cascades and cancels phase deadlines, past a broken room")
+
+
 def test_ai_levels():
     """Test all AI difficulty levels"""
     print("\n=== AI Levels Test ===\n")
@@ -117,9 +715,627 @@ def test_ai_levels():
         print(f"Level {level}: {ai.name} - {ai.description}")
 
 
+def test_room_lifecycle():
+    """Abandoned rooms are reaped, recycled clean, and kept under budget"""
+    import asyncio
+    import multiplayer_server
+    from multiplayer_server import IDLE_TIMEOUT, WAITING_TIMEOUT, MultiplayerServer, Outbox
+
+    server = MultiplayerServer()
+    origin = server.timers.origin
+
+    async def play():
+        # Nobody joins: the waiting timeout reaps the room and closes the socket
+        host = _RecordingSocket()
+        room = server.open_room("A")
+        room.lifecycle = server.timers.schedule(
+            room.last_activity + WAITING_TIMEOUT, ("waiting", room.room_id))
+        outbox = Outbox(host)
+        room.add_player(0, outbox, "A")
+        await server.expire_deadlines(room.last_activity + WAITING_TIMEOUT - 1)
+        assert room.room_id in server.rooms
+        await server.expire_deadlines(room.last_activity + WAITING_TIMEOUT + 1)
+        await outbox.flush()
+        assert not server.rooms and host.closed
+        assert "Room closed (waiting)" in host.sent[-1]
+
+        # Reused room starts clean: fresh wands, empty log, same objects
+        engine = room.engine
+        again = server.open_room("C")
+        assert again is room and again.engine is engine
+        assert not again.players and not again.closed
+        assert engine.state.turn.turn_number == 1 and not engine.state.log
+        assert engine.state.player.owner == "C" and engine.state.player.buffer.count == 0
+
+        # Seeded the same, a recycled room deals exactly what a new one does
+        fresh = multiplayer_server.GameRoom("x", "C", seed=3)
+        again.reset(again.room_id, "C", seed=3)
+        for r in (again, fresh):
+            r.add_player(0, _RecordingSocket(), "C")
+            r.add_player(1, _RecordingSocket(), "D")
+            r.engine.start_incoming_phase()
+        assert (again.engine.state.player.buffer.essences
+                == fresh.engine.state.player.buffer.essences)
+
+        # Idle: activity pushes the check back, silence reaps
+        started = origin + server.timers.now_tick * server.timers.tick  # wheel clock
+        again.last_activity = started
+        await server.start_game(again)
+        again.last_activity = started + 100
+        await server.expire_deadlines(started + IDLE_TIMEOUT + 1)
+        assert again.room_id in server.rooms and again.lifecycle.pending
+        await server.expire_deadlines(started + 100 + IDLE_TIMEOUT + 1)
+        assert not server.rooms
+
+        # Over budget: resolve_turn trims log and sync history
+        room = server.open_room("E")
+        room.add_player(0, _RecordingSocket(), "E", delta=True)
+        room.add_player(1, _RecordingSocket(), "F")
+        await server.start_game(room)
+        budget = multiplayer_server.ROOM_MEMORY_BUDGET
+        multiplayer_server.ROOM_MEMORY_BUDGET = 0
+        try:
+            await server.resolve_turn(room)
+        finally:
+            multiplayer_server.ROOM_MEMORY_BUDGET = budget
+        assert len(room.sync[0].history) <= 2 and server.trimmed == 1
+
+        # Released to the pool, a room lets go of its spectators too
+        pool = multiplayer_server.RoomPool(watched=set())
+        room = pool.acquire("s", "G")
+        watcher = Outbox(_RecordingSocket())
+        room.spectators[watcher] = "json"
+        pool.watched.add(room)
+        pool.release(room)
+        assert not room.spectators and not pool.watched and watcher.closed
+
+    asyncio.run(play())
+    report = server.lifecycle_report()
+    assert report["reclaimed"] == {"waiting": 1, "idle": 1}
+    assert report["rooms_created"] == 1 and report["rooms_reused"] == 2
+    assert report["rooms_active"] == 1
+    print("Idle rooms reaped, recycled and trimmed")
+
+
+def test_load_generator():
+    """AI load clients play full matches against an in-process server"""
+    import asyncio
+    import socket
+    import websockets
+    from multiplayer_server import MultiplayerServer
+    from test_multiplayer import LoadConfig, load_test, run_clients
+
+    server = MultiplayerServer()
+    config = LoadConfig(clients=6, join_rate=1000, think_time=0, turns=3, seed=1)
+
+    async def play():
+        async with websockets.serve(server.handle_client, "localhost", 0) as listener:
+            port = listener.sockets[0].getsockname()[1]
+            return await run_clients(f"ws://localhost:{port}", config)
+
+    stats = asyncio.run(play())
+    report = stats.report()
+    assert report["matches"] == 3 and report["errors"] == 0
+    assert 1 <= report["peak_rooms"] <= 3
+    assert stats.action_latency and len(stats.turn_latency) >= 6 * 2
+    assert report["action_latency_ms"]["p50"] <= report["action_latency_ms"]["p99"]
+    assert not server.rooms and server.trimmed == 0  # Ordinary matches fit the budget
+
+    # Sharded: load_test spawns the server, which starts its own shard processes
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    config = LoadConfig(clients=4, join_rate=1000, think_time=0, turns=2, seed=2)
+    sharded = load_test(config, port=port, shards=2).report()
+    assert sharded["matches"] == 2 and sharded["errors"] == 0
+    print(f"Load generator: {report['messages_per_sec']:.0f} msgs/s, "
+          f"peak {report['peak_rooms']} rooms, sharded run clean")
+
+
+def test_server_metrics():
+    """Metrics count frames, time handlers, and serve /metrics and stats"""
+    import asyncio
+    import json
+    from metrics import Histogram, Metrics, serve_metrics
+    from multiplayer_server import MultiplayerServer
+    from network_protocol import SERVER_WIRE
+
+    histogram = Histogram((0.001, 0.01, 0.1))
+    for value in (0.0005, 0.005, 0.005, 0.05):
+        histogram.observe(value)
+    assert histogram.buckets == [1, 2, 1, 0] and histogram.quantile(0.5) == 0.01
+
+    server = MultiplayerServer(metrics=Metrics(), admin_token="secret")
+    frames = [json.dumps({"type": "join", "player_name": "A"}),
+              '{"type": "zap"}',  # Rejected, still counted
+              json.dumps({"type": "get_state"}),
+              json.dumps({"type": "stats", "token": "wrong"}),
+              json.dumps({"type": "stats", "token": "sécret"}),  # Non-ASCII
+              json.dumps({"type": "stats", "token": "secret"})]
+    client = _ScriptedSocket(frames)
+
+    async def play():
+        await server.handle_client(client, "/")
+        endpoint = await serve_metrics(server.metrics, "127.0.0.1", 0)
+        port = endpoint.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+        page = (await reader.read()).decode()
+        endpoint.close()
+        return page
+
+    page = asyncio.run(play())
+    replies = [json.loads(frame) for frame in client.sent]
+    assert replies[-3] == replies[-2] == {"type": "error", "message": "Not authorized"}
+    stats = replies[-1]["metrics"]
+    assert stats["messages"] == {"join": 1, "malformed": 1, "get_state": 1, "stats": 3}
+    assert stats["handlers"]["get_state"]["count"] == 1 and stats["rooms"] == 1
+    assert stats["bytes_in"] == sum(map(len, frames))
+    assert server.metrics.bytes_out == sum(map(len, client.sent))
+    assert server.metrics.connections == 0
+    assert SERVER_WIRE.decode(SERVER_WIRE.encode(replies[-1])) == replies[-1]
+    assert page.startswith("HTTP/1.1 200 OK")
+    assert 'kernel_duel_messages_total{type="get_state"} 1' in page
+    assert 'kernel_duel_messages_total{type="malformed"} 1' in page
+    assert 'kernel_duel_handler_seconds_count{type="get_state"} 1' in page
+
+    # Off: stats refused, nothing counted
+    plain = MultiplayerServer()
+    client = _ScriptedSocket([json.dumps({"type": "stats", "token": "secret"})])
+    asyncio.run(plain.handle_client(client, "/"))
+    assert json.loads(client.sent[0])["message"] == "Metrics disabled"
+    print("Metrics counted and exposed")
+
+
+class _StalledSocket(_RecordingSocket):
+    """Stand-in websocket whose sends never complete (client stopped reading)"""
+    async def send(self, frame):
+        import asyncio
+        self.sent.append(frame)
+        await asyncio.Event().wait()
+
+
+def test_outbox_backpressure():
+    """Per-client queues coalesce state, drop slow clients, never block handlers"""
+    import asyncio
+    import json
+    from multiplayer_server import GameRoom, MultiplayerServer, Outbox
+
+    async def play():
+        # Stalled client: state frames coalesce, the rest pile up until dropped
+        stalled = _StalledSocket()
+        outbox = Outbox(stalled, limit=4, grace=0.05)
+        outbox.put("first")
+        await asyncio.sleep(0)  # Writer takes it and blocks in send
+        for version in range(5):
+            assert outbox.put(f"state {version}", state=True)
+        assert outbox.pending == 1 and outbox.stats["coalesced"] == 4
+        for i in range(3):
+            assert outbox.put(f"event {i}")
+        assert outbox.put("event 3") and outbox.pending == 5  # Over, within grace
+        await asyncio.sleep(0.06)
+        assert not outbox.put("event 4")
+        assert outbox.closed and outbox.stats["slow_disconnects"] == 1
+        await asyncio.sleep(0)
+        assert stalled.closed
+
+        # One stalled player can't hold up the room's handlers
+        server = MultiplayerServer()
+        room = GameRoom("t", "A", seed=3)
+        fast, stuck = _RecordingSocket(), _StalledSocket()
+        room.add_player(0, fast, "A")
+        room.add_player(1, stuck, "B")
+        server.rooms["t"] = room
+        await asyncio.wait_for(server.start_game(room), 1)
+        for _ in range(20):
+            await asyncio.wait_for(server.handle_game_action(room, 0, {"type": "get_state"}), 1)
+            await asyncio.wait_for(server.handle_game_action(room, 0, {"type": "ready"}), 1)
+            await asyncio.wait_for(server.handle_game_action(room, 1, {"type": "ready"}), 1)
+        await room.players[0].flush()
+        return fast, stuck, room
+
+    fast, stuck, room = asyncio.run(play())
+    states = [json.loads(f) for f in fast.sent if '"state_update"' in f]
+    assert states[-1]["turn"] == room.engine.state.turn.turn_number > 5
+    assert len(stuck.sent) == 1 and room.players[1].pending <= room.players[1].limit * 4
+    print("Outboxes coalesce state and isolate slow clients")
+
+
+def test_batched_actions():
+    """An actions message applies in one pass; batch clients get one write per tick"""
+    import asyncio
+    from multiplayer_server import GameRoom, MultiplayerServer, Outbox
+    from network_protocol import decode_server_frame
+
+    server = MultiplayerServer()
+    room = GameRoom("t", "A", seed=4)
+    sockets = [_RecordingSocket(), _RecordingSocket()]
+    outboxes = [Outbox(sock) for sock in sockets]
+    outboxes[0].batch = True
+    room.add_player(0, outboxes[0], "A")
+    room.add_player(1, outboxes[1], "B")
+    server.rooms["t"] = room
+
+    async def play():
+        await server.start_game(room)
+        await room.flush()
+        for sock in sockets:
+            sock.sent.clear()
+        count = room.engine.state.player.buffer.count
+        await server.handle_game_action(room, 0, {"type": "actions", "actions": [
+            {"type": "cast", "essence_count": 1},
+            {"type": "configure_rule", "chain": "PREROUTING", "action": "DROP",
+             "magic_type": 1, "source_filter": False},
+            {"type": "discard", "index": 99},
+            {"type": "join"},
+            {"type": "ready"},
+        ]})
+        await room.flush()
+        return count
+
+    count = asyncio.run(play())
+    assert len(sockets[0].sent) == 1  # Everything from that pass in one write
+    messages = decode_server_frame(sockets[0].sent[0])
+    results = messages[0]["results"]
+    assert [r["success"] for r in results] == [True, True, False, False, True]
+    assert results[3]["message"] == "Unknown action"
+    assert [m["type"] for m in messages[1:]] == ["state_update"]
+    assert messages[1]["your_wand"]["buffer_count"] == count - 1
+    assert messages[1]["your_wand"]["rules_count"] == 1
+    assert room.ready_status == {0: True, 1: False}
+    assert all(not frame.startswith('{"type": "batch"') for frame in sockets[1].sent)
+    print("Batched actions: one message in, one frame out")
+
+
+def test_spectators():
+    """Spectators share one encoded snapshot, rate-limited, buffers hidden"""
+    import asyncio
+    import json
+    import multiplayer_server
+    from multiplayer_server import ClientSession, GameRoom, MultiplayerServer, Outbox
+    from network_protocol import SERVER_WIRE
+
+    server = MultiplayerServer(spectator_interval=1.0)
+    room = GameRoom("t", "A", seed=8)
+    room.add_player(0, _RecordingSocket(), "A")
+    room.add_player(1, _RecordingSocket(), "B")
+    server.rooms["t"] = room
+    watchers = [ClientSession(Outbox(_RecordingSocket())) for _ in range(50)]
+    watchers[-1].encoding = "binary"
+
+    async def play():
+        await server.start_game(room)
+        for session in watchers:
+            server.watch(room, session)
+        await asyncio.sleep(0)
+        for session in watchers:
+            session.outbox.websocket.sent.clear()
+
+        # Two changes between ticks: one snapshot, of the latest state
+        await server.handle_game_action(room, 0, {"type": "cast", "essence_count": 1})
+        await server.handle_game_action(room, 1, {"type": "cast", "essence_count": 1})
+        tick = asyncio.create_task(server.spectator_tick(100.0))
+        await asyncio.sleep(0)
+        assert not tick.done()  # Yielded between chunks of 16
+        await tick
+        await asyncio.sleep(0)
+        first = [session.outbox.websocket.sent[:] for session in watchers]
+
+        # A change inside the interval waits for the interval to pass
+        await server.handle_game_action(room, 0, {"type": "get_state"})
+        await server.handle_game_action(room, 0, {"type": "discard", "index": 0})
+        await server.spectator_tick(100.5)
+        await asyncio.sleep(0)
+        held = any(len(session.outbox.websocket.sent) > 1 for session in watchers)
+        await server.spectator_tick(101.0)
+        await asyncio.sleep(0)
+        second = [session.outbox.websocket.sent[len(first[i]):]
+                  for i, session in enumerate(watchers)]
+        assert not held and all(len(sent) == 1 for sent in second)
+
+        # Leaving and closing
+        watchers[0].outbox.close()
+        server.unwatch(room, watchers[0])
+        await server.close_room(room, "disconnect", "Opponent disconnected", exclude=0)
+        await asyncio.sleep(0)
+        return first, second
+
+    chunk = multiplayer_server.SPECTATOR_CHUNK
+    multiplayer_server.SPECTATOR_CHUNK = 16
+    try:
+        first, second = asyncio.run(play())
+    finally:
+        multiplayer_server.SPECTATOR_CHUNK = chunk
+    count = room.engine.state.player.buffer.count
+    assert all(len(sent) == 1 for sent in first)
+    assert "B cast" in first[0][0]
+    assert all(sent[0] is first[0][0] for sent in first[:-1])  # Same bytes object
+    view = json.loads(first[0][0])
+    assert view["type"] == "spectator_update" and view["spectators"] == 50
+    assert "buffer" not in view["host_wand"] and "buffer" not in view["guest_wand"]
+    assert json.loads(second[0][0])["host_wand"]["buffer_count"] == count
+    assert SERVER_WIRE.decode(first[-1][0]) == view
+    last = watchers[1].outbox.websocket
+    assert json.loads(last.sent[-1])["type"] == "error" and last.closed
+    assert not server.watched
+    print("Spectators: one shared snapshot per interval")
+
+
+def test_message_validation():
+    """Malformed frames are rejected and counted before any handler runs"""
+    import asyncio
+    import json
+    from multiplayer_server import MALFORMED_LIMIT, GameRoom, MultiplayerServer, Outbox
+    from network_protocol import CLIENT_WIRE, SERVER_WIRE, ProtocolError, decode_client_frame
+    from spell_database import lookup_spell
+
+    for frame, kind in (("{bad", "frame"), ("[1]", "frame"), (b"\xff", "frame"), (b"", "frame"),
+                        ('{"type": "zap"}', "type"),
+                        ('{"type": "cast", "essence_count": true}', "field"),
+                        ('{"type": "discard", "index": 1000}', "field"),
+                        ('{"type": "configure_rule", "chain": "FORWARD"}', "field"),
+                        ('{"type": "configure_rule", "magic_type": 99}', "field"),
+                        (json.dumps({"type": "join", "player_name": "x" * 70000}), "field"),
+                        (json.dumps({"type": "join", "player_name": "x" * 33}), "field"),
+                        (json.dumps({"type": "stats", "token": "x" * 257}), "field")):
+        try:
+            decode_client_frame(frame)
+            assert False, frame
+        except ProtocolError as error:
+            assert error.kind == kind, frame
+    rule = {"type": "configure_rule", "chain": "INPUT", "action": "STRIP",
+            "magic_type": 7, "source_filter": True, "extra": 1}
+    assert decode_client_frame(json.dumps(rule)) == rule
+    assert decode_client_frame(CLIENT_WIRE.encode(rule))["chain"] == "INPUT"
+
+    # Garbage doesn't cost the connection its seat
+    server = MultiplayerServer()
+    client = _ScriptedSocket(["{bad", json.dumps({"type": "join", "player_name": "A"}),
+                              json.dumps({"type": "configure_rule", "chain": 5})])
+    asyncio.run(server.handle_client(client, "/"))
+    replies = [json.loads(frame) for frame in client.sent]
+    assert [r["type"] for r in replies] == ["error", "joined", "error"]
+    assert replies[2]["message"] == "Malformed message: Bad 'chain' in configure_rule"
+    assert server.malformed == {"frame": 1, "field": 1}
+
+    # A huge unknown type is quoted back cut short - a binary client can decode it
+    join = {"type": "join", "player_name": "A", "encoding": "binary"}
+    client = _ScriptedSocket([json.dumps(join), json.dumps({"type": "x" * 70000})])
+    asyncio.run(server.handle_client(client, "/"))
+    error = SERVER_WIRE.decode(client.sent[1])
+    assert error == {"type": "error",
+                     "message": "Malformed message: Unknown message type '" + "x" * 63}
+    assert server.malformed == {"frame": 1, "field": 1, "type": 1}
+
+    # A flood of it does
+    client = _ScriptedSocket(["{bad"] * (MALFORMED_LIMIT + 5))
+    asyncio.run(server.handle_client(client, "/"))
+    assert len(client.sent) == MALFORMED_LIMIT + 1
+    assert json.loads(client.sent[-1])["message"] == "Too many malformed messages"
+
+    # Cast reports the spell it consumed; a bad action in a batch fails alone
+    room = GameRoom("t", "A", seed=6)
+    sock = _RecordingSocket()
+    room.add_player(0, Outbox(sock), "A")
+    room.add_player(1, Outbox(_RecordingSocket()), "B")
+    server.rooms["t"] = room
+
+    async def play():
+        await server.start_game(room)
+        buffer = room.engine.state.player.buffer
+        spell = lookup_spell(buffer.essences[:2])
+        await server.handle_game_action(room, 0, {"type": "cast", "essence_count": 2})
+        await server.handle_game_action(room, 0, {"type": "actions", "actions": [
+            {"type": "configure_rule", "action": "NOPE"}, "x",
+            {"type": "configure_rule", "chain": "INPUT"}]})
+        await room.flush()
+        return spell
+
+    spell = asyncio.run(play())
+    replies = [json.loads(frame) for frame in sock.sent]
+    cast = next(r for r in replies if r["type"] == "action_result")
+    assert cast["spell_cast"] == spell.name
+    results = next(r for r in replies if r["type"] == "action_results")["results"]
+    assert [r["success"] for r in results] == [False, False, True]
+    assert results[1]["message"] == "Message is not an object"
+    print("Malformed messages rejected and counted")
+
+
+def test_replay_log():
+    """A recorded match replays to the exact state the players ended in"""
+    import asyncio
+    import tempfile
+    import time
+    import replay_log
+    from multiplayer_server import ClientSession, MultiplayerServer, Outbox
+    from replay import replay_match
+    from replay_log import CLOSE, ReplayLog, read_matches
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = ReplayLog(directory)
+        server = MultiplayerServer(replay=log)
+        sessions = [ClientSession(Outbox(_RecordingSocket())) for _ in range(2)]
+        sessions[1].name = "Bob"
+
+        async def play():
+            room = server.open_room("Alice", seed=4)  # Long enough to span chunks
+            server.seat(room, 0, sessions[0], "Created")
+            server.seat(room, 1, sessions[1], "Joined")
+            await server.start_game(room)
+            for turn in range(40):
+                await server.handle_game_action(room, 0, {
+                    "type": "configure_rule", "chain": "PREROUTING", "action": "DROP",
+                    "magic_type": turn % 7 + 1})
+                await server.handle_game_action(room, 0, {"type": "cast", "essence_count": 2})
+                await server.handle_game_action(room, 1, {"type": "actions", "actions": [
+                    {"type": "discard", "index": turn % 3}, {"type": "cast"}]})
+                if room.engine.state.winner:
+                    break
+                if turn % 4 == 3:
+                    await server.expire_deadlines(time.monotonic() + 60)  # Phase timeout
+                else:
+                    await server.handle_game_action(room, 0, {"type": "ready"})
+                    await server.handle_game_action(room, 1, {"type": "ready"})
+            final = (room.engine.get_state_snapshot(), list(room.engine.state.log))
+            await server.close_room(room, "disconnect", "Opponent disconnected", exclude=0)
+            return room.room_id, final
+
+        replay_log.CHUNK_SIZE, chunk_size = 256, replay_log.CHUNK_SIZE  # Several chunks
+        try:
+            room_id, final = asyncio.run(play())
+        finally:
+            replay_log.CHUNK_SIZE = chunk_size
+        log.flush()
+        matches = read_matches([log.path()])
+
+    assert len(matches) == 1
+    match = next(iter(matches.values()))
+    assert match.room_id == room_id and match.host == "Alice" and match.finished
+    assert match.records[-1] == (CLOSE, "disconnect")
+    room = replay_match(match)
+    assert (room.engine.get_state_snapshot(), list(room.engine.state.log)) == final
+    assert final[0]["turn"] > 5 and final[0]["enemy"]["name"] == "Bob"
+    assert log.path(0).endswith("replay-1970-01-01.bin")
+    print(f"Replayed {len(match.records)} records to the same end state")
+
+
+def test_snapshot_restore():
+    """Drained rooms come back mid-match, bit for bit, when their players resume"""
+    import asyncio
+    import json
+    import os
+    import tempfile
+    from multiplayer_server import ClientSession, MultiplayerServer, Outbox
+    from replay import replay_match
+    from replay_log import ReplayLog, read_matches
+    from room_snapshot import RoomSnapshot
+
+    def session(name):
+        client = ClientSession(Outbox(_RecordingSocket()))
+        client.name = name
+        return client
+
+    def received(client, kind):
+        return [m for m in map(json.loads, client.outbox.websocket.sent) if m["type"] == kind]
+
+    async def play(server, room, turns):
+        for turn in range(turns):
+            await server.handle_game_action(room, 0, {
+                "type": "configure_rule", "chain": "INPUT", "action": "DROP",
+                "magic_type": turn % 7 + 1})
+            await server.handle_game_action(room, 1, {"type": "discard", "index": turn % 2})
+            await server.handle_game_action(room, 0, {"type": "cast"})
+            await server.handle_game_action(room, 0, {"type": "ready"})
+            await server.handle_game_action(room, 1, {"type": "ready"})
+
+    def state(room):
+        engine = room.engine
+        return (engine.get_state_snapshot(), list(engine.state.log),
+                engine.source.rng.getstate(), list(engine.state.player.rules.rules),
+                engine.state.enemy.buffer.essences[:engine.state.enemy.buffer.count])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rooms.snap")
+        log = ReplayLog(directory)
+
+        async def first_process():
+            server = MultiplayerServer(replay=log)
+            seats, saved = [], []
+            for seed, host, guest in ((4, "Alice", "Bob"), (5, "Carol", "Dave")):
+                room = server.open_room(host, seed)
+                pair = [session(host), session(guest)]
+                server.seat(room, 0, pair[0], "Created")
+                server.seat(room, 1, pair[1], "Joined")
+                await server.start_game(room)
+                await play(server, room, 3)
+                seats.append(pair)
+                saved.append((room.room_id, state(room)))
+            waiting = session("Erin")
+            await server.handle_join(waiting, {"type": "join", "player_name": "Erin"})
+            assert await server.drain(path) == 2  # The waiting room is just closed
+            assert received(waiting, "restarting") == []
+            late = session("Frank")
+            await server.handle_join(late, {"type": "join"})
+            await late.outbox.flush()
+            assert received(late, "error")[-1]["message"] == "Server restarting"
+            return seats, saved
+
+        seats, saved = asyncio.run(first_process())
+        tokens = [[received(client, "restarting")[0] for client in pair] for pair in seats]
+        assert [notice["player_id"] for notice in tokens[0]] == [0, 1]
+        assert tokens[0][0]["token"] != tokens[0][1]["token"]
+
+        snapshot = RoomSnapshot(path)
+        assert len(snapshot) == 2
+
+        async def second_process():
+            server = MultiplayerServer(replay=log, snapshot=snapshot)
+            clients = [session("x"), session("y")]
+            for seat in (1, 0):  # Either player can be back first
+                await server.handle_join(clients[seat], {
+                    "type": "join", "room_id": tokens[0][seat]["room_id"],
+                    "resume": tokens[0][seat]["token"]})
+            room = server.rooms[saved[0][0]]
+            restored = state(room)
+            await clients[0].outbox.flush()
+            assert [c.player_id for c in clients] == [0, 1] and clients[0].name == "Alice"
+            assert received(clients[0], "state_update")[-1]["turn"] == restored[0]["turn"]
+
+            for token in ("not hex", "00" * 16, tokens[0][1]["token"]):
+                stranger = session("z")
+                await server.handle_join(stranger, {"type": "join", "resume": token})
+                await stranger.outbox.flush()
+                assert stranger.room_id is None
+                assert received(stranger, "error")[-1]["message"] in (
+                    "Unknown resume token", "Resume token expired")
+
+            await play(server, room, 3)
+            final = (room.engine.get_state_snapshot(), list(room.engine.state.log))
+            assert await server.drain(os.path.join(directory, "next.snap")) == 2  # + unclaimed
+            return restored, final
+
+        restored, final = asyncio.run(second_process())
+        snapshot.close()
+        assert restored == saved[0][1]
+        assert final[0]["turn"] > restored[0]["turn"]
+        assert len(RoomSnapshot(os.path.join(directory, "next.snap"))) == 2
+
+        # One match in the replay log across both processes, replaying to the end
+        log.flush()
+        matches = [m for m in read_matches([log.path()]).values() if m.host == "Alice"]
+        assert len(matches) == 1 and matches[0].room_id == saved[0][0]
+        match = matches[0]
+        room = replay_match(match)
+        assert (room.engine.get_state_snapshot(), list(room.engine.state.log)) == final
+    print(f"Restored room {saved[0][0]} at turn {restored[0]['turn']} and played on")
+
+
 if __name__ == "__main__":
     # Run all tests
     test_spell_database()
+    test_essence_buffer_in_place()
+    test_interned_spell_table()
+    test_compiled_verdicts()
+    test_vector_engine_matches_scalar()
+    test_buffer_scanner()
+    test_simulator_seeded()
+    test_structured_log()
+    test_magic_source_replay()
+    test_state_deltas()
+    test_state_frame_encoding()
+    test_binary_wire_format()
+    test_shard_routing()
+    test_matchmaking_queue()
+    test_timer_wheel()
+    test_room_lifecycle()
+    test_load_generator()
+    test_server_metrics()
+    test_outbox_backpressure()
+    test_batched_actions()
+    test_spectators()
+    test_message_validation()
+    test_replay_log()
+    test_snapshot_restore()
     test_ai_levels()
 
     print("\n" + "="*50)
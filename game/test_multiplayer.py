@@ -1,13 +1,32 @@
 """
-Test multiplayer server with two simulated clients
+Test multiplayer server with simulated clients
 
-Run this to verify the server works before connecting Godot clients
+Run this to verify the server works before connecting Godot clients:
+
+    python3 test_multiplayer.py --smoke          # Two clients, server already running
+    python3 test_multiplayer.py --clients 2000   # Load test against a spawned server
+
+The load generator plays AI strategies from ai_opponents over real
+websockets and reports throughput, action/turn latency percentiles and
+peak concurrent rooms.
 """
 
+import argparse
 import asyncio
+import multiprocessing
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
 import websockets
 import json
 
+from ai_opponents import AI_LEVELS, create_ai
+from core_data import GameState, MagicType, Wand
+from network_protocol import CLIENT_WIRE, decode_server_frame
+
 
 async def test_client(player_name: str, room_id: str = ""):
     """Simulate a player client"""
@@ -84,8 +103,365 @@ async def test_client(player_name: str, room_id: str = ""):
                 await asyncio.sleep(1)
 
 
-async def main():
-    """Run two test clients"""
+# ============================================================================
+# Load Generator - Thousands of AI clients
+# ============================================================================
+
+@dataclass
+class LoadConfig:
+    """
+    One load run
+
+    Data:
+        clients: Simulated players (rounded up to pairs)
+        join_rate: New clients connected per second
+        think_time: Mean seconds a client thinks before acting each turn
+        turns: Turns a match lasts before both players leave
+        levels: AI difficulty levels clients pick from
+        encoding: "json" or "binary" frames
+        batch: Send each turn as one "actions" message and accept batch frames
+        seed: Seeds each client's strategy choice and think jitter
+    """
+    clients: int = 100
+    join_rate: float = 200.0
+    think_time: float = 0.2
+    turns: int = 10
+    levels: Tuple[int, ...] = tuple(AI_LEVELS)
+    encoding: str = "json"
+    batch: bool = False
+    seed: int = 0
+
+
+@dataclass
+class LoadStats:
+    """
+    What one worker saw - merged across workers at the end
+
+    Data:
+        sent: Frames the clients wrote
+        frames: Frames the clients read
+        received: Messages in those frames (more than frames when batched)
+        turns: Turns the clients played
+        action_latency: Seconds from cast/configure_rule to its action_result
+        turn_latency: Seconds from ready to the next turn's state_update
+        room_events: (monotonic time, +1 open / -1 close) per room
+        matches/errors: Finished matches, and clients that failed or were dropped
+    """
+    sent: int = 0
+    frames: int = 0
+    received: int = 0
+    turns: int = 0
+    action_latency: List[float] = field(default_factory=list)
+    turn_latency: List[float] = field(default_factory=list)
+    room_events: List[Tuple[float, int]] = field(default_factory=list)
+    matches: int = 0
+    errors: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+
+    def merge(self, other: 'LoadStats'):
+        self.sent += other.sent
+        self.frames += other.frames
+        self.received += other.received
+        self.turns += other.turns
+        self.action_latency += other.action_latency
+        self.turn_latency += other.turn_latency
+        self.room_events += other.room_events
+        self.matches += other.matches
+        self.errors += other.errors
+        self.started = min(self.started or other.started, other.started)
+        self.finished = max(self.finished, other.finished)
+
+    def peak_rooms(self) -> int:
+        """Most rooms open at once (events are comparable across processes)"""
+        peak = live = 0
+        for _, delta in sorted(self.room_events):
+            live += delta
+            peak = max(peak, live)
+        return peak
+
+    def report(self) -> Dict[str, object]:
+        elapsed = max(self.finished - self.started, 1e-9)
+        return {
+            "messages_per_sec": (self.sent + self.received) / elapsed,
+            "sent": self.sent,
+            "received": self.received,
+            "frames_per_turn": (self.sent + self.frames) / max(self.turns, 1),
+            "action_latency_ms": _percentiles(self.action_latency),
+            "turn_latency_ms": _percentiles(self.turn_latency),
+            "peak_rooms": self.peak_rooms(),
+            "matches": self.matches,
+            "errors": self.errors,
+            "seconds": elapsed,
+        }
+
+
+def _percentiles(samples: List[float], percentiles=(50, 95, 99)) -> Dict[str, float]:
+    """Millisecond percentiles of samples in seconds"""
+    if not samples:
+        return {f"p{p}": 0.0 for p in percentiles}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {f"p{p}": ordered[min(last, int(round(p / 100 * last)))] * 1000
+            for p in percentiles}
+
+
+class LoadClient:
+    """
+    One simulated player - an ai_opponents strategy behind a websocket
+
+    The strategy runs against a local mirror of the player's own wand,
+    rebuilt from every state_update (enemy buffer contents stay hidden,
+    as they are for real clients).
+
+    Data:
+        name: Player name
+        strategy: AIStrategy choosing rules, casts and discards
+        mirror: GameState the strategy reads (player = us)
+        pending: Send times of actions still waiting for action_result
+    """
+    def __init__(self, name: str, config: LoadConfig, stats: LoadStats, rng: random.Random):
+        self.name = name
+        self.config = config
+        self.stats = stats
+        self.rng = rng
+        self.strategy = create_ai(rng.choice(config.levels), rng)
+        self.mirror = GameState(player=Wand(owner=name), enemy=Wand(owner="Opponent"))
+        self.pending: deque = deque()
+        self.ready_sent: Optional[Tuple[int, float]] = None  # (turn, time)
+        self.acted_turn = 0
+
+    async def send(self, websocket, message: dict):
+        self.stats.sent += 1
+        if self.config.encoding == "binary":
+            await websocket.send(CLIENT_WIRE.encode(message))
+        else:
+            await websocket.send(json.dumps(message))
+
+    def sync_mirror(self, data: dict):
+        """Copy a state_update into the strategy's view"""
+        state, mine, theirs = self.mirror, data["your_wand"], data["enemy_wand"]
+        state.turn.turn_number = data["turn"]
+        state.turn.phase = data["phase"]
+        me = state.player
+        me.hp, me.cpu, me.shield = mine["hp"], mine["cpu"], mine["shield"]
+        me.buffer.clear()
+        for magic in mine["buffer"]:
+            me.buffer.add(MagicType(magic))
+        state.enemy.hp, state.enemy.shield = theirs["hp"], theirs["shield"]
+
+    async def take_turn(self, websocket):
+        """Think, then send what the strategy picks - same order as the engine's AI turn"""
+        think = self.config.think_time
+        if think > 0:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * think)
+        me = self.mirror.player
+        actions = [{
+            "type": "configure_rule",
+            "chain": rule.chain.name,
+            "action": rule.action.name,
+            "magic_type": int(rule.magic_type) if rule.magic_type else 0,
+            "source_filter": rule.source_filter
+        } for rule in self.strategy.configure_defenses(self.mirror, me)]
+        count = self.strategy.choose_cast(self.mirror, me)
+        if count:
+            actions.append({"type": "cast", "essence_count": count})
+            me.buffer.consume(min(count, me.buffer.count))
+        index = self.strategy.should_discard(self.mirror, me)
+        if index is not None:
+            actions.append({"type": "discard", "index": index})
+        self.stats.turns += 1
+
+        if self.config.batch:
+            # Whole turn, ready included, in one message - one action_results back
+            self.pending.append(time.monotonic())
+            self.ready_sent = (self.mirror.turn.turn_number, time.monotonic())
+            actions.append({"type": "ready"})
+            await self.send(websocket, {"type": "actions", "actions": actions})
+            return
+
+        for action in actions:
+            if action["type"] != "discard":  # Only answered when it succeeds, so not timed
+                self.pending.append(time.monotonic())
+            await self.send(websocket, action)
+        self.ready_sent = (self.mirror.turn.turn_number, time.monotonic())
+        await self.send(websocket, {"type": "ready"})
+
+    async def play(self, uri: str, room: asyncio.Future, host: bool):
+        """
+        Play one match - the host creates the room and resolves room with
+        its id, the guest waits for it and joins
+        """
+        self.host = host
+        self.opened = False
+        try:
+            room_id = "" if host else await room
+            while uri is not None:
+                async with websockets.connect(uri, max_size=None) as websocket:
+                    await self.send(websocket, {
+                        "type": "join",
+                        "player_name": self.name,
+                        "room_id": room_id,
+                        "encoding": self.config.encoding,
+                        "batch": self.config.batch
+                    })
+                    uri = await self.run(websocket, room)
+        except (OSError, asyncio.CancelledError, websockets.exceptions.WebSocketException):
+            self.stats.errors += 1
+            if not room.done():
+                room.cancel()
+        finally:
+            if self.opened:
+                self.stats.room_events.append((time.monotonic(), -1))
+
+    async def run(self, websocket, room: asyncio.Future) -> Optional[str]:
+        """Handle frames until the match ends - returns a redirect URI, if any"""
+        stats = self.stats
+        async for frame in websocket:
+            stats.frames += 1
+            for data in decode_server_frame(frame):
+                stats.received += 1
+                outcome = await self.handle(websocket, room, data)
+                if outcome is not None:
+                    return outcome[0]
+        return None
+
+    async def handle(self, websocket, room: asyncio.Future,
+                     data: dict) -> Optional[Tuple[Optional[str]]]:
+        """One server message - (redirect URI or None,) once the match is over"""
+        stats = self.stats
+        msg_type = data["type"]
+
+        if msg_type == "state_update":
+            self.sync_mirror(data)
+            turn = data["turn"]
+            if self.ready_sent is not None and turn > self.ready_sent[0]:
+                stats.turn_latency.append(time.monotonic() - self.ready_sent[1])
+                self.ready_sent = None
+            if turn > self.config.turns:
+                stats.matches += self.host
+                return (None,)  # Match length reached - leave
+            if data["phase"] == "action" and turn > self.acted_turn:
+                self.acted_turn = turn
+                await self.take_turn(websocket)
+
+        elif msg_type in ("action_result", "action_results"):
+            if self.pending:
+                stats.action_latency.append(time.monotonic() - self.pending.popleft())
+
+        elif msg_type == "joined" and self.host:
+            self.opened = True
+            stats.room_events.append((time.monotonic(), 1))
+            room.set_result(data["room_id"])
+
+        elif msg_type == "redirect":
+            # Room lives on another shard
+            return (f"ws://{websocket.remote_address[0]}:{data['port']}",)
+
+        elif msg_type == "game_over":
+            stats.matches += self.host
+            return (None,)
+
+        elif msg_type == "error":
+            return (None,)  # Opponent left, or the room was closed
+        return None
+
+
+async def run_clients(uri: str, config: LoadConfig, first: int = 0,
+                      count: Optional[int] = None) -> LoadStats:
+    """
+    Connect count clients (a pair at a time, at config.join_rate) and
+    play until every match is over
+    """
+    count = config.clients if count is None else count
+    stats = LoadStats(started=time.monotonic())
+    loop = asyncio.get_running_loop()
+    tasks = []
+    for pair in range(first // 2, (first + count + 1) // 2):
+        rng = random.Random(config.seed * 1000003 + pair)
+        room = loop.create_future()
+        host = LoadClient(f"load-{pair}a", config, stats, rng)
+        guest = LoadClient(f"load-{pair}b", config, stats, rng)
+        tasks.append(asyncio.create_task(host.play(uri, room, True)))
+        tasks.append(asyncio.create_task(guest.play(uri, room, False)))
+        await asyncio.sleep(2 / config.join_rate)
+    await asyncio.gather(*tasks)
+    stats.finished = time.monotonic()
+    return stats
+
+
+def _worker(uri: str, config: LoadConfig, first: int, count: int, results):
+    """Client process entry point - its slice of the clients, stats back on a queue"""
+    results.put(asyncio.run(run_clients(uri, config, first, count)))
+
+
+def _server_process(host: str, port: int, shards: int):
+    import multiplayer_server
+    multiplayer_server.main(["--host", host, "--port", str(port), "--shards", str(shards)])
+
+
+def load_test(config: LoadConfig, uri: Optional[str] = None, workers: int = 1,
+              port: int = 8799, shards: int = 1) -> LoadStats:
+    """
+    Run a load test - against uri, or a server spawned on port
+
+    Clients are split across workers processes so the generator isn't
+    the bottleneck; their stats are merged.
+    """
+    server = None
+    if uri is None:
+        # Not daemonic - a sharded server starts its own shard processes.
+        # terminate() below reaches them too (main() passes SIGTERM on)
+        server = multiprocessing.Process(target=_server_process,
+                                         args=("localhost", port, shards))
+        server.start()
+        uri = f"ws://localhost:{port}"
+        time.sleep(1.0)  # Let it bind
+    try:
+        if workers <= 1:
+            return asyncio.run(run_clients(uri, config))
+        results = multiprocessing.Queue()
+        share = -(-config.clients // workers)
+        share += share % 2  # Whole pairs per worker
+        procs = [multiprocessing.Process(target=_worker,
+                                         args=(uri, config, i * share, share, results))
+                 for i in range(workers) if i * share < config.clients]
+        for proc in procs:
+            proc.start()
+        stats = LoadStats()
+        for _ in procs:
+            stats.merge(results.get())
+        for proc in procs:
+            proc.join()
+        return stats
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+
+def print_report(stats: LoadStats):
+    """Human-readable load test summary"""
+    report = stats.report()
+    print(f"Matches: {report['matches']}  errors: {report['errors']}  "
+          f"time: {report['seconds']:.1f}s")
+    print(f"Messages: {report['sent']} sent, {report['received']} received, "
+          f"{report['messages_per_sec']:.0f}/s, "
+          f"{report['frames_per_turn']:.1f} frames per client turn")
+    for key, label in (("action_latency_ms", "action -> action_result"),
+                       ("turn_latency_ms", "ready -> next turn state")):
+        p = report[key]
+        print(f"{label:26} p50 {p['p50']:7.1f}ms  p95 {p['p95']:7.1f}ms  "
+              f"p99 {p['p99']:7.1f}ms")
+    print(f"Peak concurrent rooms: {report['peak_rooms']}")
+
+
+# ============================================================================
+# Entry Point
+# ============================================================================
+
+async def smoke_test():
+    """Two hand-driven clients against a running server"""
     print("=" * 60)
     print("Multiplayer Server Test")
     print("=" * 60)
@@ -111,8 +487,40 @@ async def main():
     print("\n✓ Test complete!")
 
 
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Kernel Duel load generator")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Original two-client walkthrough against a running server")
+    parser.add_argument("--uri", help="Target server (default: spawn one locally)")
+    parser.add_argument("--port", type=int, default=8799, help="Port for the spawned server")
+    parser.add_argument("--shards", type=int, default=1, help="Shards for the spawned server")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--join-rate", type=float, default=200.0, help="Clients per second")
+    parser.add_argument("--think", type=float, default=0.2, help="Mean think time (s)")
+    parser.add_argument("--turns", type=int, default=10, help="Match length in turns")
+    parser.add_argument("--ai", default="1,2,3,4,5,6", help="AI levels clients pick from")
+    parser.add_argument("--encoding", choices=("json", "binary"), default="json")
+    parser.add_argument("--batch", action="store_true",
+                        help="One actions message per turn, batched server frames")
+    parser.add_argument("--workers", type=int, default=1, help="Client processes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.smoke:
+        asyncio.run(smoke_test())
+        return
+
+    config = LoadConfig(clients=args.clients, join_rate=args.join_rate,
+                        think_time=args.think, turns=args.turns,
+                        levels=tuple(int(level) for level in args.ai.split(",")),
+                        encoding=args.encoding, batch=args.batch, seed=args.seed)
+    print(f"{config.clients} clients, {config.join_rate:g}/s joins, "
+          f"{config.think_time:g}s think, {config.turns} turns, {args.workers} worker(s)")
+    print_report(load_test(config, args.uri, args.workers, args.port, args.shards))
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         print("\nTest cancelled")
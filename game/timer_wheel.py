@@ -0,0 +1,126 @@
+"""
+Hierarchical Timer Wheel - One clock for every room's deadlines
+
+Like the kernel's timer wheel (kernel/time/timer.c): level 0 has one
+slot per tick, each higher level has slots `slots` times coarser.
+A timer goes in the coarsest level that still resolves its expiry and
+is cascaded down as its time approaches. schedule() and cancel() are
+O(1); advance() costs O(ticks passed + timers fired or cascaded).
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+# ============================================================================
+# Timer - One pending deadline
+# ============================================================================
+
+class Timer:
+    """
+    A scheduled deadline
+
+    Data:
+        expires: Expiry, in wheel ticks
+        payload: Returned by advance() when the timer fires
+        slot: Slot dict currently holding the timer (None once fired/cancelled)
+    """
+    __slots__ = ("expires", "payload", "slot")
+
+    def __init__(self, expires: int, payload: Any):
+        self.expires = expires
+        self.payload = payload
+        self.slot: Optional[Dict[int, 'Timer']] = None
+
+    @property
+    def pending(self) -> bool:
+        return self.slot is not None
+
+
+# ============================================================================
+# Wheel
+# ============================================================================
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel
+
+    Data:
+        tick: Seconds per level-0 slot
+        slots: Slots per level (power of two)
+        levels: Number of levels (range = tick * slots**levels)
+        now_tick: Last tick processed
+    """
+    def __init__(self, tick: float = 0.1, slots: int = 64, levels: int = 4,
+                 now: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.origin = now
+        self.now_tick = 0
+        self._shift = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheel: List[List[Dict[int, Timer]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)]
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, deadline: float, payload: Any) -> Timer:
+        """Fire payload at deadline (same clock as advance's now)"""
+        expires = int((deadline - self.origin) / self.tick + 0.999999)
+        timer = Timer(max(expires, self.now_tick + 1), payload)
+        self._place(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer: Optional[Timer]) -> bool:
+        """Drop a pending timer - False if it already fired or was cancelled"""
+        if timer is None or timer.slot is None:
+            return False
+        del timer.slot[id(timer)]
+        timer.slot = None
+        self._count -= 1
+        return True
+
+    def _place(self, timer: Timer):
+        delta = timer.expires - self.now_tick
+        level = 0
+        while level < self.levels - 1 and delta >= 1 << (self._shift * (level + 1)):
+            level += 1
+        index = (timer.expires >> (self._shift * level)) & self._mask
+        slot = self._wheel[level][index]
+        slot[id(timer)] = timer
+        timer.slot = slot
+
+    def advance(self, now: float) -> List[Any]:
+        """Move the clock to now, return payloads of every timer that expired"""
+        target = int((now - self.origin) / self.tick)
+        fired = []
+        while self.now_tick < target:
+            self.now_tick += 1
+            tick = self.now_tick
+
+            # Cascade coarser levels whose slot boundary we just crossed,
+            # highest first so their timers can fall through every level
+            level = 1
+            while level < self.levels and tick & ((1 << (self._shift * level)) - 1) == 0:
+                level += 1
+            for upper in range(level - 1, 0, -1):
+                index = (tick >> (self._shift * upper)) & self._mask
+                slot = self._wheel[upper][index]
+                if slot:
+                    cascading = list(slot.values())
+                    slot.clear()
+                    for timer in cascading:
+                        self._place(timer)
+
+            slot = self._wheel[0][tick & self._mask]
+            if slot:
+                due = [t for t in slot.values() if t.expires <= tick]
+                for timer in due:
+                    del slot[id(timer)]
+                    timer.slot = None
+                    fired.append(timer.payload)
+                self._count -= len(due)
+        return fired
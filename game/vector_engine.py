@@ -0,0 +1,409 @@
+"""
+Vectorized Duel Engine - Many AI-vs-AI matches in lockstep
+
+Design: Struct-of-arrays, like a NIC's descriptor rings. Every match is a
+row in a set of NumPy columns and every phase is one batched pass over all
+rows. Used for balance sweeps; GameEngine stays the reference rules.
+
+Requires numpy (pip install numpy).
+
+Side 0 is GameState.player, side 1 is GameState.enemy.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core_data import (MagicType, DefenseRule, RuleAction, RuleChain,
+                       RuleSet, VERDICT_TABLE_SIZE, PACKED_COMBO_LIMIT)
+from spell_database import SPELL_TABLE
+
+
+# ============================================================================
+# Spell Tables - Every 1-3 element combo, indexed by packed code
+# ============================================================================
+
+def _build_spell_tables() -> Tuple[np.ndarray, np.ndarray]:
+    """Damage and shield per packed code (code 0 = no cast)"""
+    damage = np.zeros(PACKED_COMBO_LIMIT, dtype=np.int64)
+    shield = np.zeros(PACKED_COMBO_LIMIT, dtype=np.int64)
+    for code, spell in enumerate(SPELL_TABLE):
+        if spell is not None:
+            damage[code] = spell.damage
+            shield[code] = spell.shield
+    return damage, shield
+
+
+SPELL_DAMAGE, SPELL_SHIELD = _build_spell_tables()
+
+# Match outcome reasons
+REASON_NONE = 0
+REASON_HP = 1
+REASON_STARVATION = 2
+
+
+# ============================================================================
+# Vector Policies - Batched counterparts of the AIStrategy classes
+# ============================================================================
+
+class VectorPolicy:
+    """
+    Batched strategy for one side of every match
+
+    Mirrors an AIStrategy from ai_opponents, but decides for all N
+    matches at once from the engine's columns.
+
+    Data:
+        name: Same name as the scalar AI
+        defenses: Rules configured in the first action phase
+    """
+    name = "Idle"
+    defenses: List[DefenseRule] = []
+
+    def choose_cast(self, engine: "VectorizedDuelEngine", side: int) -> np.ndarray:
+        """Essences to cast per match (0 = skip)"""
+        return np.zeros(engine.n, dtype=np.int64)
+
+    def choose_discard(self, engine: "VectorizedDuelEngine", side: int) -> np.ndarray:
+        """Index to discard per match (-1 = keep)"""
+        return np.full(engine.n, -1, dtype=np.int64)
+
+
+def _water_in_first3(engine: "VectorizedDuelEngine", side: int) -> np.ndarray:
+    """MagicType.WATER in buffer.essences[:3], per match"""
+    first3 = engine.buf[side, :, :3]
+    live = np.arange(3) < engine.buf_len[side][:, None]
+    return ((first3 == MagicType.WATER) & live).any(axis=1)
+
+
+class PassivePolicy(VectorPolicy):
+    """Level 1 - random 1-2 element casts, no defense"""
+    name = "Novice Mage"
+    defenses = []
+
+    def choose_cast(self, engine, side):
+        n = engine.buf_len[side]
+        upper = np.minimum(n, 2)
+        picks = engine.rng.integers(1, np.maximum(upper, 1) + 1)
+        return np.where(n == 0, 0, picks)
+
+
+class DefensivePolicy(VectorPolicy):
+    """Level 2 - blocks Fire and Dark, heals when low"""
+    name = "Shieldmage"
+    defenses = [
+        DefenseRule(chain=RuleChain.PREROUTING, action=RuleAction.DROP,
+                    magic_type=MagicType.FIRE),
+        DefenseRule(chain=RuleChain.PREROUTING, action=RuleAction.DROP,
+                    magic_type=MagicType.DARK),
+    ]
+
+    def choose_cast(self, engine, side):
+        n = engine.buf_len[side]
+        heal = (engine.hp[side] < 50) & (n >= 2) & _water_in_first3(engine, side)
+        return np.select([n == 0, heal], [0, 2], default=np.minimum(n, 2))
+
+
+class AggressivePolicy(VectorPolicy):
+    """Level 3 - blocks Dark, always casts as many as possible"""
+    name = "Battle Mage"
+    defenses = [
+        DefenseRule(chain=RuleChain.PREROUTING, action=RuleAction.DROP,
+                    magic_type=MagicType.DARK),
+    ]
+
+    def choose_cast(self, engine, side):
+        return np.minimum(engine.buf_len[side], 3)
+
+    def choose_discard(self, engine, side):
+        return np.where(engine.buf_len[side] > 8, 0, -1)
+
+
+class BalancedPolicy(VectorPolicy):
+    """Level 4 - blocks Fire and Dark, takes strong triples, heals when low"""
+    name = "Adept Mage"
+    defenses = DefensivePolicy.defenses
+
+    def choose_cast(self, engine, side):
+        n = engine.buf_len[side]
+        heal = (engine.hp[side] < 30) & (n >= 2) & _water_in_first3(engine, side)
+        dmg3 = SPELL_DAMAGE[engine.prefix_codes(side, np.full(engine.n, 3))]
+        good3 = (n >= 3) & ((dmg3 >= 30) | (dmg3 <= -15))
+        return np.select([n == 0, heal, good3, n >= 2], [0, 2, 3, 2], default=1)
+
+    def choose_discard(self, engine, side):
+        oldest_weak = engine.buf[side, :, 0] == MagicType.NATURE
+        return np.where((engine.buf_len[side] > 7) & oldest_weak, 0, -1)
+
+
+VECTOR_POLICIES = {
+    1: PassivePolicy,
+    2: DefensivePolicy,
+    3: AggressivePolicy,
+    4: BalancedPolicy,
+}
+
+
+def create_policy(difficulty: int) -> VectorPolicy:
+    """
+    Create the vectorized counterpart of create_ai(difficulty)
+
+    Levels 5-6 keep per-match learning state and are not vectorized.
+    """
+    if difficulty not in VECTOR_POLICIES:
+        raise ValueError(f"No vectorized policy for AI level {difficulty}")
+    return VECTOR_POLICIES[difficulty]()
+
+
+# ============================================================================
+# Vectorized Duel Engine
+# ============================================================================
+
+class VectorizedDuelEngine:
+    """
+    N matches stepped in lockstep, one NumPy pass per phase
+
+    Data (shape (2, N) unless noted, side 0 = player, side 1 = enemy):
+        hp, shield, cpu: Wand stats
+        buf: (2, N, capacity) MagicType codes, oldest first
+        buf_len: Essences in each buffer
+        verdicts: (2, N, VERDICT_TABLE_SIZE) compiled RuleSet tables
+        passive_cost: Per-turn CPU cost of installed rules
+        no_cast: Consecutive turns without casting
+        turn: (N,) current turn number
+        winner: (N,) -1 while ongoing, else winning side
+        reason: (N,) REASON_* for finished matches
+    """
+    def __init__(self, n: int, policies: Tuple[VectorPolicy, VectorPolicy],
+                 seed: Optional[int] = None, capacity: int = 10,
+                 max_hp: int = 100, max_cpu: int = 100):
+        self.n = n
+        self.policies = policies
+        self.rng = np.random.default_rng(seed)
+        self.capacity = capacity
+        self.max_hp = max_hp
+        self.max_cpu = max_cpu
+
+        self.hp = np.full((2, n), max_hp, dtype=np.int64)
+        self.shield = np.zeros((2, n), dtype=np.int64)
+        self.cpu = np.full((2, n), max_cpu, dtype=np.int64)
+        self.buf = np.zeros((2, n, capacity), dtype=np.int64)
+        self.buf_len = np.zeros((2, n), dtype=np.int64)
+        self.verdicts = np.full((2, n, VERDICT_TABLE_SIZE), RuleAction.ACCEPT,
+                                dtype=np.int64)
+        self.passive_cost = np.zeros((2, n), dtype=np.int64)
+        self.no_cast = np.zeros((2, n), dtype=np.int64)
+        self.turn = np.ones(n, dtype=np.int64)
+        self.winner = np.full(n, -1, dtype=np.int64)
+        self.reason = np.zeros(n, dtype=np.int64)
+
+        self.cast_counts = np.zeros((2, 4), dtype=np.int64)  # per side, per size
+        self._defenses_installed = False
+
+    @property
+    def active(self) -> np.ndarray:
+        """Matches still being played"""
+        return self.winner < 0
+
+    # ------------------------------------------------------------------
+    # Column helpers
+    # ------------------------------------------------------------------
+
+    def _take_damage(self, side: int, amount: np.ndarray):
+        """Wand.take_damage for every match - shield absorbs first"""
+        absorbed = np.minimum(self.shield[side], amount)
+        self.shield[side] -= absorbed
+        self.hp[side] = np.maximum(self.hp[side] - (amount - absorbed), 0)
+
+    def prefix_codes(self, side: int, counts: np.ndarray) -> np.ndarray:
+        """Packed spell code (pack_magic) of the first `counts` essences per match"""
+        b = self.buf[side]
+        counts = np.minimum(counts, self.buf_len[side])
+        return (np.where(counts >= 1, b[:, 0], 0)
+                | np.where(counts >= 2, b[:, 1] << 3, 0)
+                | np.where(counts >= 3, b[:, 2] << 6, 0))
+
+    def _pull(self, side: int, counts: np.ndarray):
+        """EssenceBuffer.pull for every match"""
+        idx = np.minimum(np.arange(self.capacity) + counts[:, None],
+                         self.capacity - 1)
+        self.buf[side] = np.take_along_axis(self.buf[side], idx, axis=1)
+        self.buf_len[side] -= counts
+
+    def _discard(self, side: int, index: np.ndarray):
+        """EssenceBuffer.discard for every match (index -1 = none)"""
+        positions = np.arange(self.capacity)
+        shift = (index[:, None] >= 0) & (positions >= index[:, None])
+        idx = np.minimum(positions + shift, self.capacity - 1)
+        self.buf[side] = np.take_along_axis(self.buf[side], idx, axis=1)
+        self.buf_len[side] -= index >= 0
+
+    def _install_defenses(self, side: int, rules: List[DefenseRule]):
+        """Configure rules at 20 CPU each, like GameEngine.process_ai_turn"""
+        # One compiled table per affordable prefix of the rule list
+        tables, costs = [], []
+        ruleset = RuleSet()
+        tables.append(ruleset.verdicts)
+        costs.append(0)
+        for rule in rules:
+            ruleset.add_rule(rule)
+            tables.append(ruleset.verdicts)
+            costs.append(ruleset.total_cpu_cost())
+
+        active = self.active
+        installed = np.where(active, np.minimum(len(rules), self.cpu[side] // 20), 0)
+        self.cpu[side] -= 20 * installed
+        self.verdicts[side] = np.asarray(tables, dtype=np.int64)[installed]
+        self.passive_cost[side] = np.asarray(costs, dtype=np.int64)[installed]
+
+    # ------------------------------------------------------------------
+    # Phases
+    # ------------------------------------------------------------------
+
+    def generate_incoming_magic(self, count: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched generate_incoming_magic for both sides of every match
+        Returns: (magic, from_enemy), each shaped (2, N, count)
+        """
+        magic = self.rng.integers(1, len(MagicType) + 1, size=(2, self.n, count))
+        from_enemy = (self.rng.random((2, self.n, count)) < 0.90).astype(np.int64)
+        return magic, from_enemy
+
+    def incoming_phase(self, magic: Optional[np.ndarray] = None,
+                       from_enemy: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        PREROUTING filter, buffer insertion and overflow damage
+        Returns: Per-side stats arrays (accepted, dropped, overflow)
+        """
+        if magic is None:
+            magic, from_enemy = self.generate_incoming_magic()
+        magic = np.asarray(magic, dtype=np.int64)
+        from_enemy = np.asarray(from_enemy, dtype=np.int64)
+
+        active = self.active
+        rows = np.arange(self.n)
+        stats = {name: np.zeros((2, self.n), dtype=np.int64)
+                 for name in ('accepted', 'dropped', 'overflow')}
+
+        for side in (0, 1):
+            vidx = (RuleChain.PREROUTING << 4) | (from_enemy[side] << 3) | magic[side]
+            verdict = np.take_along_axis(self.verdicts[side], vidx, axis=1)
+            passed = (verdict != RuleAction.DROP) & active[:, None]
+            stats['dropped'][side] = ((~passed) & active[:, None]).sum(axis=1)
+
+            for j in range(magic.shape[2]):
+                has_room = self.buf_len[side] < self.capacity
+                put = passed[:, j] & has_room
+                over = passed[:, j] & ~has_room
+
+                slot = np.minimum(self.buf_len[side], self.capacity - 1)
+                self.buf[side, rows[put], slot[put]] = magic[side, put, j]
+                self.buf_len[side] += put
+                self._take_damage(side, over * 10)  # 10 HP per overflow
+
+                stats['accepted'][side] += put
+                stats['overflow'][side] += over
+
+        return stats
+
+    def action_phase(self):
+        """Refresh CPU, pay rule costs, then each side configures, casts, discards"""
+        active = self.active
+        self.cpu = np.where(active, self.max_cpu, self.cpu)
+        affordable = active & (self.cpu >= self.passive_cost)
+        self.cpu -= np.where(affordable, self.passive_cost, 0)
+
+        for side in (0, 1):
+            policy = self.policies[side]
+            target = 1 - side
+
+            if not self._defenses_installed and policy.defenses:
+                self._install_defenses(side, policy.defenses)
+
+            # Cast - spell lookup and effects for every match at once
+            counts = np.asarray(policy.choose_cast(self, side), dtype=np.int64)
+            counts = np.where(active & (counts <= self.buf_len[side]), counts, 0)
+            codes = self.prefix_codes(side, counts)
+            damage = SPELL_DAMAGE[codes]
+            self._take_damage(target, np.maximum(damage, 0))
+            self.hp[side] = np.minimum(self.hp[side] + np.maximum(-damage, 0),
+                                       self.max_hp)
+            self.shield[side] += SPELL_SHIELD[codes]
+            self._pull(side, counts)
+            self.no_cast[side] = np.where(
+                active, np.where(counts > 0, 0, self.no_cast[side] + 1),
+                self.no_cast[side])
+            self.cast_counts[side] += np.bincount(counts[active], minlength=4)[:4]
+
+            # Discard - 5 CPU, spent even if the index is out of range
+            index = np.asarray(policy.choose_discard(self, side), dtype=np.int64)
+            pay = active & (index >= 0) & (self.cpu[side] >= 5)
+            self.cpu[side] -= pay * 5
+            valid = pay & (index < self.buf_len[side])
+            self._discard(side, np.where(valid, index, -1))
+
+        self._defenses_installed = True
+
+    def end_turn(self):
+        """GameState.check_victory for every match, then advance the turn"""
+        active = self.active
+        player_dead = self.hp[0] <= 0
+        enemy_dead = self.hp[1] <= 0
+        player_starved = self.no_cast[0] >= 5
+        enemy_starved = self.no_cast[1] >= 5
+
+        winner = np.select(
+            [player_dead, enemy_dead, player_starved, enemy_starved],
+            [1, 0, 1, 0], default=-1)
+        reason = np.select(
+            [player_dead | enemy_dead, player_starved | enemy_starved],
+            [REASON_HP, REASON_STARVATION], default=REASON_NONE)
+
+        self.winner = np.where(active, winner, self.winner)
+        self.reason = np.where(active, reason, self.reason)
+        self.turn += active & (self.winner < 0)
+
+    def step(self, magic: Optional[np.ndarray] = None,
+             from_enemy: Optional[np.ndarray] = None):
+        """Play one full turn in every unfinished match"""
+        self.incoming_phase(magic, from_enemy)
+        self.action_phase()
+        self.end_turn()
+
+    def run(self, max_turns: int = 100) -> dict:
+        """Play until every match ends or hits max_turns"""
+        while self.active.any() and self.turn.min() <= max_turns:
+            self.step()
+        return self.results()
+
+    def results(self) -> dict:
+        """Aggregate outcome of all matches"""
+        finished = ~self.active
+        return {
+            'matches': self.n,
+            'player_wins': int((self.winner == 0).sum()),
+            'enemy_wins': int((self.winner == 1).sum()),
+            'unfinished': int(self.active.sum()),
+            'avg_turns': float(self.turn[finished].mean()) if finished.any() else 0.0,
+            'starvation_rate': float((self.reason == REASON_STARVATION).mean()),
+            'cast_counts': self.cast_counts.tolist(),
+        }
+
+
+if __name__ == "__main__":
+    import time
+
+    print("=== Vectorized Duel Engine Test ===\n")
+
+    for n in (1000, 10000):
+        engine = VectorizedDuelEngine(
+            n, (create_policy(3), create_policy(4)), seed=42)
+        start = time.perf_counter()
+        results = engine.run()
+        elapsed = time.perf_counter() - start
+        print(f"{n} matches Battle Mage vs Adept Mage in {elapsed:.2f}s")
+        print(f"  Player wins: {results['player_wins']}, "
+              f"Enemy wins: {results['enemy_wins']}, "
+              f"Avg turns: {results['avg_turns']:.1f}\n")
+
+    print("✓ Vectorized engine working!")